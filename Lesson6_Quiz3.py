@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 import xml.etree.cElementTree as ET
 import pprint
-import re
+
+import tag_keys
 """
 Your task is to explore the data a bit more.
 Before you process the data and add it into MongoDB, you should
@@ -18,23 +19,15 @@ Please complete the function 'key_type'.
 """
 
 
-lower = re.compile(r'^([a-z]|_)*$')
-lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
-problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+# The regular expressions are in tag_keys.py, which shape_element uses to classify keys too
 
 
 def key_type(element, keys):
     if element.tag == "tag":
         # YOUR CODE HERE
-        # Match value of street to regex patterns
-        if(re.search(lower, element.attrib['k'])):
-            keys['lower'] += 1
-        elif(re.search(lower_colon, element.attrib['k'])):
-            keys['lower_colon'] += 1
-        elif(re.search(problemchars, element.attrib['k'])):
-            keys['problemchars'] += 1
-        else:
-            keys['other'] += 1
+        # Match value of key to regex patterns, using the classification cache shared with shape_element
+        category, _, _ = tag_keys.classify_key(element.attrib['k'])
+        keys[category] += 1
     return keys
 
 
@@ -95,7 +95,7 @@ CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
 
 def shape_element(element):
     node = {}
-    if element.tag == "node" or element.tag == "way" :
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
         # YOUR CODE HERE
         # Process element attributes 
         node['type'] = element.tag
@@ -147,6 +147,15 @@ def shape_element(element):
                     node['node_refs'] = []
                 # Add id to list
                 node['node_refs'].append(tag.attrib['ref'])
+            # Check if tag is a <member>
+            if tag.tag == 'member':
+                # Create list for members if doesn't already exist
+                if 'members' not in node:
+                    node['members'] = []
+                # Add member with its type, ref and role
+                node['members'].append({'type': tag.attrib.get('type'),
+                                        'ref': tag.attrib.get('ref'),
+                                        'role': tag.attrib.get('role', '')})
             
         # pprint.pprint(node)
         
@@ -170,6 +179,39 @@ def process_map(file_in, pretty = False):
                     fo.write(json.dumps(el) + "\n")
     return data
 
+
+def iter_shaped_elements(file_in):
+    # Yields shaped elements one at a time, clearing each finished top level
+    # element (and its earlier siblings) from the root to keep memory flat
+    context = ET.iterparse(file_in, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == "start":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                el = shape_element(element)
+                if el:
+                    yield el
+                root.clear()
+
+
+def stream_map(file_in, pretty = False):
+    # Same output as process_map, but records are written as they are shaped
+    # instead of being collected in a list. Returns the number of records written.
+    file_out = "{0}.json".format(file_in)
+    count = 0
+    with codecs.open(file_out, "w") as fo:
+        for el in iter_shaped_elements(file_in):
+            if pretty:
+                fo.write(json.dumps(el, indent=2)+"\n")
+            else:
+                fo.write(json.dumps(el) + "\n")
+            count += 1
+    return count
+
 def test():
     # NOTE: if you are running this code on your computer, with a larger dataset, 
     # call the process_map procedure with pretty=False. The pretty=True option adds 
@@ -191,12 +233,17 @@ def test():
         }
     }
     assert data[0] == correct_first_elem
-    assert data[-1]["address"] == {
+    # Relations come after the ways in the file, so check the last way
+    ways = [el for el in data if el["type"] == "way"]
+    assert ways[-1]["address"] == {
                                     "street": "West Lexington St.", 
                                     "housenumber": "1412"
                                       }
-    assert data[-1]["node_refs"] == [ "2199822281", "2199822390",  "2199822392", "2199822369", 
+    assert ways[-1]["node_refs"] == [ "2199822281", "2199822390",  "2199822392", "2199822369", 
                                     "2199822370", "2199822284", "2199822281"]
+    for el in data:
+        if el["type"] == "relation":
+            assert all(set(member) == set(["type", "ref", "role"]) for member in el.get("members", []))
 
 if __name__ == "__main__":
     test()
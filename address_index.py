@@ -0,0 +1,150 @@
+import json
+import re
+import os
+import bisect
+import cPickle as pickle
+from array import array
+import time
+import pprint
+
+# Address fields that are indexed
+ADDRESS_FIELDS = ["street", "postcode", "city", "housenumber"]
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+OFFSET_TYPECODE = 'l'
+# Bump when the layout of the saved index changes
+INDEX_VERSION = 1
+
+# Files
+json_file = './vancouver.osm/vancouver_sample.osm.json'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+
+# Index of address field values to the byte offsets of the records that use them in a JSON-lines file
+# For each field, values holds the sorted distinct values and offsets holds an array of offsets for each value
+class AddressIndex(object):
+    def __init__(self, filename, fields, source):
+        self.filename = filename
+        self.fields = fields
+        # Size and modification time of the JSON file when the index was built
+        self.source = source
+        self.values = {}
+        self.offsets = {}
+
+    # Builds the index in a single pass over the JSON file
+    @classmethod
+    def build(cls, filename, fields = ADDRESS_FIELDS):
+        index = cls(filename, fields, source_stamp(filename))
+        data = dict([(field, {}) for field in fields])
+        offset = 0
+        with open(filename, "rb") as f:
+            for line in f:
+                # Cheap check before paying for json.loads
+                if '"address"' in line:
+                    record = json.loads(line)
+                    if 'address' in record:
+                        for field in fields:
+                            if field in record['address']:
+                                value = record['address'][field]
+                                if value not in data[field]:
+                                    data[field][value] = array(OFFSET_TYPECODE)
+                                data[field][value].append(offset)
+                offset += len(line)
+        for field in fields:
+            index.values[field] = sorted(data[field])
+            index.offsets[field] = [data[field][v] for v in index.values[field]]
+        return index
+
+    # Offsets of the records whose field equals value
+    def exact_offsets(self, field, value):
+        values = self.values[field]
+        i = bisect.bisect_left(values, value)
+        if i < len(values) and values[i] == value:
+            return list(self.offsets[field][i])
+        return []
+
+    # Offsets of the records whose field starts with prefix
+    def prefix_offsets(self, field, prefix):
+        values = self.values[field]
+        data = []
+        i = bisect.bisect_left(values, prefix)
+        while i < len(values) and values[i].startswith(prefix):
+            data.extend(self.offsets[field][i])
+            i += 1
+        return sorted(data)
+
+    # Offsets of the records whose field matches a regex, testing each distinct value once
+    def regex_offsets(self, field, pattern):
+        match_value = re.compile(pattern)
+        data = []
+        for i, value in enumerate(self.values[field]):
+            if match_value.search(value):
+                data.extend(self.offsets[field][i])
+        return sorted(data)
+
+    # Reads the records at the given offsets
+    def records(self, offsets):
+        data = []
+        with open(self.filename, "rb") as f:
+            for offset in offsets:
+                f.seek(offset)
+                data.append(json.loads(f.readline()))
+        return data
+
+    def exact(self, field, value):
+        return self.records(self.exact_offsets(field, value))
+
+    def prefix(self, field, prefix):
+        return self.records(self.prefix_offsets(field, prefix))
+
+    def regex(self, field, pattern):
+        return self.records(self.regex_offsets(field, pattern))
+
+    def save(self, index_file = None):
+        if index_file is None:
+            index_file = index_filename(self.filename)
+        with open(index_file, "wb") as f:
+            pickle.dump((INDEX_VERSION, self.fields, self.source, self.values, self.offsets), f, pickle.HIGHEST_PROTOCOL)
+
+    # Loads a saved index, or returns None if it is missing or out of date
+    @classmethod
+    def load(cls, filename, index_file = None):
+        if index_file is None:
+            index_file = index_filename(filename)
+        if not os.path.exists(index_file):
+            return None
+        with open(index_file, "rb") as f:
+            version, fields, source, values, offsets = pickle.load(f)
+        if version != INDEX_VERSION or source != source_stamp(filename):
+            return None
+        index = cls(filename, fields, source)
+        index.values = values
+        index.offsets = offsets
+        return index
+
+# Name of the index file kept next to the JSON file
+def index_filename(filename):
+    return filename + ".addr.idx"
+
+# Identifies the version of a JSON file, so that an index built from an older file is not used
+def source_stamp(filename):
+    st = os.stat(filename)
+    return (st.st_size, int(st.st_mtime))
+
+# Returns the address index for a JSON file, building and saving it if there isn't an up to date one
+def get_address_index(filename, fields = ADDRESS_FIELDS):
+    index = AddressIndex.load(filename)
+    if index is None or not set(fields).issubset(index.fields):
+        index = AddressIndex.build(filename, fields)
+        index.save()
+    return index
+
+def main():
+    start = time.time()
+    index = get_address_index(clean_json_file_full)
+    print("Index ready in {0:.2f}s".format(time.time() - start))
+    start = time.time()
+    records = index.regex('street', r'(Wynd)')
+    print("Regex lookup returned {0} records in {1:.1f}ms".format(len(records), (time.time() - start) * 1000))
+    pprint.pprint(index.exact('postcode', 'V6B 1A1'))
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,25 @@
 import xml.etree.cElementTree as ET
+import xml.parsers.expat as expat
 import pprint
 import re
-import codecs
 import json
+import io
+import os
+import multiprocessing
+
+import address_index
+import tag_keys
+import records
+import string_table
+import json_codec
+import compressed_io
+import record_index
+import columnar
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 '''
 Example: JSON output
@@ -30,10 +47,10 @@ Example: JSON output
 '''
 
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
-EXPECTED_STREET_NAMES = ["Avenue", "Boulevard", "Centre", "Close", "Court", "Crescent", "Diversion", "Drive", "East",
-                         "Forest", "Gate", "Grove", "Highway", "Kingsway", "Lane", "Mall", "Mews", "North", "Parkway",
-                         "Place", "Road", "South", "Street", "Terrace", "Trail", "Way", "West", "Wynd", "Broadway",
-                         "Tsawwassen", "Walk", "Park", "Alley"]
+EXPECTED_STREET_NAMES = set(["Avenue", "Boulevard", "Centre", "Close", "Court", "Crescent", "Diversion", "Drive", "East",
+                             "Forest", "Gate", "Grove", "Highway", "Kingsway", "Lane", "Mall", "Mews", "North", "Parkway",
+                             "Place", "Road", "South", "Street", "Terrace", "Trail", "Way", "West", "Wynd", "Broadway",
+                             "Tsawwassen", "Walk", "Park", "Alley"])
 
 # Files
 osm_file = './vancouver.osm/vancouver_sample.osm'
@@ -53,128 +70,732 @@ lower_first = re.compile(r'^([a-z])')
 street_ending = re.compile(r'(\S)+$')
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 contains_numbers = re.compile(r'([0-9]+)')
+top_level_element = re.compile(r'<(node|way|relation)[\s/>]')
+
+# Parallel conversion settings
+CHUNK_SIZE = 32 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+TOP_LEVEL_TAGS = ("node", "way", "relation")
 
 # Shape OSM data into desired data model in JSON
 def shape_element(element):
-    node = {}
-    if element.tag == "node" or element.tag == "way" :
-        # Process element attributes 
-        node['type'] = element.tag
-        if 'id' in element.attrib:
-            node['id'] = element.attrib['id']
-        if 'visible' in element.attrib:
-            node['visible'] = element.attrib['visible']
-        if ('lat' in element.attrib) & ('lon' in element.attrib):
-            node['pos'] = [float(element.attrib['lat']), float(element.attrib['lon'])]
-        # Process created attributes
-        node['created'] = {}
-        for c in CREATED:
-            if c in element.attrib:
-                node['created'][c] = element.attrib[c]
+    if element.tag == "node" or element.tag == "way" or element.tag == "relation":
+        # Process element attributes
+        node = shape_attributes(element.tag, element.attrib)
         # Process tags
         for tag in element.iter():
             # Check if tag is a <tag>
             if tag.tag == 'tag':
-                # Check for problematic characters
-                m1 = problemchars.search(tag.attrib['k'])
-                if not m1:
-                    # Check if contains proper colon structure
-                    m2 = lower_colon.search(tag.attrib['k'])
-                    if m2:
-                        matched = m2.group(0)
-                        # Split matched by colon
-                        matched_split = matched.split(':')
-                        # Check if address tag
-                        if(matched_split[0] == 'addr'):
-                            # Check if address dictionary already created in node
-                            if 'address' not in node:
-                                node['address'] = {}
-                            # Address tag to address dictionary
-                            node['address'][matched_split[1]] = tag.attrib['v']
-                        else: 
-                            # Add as normal tag
-                            node[matched] = tag.attrib['v']
-                    else:
-                        # Check if contains a proper lowercase structure
-                        m3 = lower.search(tag.attrib['k'])
-                        if m3:
-                            matched = m3.group(0)
-                            # Check if the key is "type".  If so, rename the key so that it doesn't overwrite our node['type'] value.
-                            if(matched != "type"):
-                                # Add as normal tag
-                                node[matched] = tag.attrib['v']
-                            else:
-                                node[matched+"_tag"] = tag.attrib['v']
+                add_tag(node, tag.attrib['k'], tag.attrib['v'])
             # Check if tag is a <nd>
             if tag.tag == 'nd':
-                # Create list for node_refs if doesn't already exist
-                if 'node_refs' not in node:
-                    node['node_refs'] = []
-                # Add id to list
-                node['node_refs'].append(tag.attrib['ref'])
-            
-        # pprint.pprint(node)
-        
+                add_node_ref(node, tag.attrib['ref'])
+            # Check if tag is a <member>
+            if tag.tag == 'member':
+                add_member(node, tag.attrib)
         return node
     else:
         return None
 
+# Starts the data model for a node, way or relation from its attributes
+# Shared by shape_element and the expat parser, which has no Element objects to work from
+def shape_attributes(tag, attrib):
+    node = {}
+    node['type'] = tag
+    if 'id' in attrib:
+        node['id'] = attrib['id']
+    if 'visible' in attrib:
+        node['visible'] = attrib['visible']
+    if ('lat' in attrib) & ('lon' in attrib):
+        node['pos'] = [float(attrib['lat']), float(attrib['lon'])]
+    # Process created attributes
+    node['created'] = {}
+    for c in CREATED:
+        if c in attrib:
+            node['created'][c] = attrib[c]
+    return node
+
+# Adds the key/value of a <tag> to the data model
+# Keys are classified once each by tag_keys.classify_key, since files use the same few thousand keys throughout
+def add_tag(node, k, v):
+    _, action, name = tag_keys.classify_key(k)
+    if action == tag_keys.ADDRESS:
+        # Check if address dictionary already created in node
+        if 'address' not in node:
+            node['address'] = {}
+        # Address tag to address dictionary
+        node['address'][name] = v
+    elif action != tag_keys.DROP:
+        # Add as normal tag, or renamed if the key is "type"
+        node[name] = v
+
+# Adds the ref of a <nd> to the data model
+def add_node_ref(node, ref):
+    # Create list for node_refs if doesn't already exist
+    if 'node_refs' not in node:
+        node['node_refs'] = []
+    # Add id to list
+    node['node_refs'].append(ref)
+
+# Adds a relation <member> to the data model as {type, ref, role}
+def add_member(node, attrib):
+    if 'members' not in node:
+        node['members'] = []
+    node['members'].append({'type': attrib.get('type'), 'ref': attrib.get('ref'), 'role': attrib.get('role', '')})
+
 # Iteratively parses OSM file, uses shape_element function to get data model and writes it to a JSON file
-def process_map(file_in, pretty = False):
+# With columnar=True the records are also written in the columnar format (see columnar.py)
+# With compact=True the records returned are records.ElementRecord objects, which take much less memory than
+# dictionaries.  The JSON file is the same either way.
+# The records returned are interned in a string_table.StringTable made for this call, so equal users, streets,
+# cities and so on share one object.  The columnar writer stores its codes in the same table and exports it.
+# Compressed input and output are read and written as streams (see compressed_io.py)
+def process_map(file_in, pretty = False, columnar = False, compact = False, file_out = None):
     # You do not need to change this file
-    file_out = "{0}.json".format(file_in)
+    if file_out is None:
+        file_out = json_filename(file_in)
+    strings = string_table.StringTable()
+    writer = columnar_writer(file_out, columnar, strings)
     data = []
-    with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in):
+    with compressed_io.open_input(file_in) as fi, json_codec.open_output(file_out) as fo, \
+            json_codec.RecordWriter(fo, pretty) as lines:
+        for _, element in ET.iterparse(fi):
             el = shape_element(element)
             if el:
-                data.append(el)
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
+                el = strings.intern_record(el)
+                data.append(records.ElementRecord.from_dict(el) if compact else el)
+                if writer is not None:
+                    writer.add(el)
+                lines.write(el)
+    if writer is not None:
+        writer.close()
     return data
 
+# Name of the JSON file made from an OSM file, compressed the same way as the OSM file
+def json_filename(file_in):
+    name, ext = compressed_io.split_compression(file_in)
+    return "{0}.json{1}".format(name, ext)
+
+# Columnar writer for a JSON output file, or None if columnar output isn't wanted
+# strings is the string table of the run, or None for the writer to make its own
+def columnar_writer(file_out, enabled, strings = None):
+    if not enabled:
+        return None
+    return columnar.ColumnarWriter(columnar.columnar_filename(file_out), strings)
+
+# Iteratively parses OSM file and yields shaped elements one at a time
+# parser picks the XML backend from PARSERS: 'etree' (default), 'expat' or 'lxml'
+# Compressed files are decompressed as they are parsed
+def iter_shaped_elements(file_in, parser = 'etree'):
+    if isinstance(file_in, basestring):
+        compressed_io.check_supported(file_in)
+        if compressed_io.is_compressed(file_in):
+            return iter_compressed_elements(file_in, parser)
+    return PARSERS[parser](file_in)
+
+def iter_compressed_elements(file_in, parser):
+    with compressed_io.open_input(file_in) as f:
+        for el in PARSERS[parser](f):
+            yield el
+
+# ElementTree backend for iter_shaped_elements
+# Each top level element (node, way, relation, ...) is cleared from the root once it has been shaped,
+# so memory stays flat no matter how large the input file is
+def iter_etree_elements(file_in):
+    context = ET.iterparse(file_in, events=("start", "end"))
+    # First event is the start of the root <osm> element
+    _, root = next(context)
+    depth = 0
+    for event, element in context:
+        if event == "start":
+            depth += 1
+        else:
+            depth -= 1
+            # Only shape once a direct child of the root is complete, so its <tag> and <nd> children are available
+            if depth == 0:
+                el = shape_element(element)
+                if el:
+                    yield el
+                # Clear finished element and its earlier siblings out of memory
+                root.clear()
+
+# lxml backend for iter_shaped_elements
+# lxml elements work with shape_element as they are, and lxml can skip events for anything but top level elements
+def iter_lxml_elements(file_in):
+    if lxml_etree is None:
+        raise ImportError("lxml is required for the 'lxml' parser")
+    for _, element in lxml_etree.iterparse(file_in, tag=TOP_LEVEL_TAGS):
+        el = shape_element(element)
+        if el:
+            yield el
+        # Clear finished element and its earlier siblings out of memory
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+# Builds the data model straight from expat start/end events, without creating Element objects
+class ExpatShaper(object):
+    def __init__(self):
+        # The root <osm> element is depth 1, top level elements are depth 2
+        self.depth = 0
+        self.node = None
+        self.records = []
+
+    def start_element(self, name, attrs):
+        self.depth += 1
+        if self.depth == 2:
+            if name == "node" or name == "way" or name == "relation":
+                self.node = shape_attributes(name, attrs)
+        elif self.node is not None:
+            if name == 'tag':
+                add_tag(self.node, attrs['k'], attrs['v'])
+            elif name == 'nd':
+                add_node_ref(self.node, attrs['ref'])
+            elif name == 'member':
+                add_member(self.node, attrs)
+
+    def end_element(self, name):
+        if self.depth == 2 and self.node is not None:
+            self.records.append(self.node)
+            self.node = None
+        self.depth -= 1
+
+# expat backend for iter_shaped_elements
+def iter_expat_elements(file_in):
+    shaper = ExpatShaper()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = shaper.start_element
+    parser.EndElementHandler = shaper.end_element
+    # Accept an open file as well as a file name, like iterparse does
+    if hasattr(file_in, 'read'):
+        f = file_in
+    else:
+        f = open(file_in, "rb")
+    try:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            parser.Parse(block, not block)
+            for el in shaper.records:
+                yield el
+            del shaper.records[:]
+            if not block:
+                break
+    finally:
+        if f is not file_in:
+            f.close()
+
+# XML backends available to iter_shaped_elements
+PARSERS = {'etree': iter_etree_elements, 'expat': iter_expat_elements, 'lxml': iter_lxml_elements}
+
+# Streaming version of process_map that writes each shaped element to the JSON file without collecting them
+# Returns the number of records written
+def stream_map(file_in, pretty = False, parser = 'etree', columnar = False, file_out = None):
+    compressed_io.check_supported(file_in)
+    if file_out is None:
+        file_out = json_filename(file_in)
+    writer = columnar_writer(file_out, columnar)
+    count = 0
+    with json_codec.open_output(file_out) as fo, json_codec.RecordWriter(fo, pretty) as lines:
+        for el in iter_shaped_elements(file_in, parser):
+            if writer is not None:
+                writer.add(el)
+            lines.write(el)
+            count += 1
+    if writer is not None:
+        writer.close()
+    return count
+
+# Finds the byte offset of the first top level <node, <way or <relation at or after offset
+# Returns None if there are no more top level elements in the file
+def find_element_start(f, offset, block_size = BLOCK_SIZE):
+    f.seek(offset)
+    base = offset
+    tail = ''
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return None
+        buf = tail + block
+        m = top_level_element.search(buf)
+        if m:
+            return base - len(tail) + m.start()
+        # Keep the end of the buffer in case a tag name is split across blocks
+        tail = buf[-16:]
+        base += len(block)
+
+# Splits an OSM file into byte ranges that each start on a top level element boundary
+# Returns the XML prolog (everything before the root <osm> element) and a list of (start, end) ranges
+def split_osm_file(file_in, chunks):
+    if compressed_io.is_compressed(file_in):
+        raise ValueError("Chunks are found by seeking, which needs an uncompressed file: {0}".format(file_in))
+    size = os.path.getsize(file_in)
+    with open(file_in, "rb") as f:
+        # Keep the XML declaration so each chunk is decoded with the same encoding
+        head = f.read(BLOCK_SIZE)
+        prolog = head[:max(0, head.find('<osm'))]
+        first = find_element_start(f, 0)
+        if first is None:
+            return prolog, []
+        # Top level elements end where the closing root tag starts
+        f.seek(max(0, size - BLOCK_SIZE))
+        end = f.tell()
+        tail = f.read()
+        end += tail.rfind('</osm>')
+        starts = [first]
+        for i in range(1, chunks):
+            start = find_element_start(f, first + (end - first) * i // chunks)
+            if start is not None and starts[-1] < start < end:
+                starts.append(start)
+    return prolog, zip(starts, starts[1:] + [end])
+
+# Shapes all elements within a byte range of an OSM file and returns them as JSON lines
+# Runs in a worker process, so arguments are passed as a single tuple
+def shape_chunk(args):
+    file_in, prolog, start, end, pretty, parser = args
+    with open(file_in, "rb") as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    lines = []
+    for el in iter_shaped_elements(io.BytesIO(prolog + '<osm>' + chunk + '</osm>'), parser):
+        lines.append(json_codec.dumps_line(el, pretty))
+    return ''.join(lines), len(lines)
+
+# Parallel version of stream_map that shapes chunks of the OSM file in a process pool
+# Chunks are written back in their original order, so the output is identical to process_map
+# Returns the number of records written
+def process_map_parallel(file_in, pretty = False, workers = None, chunk_size = CHUNK_SIZE, parser = 'etree'):
+    file_out = "{0}.json".format(file_in)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    # Use a few chunks per worker so that uneven chunks don't leave workers idle
+    chunks = max(workers * 4, os.path.getsize(file_in) // chunk_size)
+    prolog, ranges = split_osm_file(file_in, chunks)
+    tasks = [(file_in, prolog, start, end, pretty, parser) for start, end in ranges]
+    count = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        with json_codec.open_output(file_out) as fo:
+            for text, n in pool.imap(shape_chunk, tasks):
+                fo.write(text)
+                count += n
+    finally:
+        pool.close()
+        pool.join()
+    return count
+
 # Gets a dictionary of tags in the OSM and how many instances of the tag is used in the file
-def audit_xml(filename):
+def audit_xml(filename, parser = 'etree'):
+    if parser == 'expat':
+        return audit_xml_expat(filename)
     data = {}
     # Loop through data using iterative parser
-    for event, elem in ET.iterparse(filename):
+    with compressed_io.open_input(filename) as f:
+        for event, elem in ET.iterparse(f):
+            # Check if tag is already a key in dictionary
+            if elem.tag in data:
+                data[elem.tag]['count'] += 1
+            else:
+                data[elem.tag] = {'count':1, 'attributes':set()}
+            # Capture unique attributes
+            for k,v in elem.attrib.iteritems():
+                data[elem.tag]['attributes'].add(k)
+            # Clear element out of memory
+            elem.clear()
+    return data
+
+# expat version of audit_xml, which counts tags from start events without building Element objects
+def audit_xml_expat(filename):
+    data = {}
+    def start_element(name, attrs):
         # Check if tag is already a key in dictionary
-        if elem.tag in data:
-            data[elem.tag]['count'] += 1
+        if name in data:
+            data[name]['count'] += 1
         else:
-            data[elem.tag] = {'count':1, 'attributes':set()}
+            data[name] = {'count':1, 'attributes':set()}
         # Capture unique attributes
-        for k,v in elem.attrib.iteritems():
-            data[elem.tag]['attributes'].add(k)
-        # Clear element out of memory
-        elem.clear()
+        data[name]['attributes'].update(attrs)
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    with compressed_io.open_input(filename) as f:
+        parser.ParseFile(f)
     return data
 
+# Base class for an audit that can run alongside other audits in a single pass over a JSON file
+# process() is called once per record and finalize() returns the result once the file has been read
+class AuditRule(object):
+    name = None
+
+    def process(self, record):
+        pass
+
+    def finalize(self):
+        return None
+
+# Reads a JSON file once and runs every rule on each record
+# Rules keep values and whole records in their results, so the records are interned in a string table for the run
+# Returns a dictionary of results keyed by rule name
+def run_audits(filename, rules):
+    strings = string_table.StringTable()
+    with compressed_io.open_input(filename) as f:
+        return audit_records((strings.intern_record(json_codec.loads(line)) for line in f), rules)
+
+# Runs every rule on records that are already loaded, such as the records process_map returns
+def audit_records(records, rules):
+    for record in records:
+        for rule in rules:
+            rule.process(record)
+    return dict((rule.name, rule.finalize()) for rule in rules)
+
+# Helper rule for experimenting
+class ExperimentsRule(AuditRule):
+    name = 'experiments'
+
+    def process(self, record):
+        if "address" in record:
+            if "street" not in record['address']:
+                if record['type'] == 'way':
+                    pprint.pprint(record['address'])
+
+# Get a list of all keys used in json data model
+class JsonKeysRule(AuditRule):
+    name = 'json_keys'
+
+    def __init__(self):
+        self.data = set()
+
+    def process(self, record):
+        for key in record.keys():
+            self.data.add(key)
+
+    def finalize(self):
+        return self.data
+
+# Provides an audit of the created_by field
+class CreatedByRule(AuditRule):
+    name = 'created_by'
+
+    def __init__(self):
+        self.counter = 0
+        self.total = 0
+        self.values = set()
+        self.types = set()
+
+    def process(self, record):
+        # Count total
+        self.total += 1
+        if 'created_by' in record:
+            # Increment counter
+            self.counter += 1
+            # Record details
+            self.values.add(record['created_by'])
+            self.types.add(record['type'])
+
+    def finalize(self):
+        # Shape data
+        data = {}
+        data[self.counter] = self.values
+        data['total'] = self.total
+        data['types'] = self.types
+        return data
+
+# Provides an audit of other fields and checks for empty values
+class OtherFieldsUnexpectedRule(AuditRule):
+    name = 'other_fields_unexpected'
+
+    def __init__(self):
+        self.count = 0
+        self.cases = []
+
+    def process(self, record):
+        for key in record.keys():
+            # Check for empty value
+            if((record[key] == '') | (record[key] == 'NULL') | (record[key] == None)):
+                self.count += 1
+                self.cases.append(record)
+
+    def finalize(self):
+        # Shape data
+        return {'count': self.count, 'cases': self.cases}
+
+# Provides an audit of the address fields
+class AddressRule(AuditRule):
+    name = 'address'
+
+    def __init__(self):
+        self.counter = 0
+        self.total = 0
+        self.attributes = set()
+        self.cities = set()
+        self.cities_counter = 0
+        self.countries = set()
+        self.countries_counter = 0
+        self.pcode = set()
+        self.pcode_counter = 0
+        # Postcodes and streets already checked, so each distinct value is only matched once
+        self.pcode_checked = set()
+        self.provinces = set()
+        self.provinces_counter = 0
+        self.states = set()
+        self.states_counter = 0
+        # address.street field
+        self.streets = set()
+        self.streets_counter = 0
+        self.streets_checked = set()
+        # address.unit field
+        self.units = set()
+        self.units_counter = 0
+        # address.housename field
+        self.housenames = set()
+        self.housenames_counter = 0
+        # address.housenumber field
+        self.housenumbers = set()
+        self.housenumbers_counter = 0
+
+    def process(self, record):
+        # Count total
+        self.total += 1
+        if 'address' in record:
+            address = record['address']
+            # Increment counter
+            self.counter += 1
+            # Record different attributes
+            for key in address.keys():
+                self.attributes.add(key)
+            # Display details about cities
+            if 'city' in address:
+                self.cities_counter += 1
+                self.cities.add(address['city'])
+            # Display details about countries
+            if 'country' in address:
+                self.countries_counter += 1
+                self.countries.add(address['country'])
+            # Display details about postcode
+            if 'postcode' in address:
+                self.pcode_counter += 1
+                postcode = address['postcode']
+                if postcode not in self.pcode_checked:
+                    self.pcode_checked.add(postcode)
+                    # Record postal codes that are not expected
+                    m = pcode_match.search(postcode)
+                    if not m:
+                        self.pcode.add(postcode)
+            # Display details about province
+            if 'province' in address:
+                self.provinces_counter += 1
+                self.provinces.add(address['province'])
+            # Display details about state
+            if 'state' in address:
+                self.states_counter += 1
+                self.states.add(address['state'])
+            # Display details about street ending variations
+            if 'street' in address:
+                self.streets_counter += 1
+                street = address['street']
+                if street not in self.streets_checked:
+                    self.streets_checked.add(street)
+                    m = street_ending.search(street)
+                    if m:
+                        ending = m.group()
+                        self.streets.add(ending)
+            # Display details about unit
+            if 'unit' in address:
+                self.units_counter += 1
+                self.units.add(address['unit'])
+            # Display details about housename
+            if 'housename' in address:
+                self.housenames_counter += 1
+                self.housenames.add(address['housename'])
+            # Display details about housenumber
+            if 'housenumber' in address:
+                self.housenumbers_counter += 1
+                self.housenumbers.add(address['housenumber'])
+
+    def finalize(self):
+        # Shape data
+        data = {}
+        data['counter'] = self.counter
+        data['total'] = self.total
+        data['attributes'] = self.attributes
+        data['cities'] = {'count':self.cities_counter, 'uniques':self.cities}
+        data['countries'] = {'count':self.countries_counter, 'uniques':self.countries}
+        data['postcodes'] = {'count':self.pcode_counter, 'unexpected':self.pcode}
+        data['provinces'] = {'count':self.provinces_counter, 'uniques':self.provinces}
+        data['states'] = {'count':self.states_counter, 'uniques':self.states}
+        data['streets'] = {'count':self.streets_counter, 'uniques':self.streets}
+        data['units'] = {'count':self.units_counter, 'uniques':self.units}
+        data['housenames'] = {'count':self.housenames_counter, 'uniques':self.housenames}
+        data['housenumbers'] = {'count':self.housenumbers_counter, 'uniques':self.housenumbers}
+        return data
+
+# Displays unexpected records in the address fields
+class AddressUnexpectedRule(AuditRule):
+    name = 'address_unexpected'
+
+    def __init__(self):
+        # General variables
+        self.counter = 0
+        self.total = 0
+        self.attributes = set()
+        # address.city field
+        self.cities = set()
+        self.cities_counter = 0
+        # address.country field
+        self.countries = set()
+        self.countries_counter = 0
+        # address.postcode field
+        self.pcode = set()
+        self.pcode_counter = 0
+        # address.province field
+        self.provinces = set()
+        self.provinces_counter = 0
+        # address.state field
+        self.states = set()
+        self.states_counter = 0
+        # address.street field
+        self.streets = set()
+        self.streets_counter = 0
+        # address.unit field
+        self.units = set()
+        self.units_counter = 0
+        # address.housename field
+        self.housenames = []
+        self.housenames_counter = 0
+        # address.housenumber field
+        self.housenumbers = set()
+        self.housenumbers_counter = 0
+
+    def process(self, record):
+        # Count total
+        self.total += 1
+        if 'address' in record:
+            address = record['address']
+            # Record how many records have addresses
+            self.counter += 1
+            # Record attributes found in address field
+            for key in address.keys():
+                self.attributes.add(key)
+            # Display details about cities
+            if 'city' in address:
+                # Capture cities that have a comma-separated, therefore could be including a province
+                if ',' in address['city']:
+                    self.cities.add(address['city'])
+                    self.cities_counter += 1
+                # Capture cities that are lowercase
+                m = lower.search(address['city'])
+                if m:
+                    self.cities.add(address['city'])
+                    self.cities_counter += 1
+            # Display details about countries
+            if 'country' in address:
+                # Capture countries that do not have a country field 'Canada'
+                if(address['country'] != 'Canada'):
+                    self.countries_counter += 1
+                    self.countries.add(address['country'])
+            else:
+                # Capture records that do not have a country field
+                self.countries_counter += 1
+                self.countries.add('')
+            # Display details about postcode
+            if 'postcode' in address:
+                # Record postal codes that are not expected
+                m = pcode_match.search(address['postcode'])
+                if not m:
+                    self.pcode.add(address['postcode'])
+                    self.pcode_counter += 1
+            # Display details about province
+            if 'province' in address:
+                # Capture records where province is not 'British Columbia'
+                if(address['province'] != 'British Columbia'):
+                    self.provinces_counter += 1
+                    self.provinces.add(address['province'])
+            else:
+                # Capture records that do not have a province field
+                self.provinces_counter += 1
+                self.provinces.add('')
+            # Display details about state
+            if 'state' in address:
+                # Capture records where state is used instead of province
+                self.states_counter += 1
+                self.states.add(address['state'])
+            # Display details about street
+            if 'street' in address:
+                # Capture record if street is not capitalized
+                m = lower_first.search(address['street'])
+                if m:
+                    self.streets_counter += 1
+                    self.streets.add(address['street'])
+                # Capture record if street ending does not match expected
+                m = street_type_re.search(address['street'])
+                if m:
+                    ending = m.group()
+                    if ending not in EXPECTED_STREET_NAMES:
+                        self.streets_counter += 1
+                        self.streets.add(address['street'])
+            # Display details about unit
+            if 'unit' in address:
+                # Capture record if "Suite" or "suite" is included in the unit number
+                if "suite" in address['unit'].lower():
+                    self.units_counter += 1
+                    self.units.add(address['unit'])
+            # Display details about housename
+            if 'housename' in address:
+                # Capture record if it contains numbers (could be misused instead of address.housenumber)
+                m = contains_numbers.search(address['housename'])
+                if m:
+                    self.housenames_counter += 1
+                    self.housenames.append(address)
+            # Display details about housenumber
+            if 'housenumber' in address:
+                # Capture record if housenumber has unexpected characters
+                try:
+                    address['housenumber'].decode()
+                except UnicodeEncodeError:
+                    self.housenumbers_counter += 1
+                    self.housenumbers.add(address['housenumber'])
+                # Capture record if housenumber is not a number
+                m = numbers.search(address['housenumber'])
+                if not m:
+                    self.housenumbers_counter += 1
+                    self.housenumbers.add(address['housenumber'])
+
+    def finalize(self):
+        # Shape data
+        data = {}
+        data['counter'] = self.counter
+        data['total'] = self.total
+        data['attributes'] = self.attributes
+        data['cities'] = {'count':self.cities_counter, 'unexpected':self.cities}
+        data['countries'] = {'count':self.countries_counter, 'unexpected':self.countries}
+        data['postcodes'] = {'count':self.pcode_counter, 'unexpected':self.pcode}
+        data['provinces'] = {'count':self.provinces_counter, 'unexpected':self.provinces}
+        data['states'] = {'count':self.states_counter, 'unexpected':self.states}
+        data['streets'] = {'count':self.streets_counter, 'unexpected':self.streets}
+        data['units'] = {'count':self.units_counter, 'unexpected':self.units}
+        data['housenames'] = {'count':self.housenames_counter, 'unexpected':self.housenames}
+        data['housenumbers'] = {'count':self.housenumbers_counter, 'unexpected':self.housenumbers}
+        return data
+
+# Runs every audit over a JSON file in a single pass
+def audit_report(filename):
+    return run_audits(filename, [JsonKeysRule(), CreatedByRule(), OtherFieldsUnexpectedRule(),
+                                 AddressRule(), AddressUnexpectedRule()])
+
 # Helper function for experimenting
 def experiments(filename):
-    data = set()
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            if "address" in record:
-                if "street" not in record['address']:
-                    if record['type'] == 'way':
-                        pprint.pprint(record['address'])
+    run_audits(filename, [ExperimentsRule()])
 
 # Get a list of all keys used in json data model
 def audit_json_keys(filename):
-    data = set()
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            for key in record.keys():
-                data.add(key)
-    return data
+    return run_audits(filename, [JsonKeysRule()])['json_keys']
 
 # Displays a JSON file in pretty format
-def print_json(filename, records=10):
+# With start set, the records are read from that position using the record offset index
+def print_json(filename, records=10, start=0):
+    if start:
+        reader = record_index.RecordReader(filename)
+        pprint.pprint(reader.page(start, records))
+        reader.close()
+        return
     data = []
     counter = 0
     with open(filename, "r") as f:
@@ -190,9 +811,27 @@ def print_json(filename, records=10):
     # Display data
     pprint.pprint(data)
 
+# Displays a random sample of records from a JSON file in pretty format
+def print_json_sample(filename, records=10, seed=None):
+    reader = record_index.RecordReader(filename)
+    pprint.pprint(reader.sample(records, seed))
+    reader.close()
+
+# Look up the records with a specific OSM id, optionally only of one type ('node' or 'way')
+def lookup_id_record(filename, osm_id, type=None):
+    reader = record_index.RecordReader(filename)
+    data = reader.find_id(osm_id, type)
+    reader.close()
+    return data
+
 # Look up a record for a specific value of an address field
-def lookup_address_record(filename, field, value):
+# With use_index, the regex is only tested against the distinct values in the address index
+def lookup_address_record(filename, field, value, use_index = False):
+    if use_index:
+        return address_index.get_address_index(filename).regex(field, r'('+value+')')
     data = []
+    # Records found are held until the end, so their repeated values are shared
+    strings = string_table.StringTable()
     # Regex pattern
     match_value = re.compile(r'('+value+')')
     with open(filename, "r") as f:
@@ -202,322 +841,44 @@ def lookup_address_record(filename, field, value):
                 if field in record['address']:
                     m = match_value.search(record['address'][field])
                     if m:
-                        data.append(record)
+                        data.append(strings.intern_record(record))
     return data
         
 # Provides an audit of the created_by field 
 def audit_created_by(filename):
-    data = {}
-    counter = 0
-    total = 0
-    values = set()
-    types = set()
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            # Count total
-            total += 1
-            if 'created_by' in record:
-                # Increment counter
-                counter += 1
-                # Record details
-                values.add(record['created_by'])
-                types.add(record['type'])
-        # Shape data
-        data[counter] = values
-        data['total'] = total
-        data['types'] = types
-    # Return data
-    return data
+    return run_audits(filename, [CreatedByRule()])['created_by']
 
 # Provides an audit of other fields and checks for empty values
 def audit_other_fields_unexpected(filename):
-    data = {}
-    count = 0
-    cases = []
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            for key in record.keys():
-                # Check for empty value
-                if((record[key] == '') | (record[key] == 'NULL') | (record[key] == None)):
-                    count += 1
-                    cases.append(record)
-    # Shape data
-    data['count'] = count
-    data['cases'] = cases
-    # Return data
-    return data
+    return run_audits(filename, [OtherFieldsUnexpectedRule()])['other_fields_unexpected']
 
 # Provides an audit of the address fields
 def audit_address(filename):
-    
-    data = {}
-    counter = 0
-    total = 0
-    attributes = set()
-    cities = set()
-    cities_counter = 0
-    countries = set()
-    countries_counter = 0
-    pcode = set()
-    pcode_counter = 0
-    provinces = set()
-    provinces_counter = 0
-    states = set()
-    states_counter = 0
-    # address.street field
-    streets = set()
-    streets_counter = 0
-    # address.unit field
-    units = set()
-    units_counter = 0
-    # address.housename field
-    housenames = set()
-    housenames_counter = 0
-    # address.housenumber field
-    housenumbers = set()
-    housenumbers_counter = 0
-    
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            # Count total
-            total += 1
-            if 'address' in record:
-                # Increment counter
-                counter += 1
-                # Record different attributes
-                for key in record['address'].keys():
-                    attributes.add(key)
-                # Display details about cities
-                if 'city' in record['address']:
-                    cities_counter += 1
-                    cities.add(record['address']['city'])
-                # Display details about countries
-                if 'country' in record['address']:
-                    countries_counter += 1
-                    countries.add(record['address']['country'])
-                # Display details about postcode
-                if 'postcode' in record['address']:
-                    pcode_counter += 1
-                    # Record postal codes that are not expected
-                    m = pcode_match.search(record['address']['postcode'])
-                    if not m:
-                        pcode.add(record['address']['postcode'])
-                # Display details about province
-                if 'province' in record['address']:
-                    provinces_counter += 1
-                    provinces.add(record['address']['province'])
-                # Display details about state
-                if 'state' in record['address']:
-                    states_counter += 1
-                    states.add(record['address']['state'])   
-                # Display details about street ending variations
-                if 'street' in record['address']:
-                    streets_counter += 1
-                    m = street_ending.search(record['address']['street'])
-                    if m:
-                        ending = m.group()
-                        streets.add(ending)
-                # Display details about unit
-                if 'unit' in record['address']:
-                    units_counter += 1
-                    units.add(record['address']['unit'])
-                # Display details about housename
-                if 'housename' in record['address']:
-                    housenames_counter += 1
-                    housenames.add(record['address']['housename'])
-                    # Print if contains numbers
-                    m = contains_numbers.search(record['address']['housename'])
-                    if m:
-                        # pprint.pprint(record)
-                        pass
-                # Display details about housenumber
-                if 'housenumber' in record['address']:
-                    housenumbers_counter += 1
-                    housenumbers.add(record['address']['housenumber'])
-
-                # Display address
-                # pprint.pprint(record['address'])
-                
-        # Shape data
-        data['counter'] = counter
-        data['total'] = total
-        data['attributes'] = attributes
-        data['cities'] = {'count':cities_counter, 'uniques':cities}
-        data['countries'] = {'count':countries_counter, 'uniques':countries}
-        data['postcodes'] = {'count':pcode_counter, 'unexpected':pcode}
-        data['provinces'] = {'count':provinces_counter, 'uniques':provinces}
-        data['states'] = {'count':states_counter, 'uniques':states}
-        data['streets'] = {'count':streets_counter, 'uniques':streets}
-        data['units'] = {'count':units_counter, 'uniques':units}
-        data['housenames'] = {'count':housenames_counter, 'uniques':housenames}
-        data['housenumbers'] = {'count':housenumbers_counter, 'uniques':housenumbers}
-        
-    # Return data
-    return data
+    return run_audits(filename, [AddressRule()])['address']
 
 # Displays unexpected records in the address fields
 def audit_address_unexpected(filename):
-    
-    data = {}
-    # General variables
-    counter = 0
-    total = 0
-    attributes = set()
-    # address.city field
-    cities = set()
-    cities_counter = 0
-    # address.country field
-    countries = set()
-    countries_counter = 0
-    # address.postcode field
-    pcode = set()
-    pcode_counter = 0
-    # address.province field
-    provinces = set()
-    provinces_counter = 0
-    # address.state field
-    states = set()
-    states_counter = 0
-    # address.street field
-    streets = set()
-    streets_counter = 0
-    # address.unit field
-    units = set()
-    units_counter = 0
-    # address.housename field
-    housenames = []
-    housenames_counter = 0
-    # address.housenumber field
-    housenumbers = set()
-    housenumbers_counter = 0
-    
-    with open(filename, "r") as f:
-        for line in f:
-            record = json.loads(line)
-            # Count total
-            total += 1
-            if 'address' in record:
-                # Record how many records have addresses
-                counter += 1
-                # Record attributes found in address field
-                for key in record['address'].keys():
-                    attributes.add(key)
-                # Display details about cities
-                if 'city' in record['address']:
-                    # Capture cities that have a comma-separated, therefore could be including a province
-                    if ',' in record['address']['city']:
-                        cities.add(record['address']['city'])
-                        cities_counter += 1
-                    # Capture cities that are lowercase 
-                    m = lower.search(record['address']['city'])
-                    if m:
-                        cities.add(record['address']['city'])
-                        cities_counter += 1
-                # Display details about countries
-                if 'country' in record['address']:
-                    # Capture countries that do not have a country field 'Canada'
-                    if(record['address']['country'] != 'Canada'):
-                        countries_counter += 1
-                        countries.add(record['address']['country'])
-                else:
-                    # Capture records that do not have a country field
-                    countries_counter += 1
-                    countries.add('')
-                # Display details about postcode
-                if 'postcode' in record['address']:
-                    # Record postal codes that are not expected
-                    m = pcode_match.search(record['address']['postcode'])
-                    if not m:
-                        pcode.add(record['address']['postcode'])
-                        pcode_counter += 1
-                # Display details about province
-                if 'province' in record['address']:
-                    # Capture records where province is not 'British Columbia'
-                    if(record['address']['province'] != 'British Columbia'):
-                        provinces_counter += 1
-                        provinces.add(record['address']['province'])
-                else:
-                    # Capture records that do not have a province field
-                    provinces_counter += 1
-                    provinces.add('')
-                # Display details about state
-                if 'state' in record['address']:
-                    # Capture records where state is used instead of province
-                    states_counter += 1
-                    states.add(record['address']['state'])   
-                # Display details about street
-                if 'street' in record['address']:
-                    # Capture record if street is not capitalized
-                    m = lower_first.search(record['address']['street'])
-                    if m:
-                        streets_counter += 1
-                        streets.add(record['address']['street'])
-                    # Capture record if street ending does not match expected
-                    m = street_type_re.search(record['address']['street'])
-                    if m:
-                        ending = m.group()
-                        if ending not in EXPECTED_STREET_NAMES:
-                            streets_counter += 1
-                            streets.add(record['address']['street'])
-                # Display details about unit
-                if 'unit' in record['address']:
-                    # Capture record if "Suite" or "suite" is included in the unit number
-                    if "suite" in record['address']['unit'].lower():
-                        units_counter += 1
-                        units.add(record['address']['unit'])
-                # Display details about housename
-                if 'housename' in record['address']:
-                    # Capture record if it contains numbers (could be misused instead of address.housenumber)
-                    m = contains_numbers.search(record['address']['housename'])
-                    if m:
-                        housenames_counter += 1
-                        housenames.append(record['address'])
-                # Display details about housenumber
-                if 'housenumber' in record['address']:
-                    # Capture record if housenumber has unexpected characters
-                    try:
-                        record['address']['housenumber'].decode()
-                    except UnicodeEncodeError:
-                        housenumbers_counter += 1
-                        housenumbers.add(record['address']['housenumber'])
-                    # Capture record if housenumber is not a number
-                    m = numbers.search(record['address']['housenumber'])
-                    if not m:
-                        housenumbers_counter += 1
-                        housenumbers.add(record['address']['housenumber'])
-                    
-        # Shape data
-        data['counter'] = counter
-        data['total'] = total
-        data['attributes'] = attributes
-        data['cities'] = {'count':cities_counter, 'unexpected':cities}
-        data['countries'] = {'count':countries_counter, 'unexpected':countries}
-        data['postcodes'] = {'count':pcode_counter, 'unexpected':pcode}
-        data['provinces'] = {'count':provinces_counter, 'unexpected':provinces}
-        data['states'] = {'count':states_counter, 'unexpected':states}
-        data['streets'] = {'count':streets_counter, 'unexpected':streets}
-        data['units'] = {'count':units_counter, 'unexpected':units}
-        data['housenames'] = {'count':housenames_counter, 'unexpected':housenames}
-        data['housenumbers'] = {'count':housenumbers_counter, 'unexpected':housenumbers}
-        
-    # Return data
-    return data
-            
+    return run_audits(filename, [AddressUnexpectedRule()])['address_unexpected']
+
 def main():
     # pprint.pprint(audit_xml(osm_file))
     # process_map(osm_file)
     # process_map(osm_file_full)
+    # stream_map(osm_file_full)
+    # process_map_parallel(osm_file_full)
     # print_json(json_file)
+    # print_json(json_file, start=1500000)
+    # print_json_sample(json_file)
+    # pprint.pprint(lookup_id_record(json_file, '261114295', 'node'))
     # audit_created_by(json_file)
     # pprint.pprint(audit_address(json_file))
     # pprint.pprint(audit_address(clean_json_file))
     # pprint.pprint(lookup_address_record(json_file, 'street', 'Wynd'))
+    # pprint.pprint(lookup_address_record(json_file, 'street', 'Wynd', use_index=True))
     # pprint.pprint(audit_json_keys(json_file))
     # pprint.pprint(audit_other_fields_unexpected(json_file))
     # experiments(json_file)
+    # pprint.pprint(audit_report(json_file))
     
     # pprint.pprint(audit_address_unexpected(json_file))
     # pprint.pprint(audit_address_unexpected(clean_json_file))
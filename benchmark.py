@@ -0,0 +1,464 @@
+import multiprocessing
+import resource
+import os
+import time
+import pprint
+import filecmp
+import shutil
+import sys
+import re
+import json
+import timeit
+import itertools
+import platform
+
+import audit
+import clean
+import pipeline
+import columnar
+import records
+import string_table
+import json_codec
+import synthetic_osm
+from Lesson6_Quiz1 import count_tags
+
+# Files
+osm_file = './vancouver.osm/vancouver_sample.osm'
+osm_file_full = './vancouver.osm/vancouver.osm'
+json_file_full = './vancouver.osm/vancouver.osm.json'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+benchmark_dir = './vancouver.osm/benchmark'
+baseline_file = './vancouver.osm/benchmark/baseline.json'
+
+# Sizes of the synthetic files the suite runs on
+SCALES = [('10MB', 10 * 1024 * 1024), ('100MB', 100 * 1024 * 1024), ('1GB', 1024 * 1024 * 1024)]
+# Audits timed by the suite, run over the JSON file written by process_map
+SUITE_AUDITS = [audit.audit_json_keys, audit.audit_created_by, audit.audit_other_fields_unexpected,
+                audit.audit_address, audit.audit_address_unexpected, audit.audit_report]
+# Functions in the order the suite runs them
+SUITE_FUNCTIONS = ['count_tags', 'audit_xml', 'process_map', 'clean_json'] + [func.__name__ for func in SUITE_AUDITS]
+
+# Housenumber formats found while auditing the Vancouver dataset
+HOUSENUMBER_CORPUS = [u' 620', u'#107-7885', u'#110 532', u'101-20151', u'10A-825', u'104 - 1628', u'10153, Suite 147-2153',
+                      u'104 1676', u'1067;1077', u'4269, #4051', u'U1 601', u'Suite 110, 1333', u'Unit 102 -1626',
+                      u'Studio 100 1000', u'1238 #4', u'201 City Square, 555', u'12-12', u'208 - 1899', u'5157',
+                      u'3917, Army, Navy, & Airforce Veterans Club, Taurus Unit #298', u'unit: #5 1200', u'SUITE 4B 880']
+
+# Runs a function in a child process and reports its peak resident memory
+# ru_maxrss only ever grows, so each measurement needs a fresh process
+def run_with_peak_rss(func, args):
+    def target(queue):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        # ru_maxrss is reported in kilobytes on Linux
+        queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed))
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=target, args=(queue,))
+    p.start()
+    peak_kb, elapsed = queue.get()
+    p.join()
+    return peak_kb, elapsed
+
+# Compares peak memory of process_map against stream_map over input files of different sizes
+def benchmark_process_map_memory(filenames):
+    data = []
+    for filename in filenames:
+        size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+        list_kb, list_time = run_with_peak_rss(audit.process_map, (filename,))
+        stream_kb, stream_time = run_with_peak_rss(audit.stream_map, (filename,))
+        data.append({'file': filename,
+                     'size_mb': round(size_mb, 1),
+                     'process_map': {'peak_rss_mb': round(list_kb / 1024.0, 1), 'seconds': round(list_time, 2)},
+                     'stream_map': {'peak_rss_mb': round(stream_kb / 1024.0, 1), 'seconds': round(stream_time, 2)}})
+    return data
+
+# Times process_map_parallel with different numbers of workers and checks the output matches stream_map
+def benchmark_parallel_scaling(filename, worker_counts=(1, 2, 4, 8)):
+    data = {'file': filename, 'runs': []}
+    size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+    file_out = "{0}.json".format(filename)
+    # Serial reference output
+    start = time.time()
+    audit.stream_map(filename)
+    serial_time = time.time() - start
+    reference = file_out + '.serial'
+    shutil.move(file_out, reference)
+    data['serial'] = {'seconds': round(serial_time, 2), 'mb_per_sec': round(size_mb / serial_time, 1)}
+    for workers in worker_counts:
+        start = time.time()
+        audit.process_map_parallel(filename, workers=workers)
+        elapsed = time.time() - start
+        data['runs'].append({'workers': workers,
+                             'seconds': round(elapsed, 2),
+                             'mb_per_sec': round(size_mb / elapsed, 1),
+                             'speedup': round(serial_time / elapsed, 2),
+                             'identical': filecmp.cmp(file_out, reference, shallow=False)})
+    os.remove(reference)
+    return data
+
+# Times clean_json with different numbers of workers and checks the output matches the serial run
+def benchmark_clean_json_scaling(filename, worker_counts=(1, 2, 4, 8)):
+    data = {'file': filename, 'runs': []}
+    size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+    file_out = filename[:len(filename)-9]+"_cleaned"+filename[len(filename)-9:]
+    # Serial reference output
+    start = time.time()
+    clean.clean_json(filename)
+    serial_time = time.time() - start
+    reference = file_out + '.serial'
+    shutil.move(file_out, reference)
+    data['serial'] = {'seconds': round(serial_time, 2), 'mb_per_sec': round(size_mb / serial_time, 1)}
+    for workers in worker_counts:
+        start = time.time()
+        clean.clean_json(filename, workers=workers)
+        elapsed = time.time() - start
+        data['runs'].append({'workers': workers,
+                             'seconds': round(elapsed, 2),
+                             'mb_per_sec': round(size_mb / elapsed, 1),
+                             'speedup': round(serial_time / elapsed, 2),
+                             'identical': filecmp.cmp(file_out, reference, shallow=False)})
+    os.remove(reference)
+    return data
+
+# Compares the two-step process_map + clean_json path with the fused pipeline
+# Bytes written count every output file, so the dirty JSON is included for the two-step path
+def benchmark_pipeline(filename):
+    json_out = "{0}.json".format(filename)
+    file_out = json_out[:len(json_out)-9]+"_cleaned"+json_out[len(json_out)-9:]
+    start = time.time()
+    audit.stream_map(filename)
+    clean.clean_json(json_out)
+    two_step_time = time.time() - start
+    two_step_bytes = os.path.getsize(json_out) + os.path.getsize(file_out)
+    reference = file_out + '.two_step'
+    shutil.move(file_out, reference)
+    os.remove(json_out)
+    start = time.time()
+    pipeline.run_pipeline(filename)
+    fused_time = time.time() - start
+    data = {'file': filename,
+            'two_step': {'seconds': round(two_step_time, 2), 'mb_written': round(two_step_bytes / (1024.0 * 1024.0), 1)},
+            'fused': {'seconds': round(fused_time, 2), 'mb_written': round(os.path.getsize(file_out) / (1024.0 * 1024.0), 1)},
+            'identical': filecmp.cmp(file_out, reference, shallow=False)}
+    os.remove(reference)
+    return data
+
+# Compares elements per second for each XML backend of iter_shaped_elements
+# Each backend is also checked against the etree backend in a separate, untimed pass
+def benchmark_parsers(filename, parsers=('etree', 'expat', 'lxml')):
+    data = {'file': filename, 'parsers': {}}
+    for parser in parsers:
+        if parser == 'lxml' and audit.lxml_etree is None:
+            continue
+        start = time.time()
+        count = 0
+        for el in audit.iter_shaped_elements(filename, parser):
+            count += 1
+        elapsed = time.time() - start
+        pairs = itertools.izip_longest(audit.iter_shaped_elements(filename), audit.iter_shaped_elements(filename, parser))
+        data['parsers'][parser] = {'elements': count,
+                                   'seconds': round(elapsed, 2),
+                                   'elements_per_sec': round(count / elapsed),
+                                   'identical': all(a == b for a, b in pairs)}
+    return data
+
+# Compares size on disk and full-scan audit time of a JSON file and its columnar version
+# The columnar audits are also checked against the JSON ones
+def benchmark_columnar(filename):
+    path = columnar.columnar_filename(filename)
+    start = time.time()
+    columnar.json_to_columnar(filename, path)
+    data = {'file': filename, 'convert_seconds': round(time.time() - start, 2)}
+    columnar_bytes = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    data['bytes'] = {'json': os.path.getsize(filename), 'columnar': columnar_bytes}
+    for name, audit_json, audit_columnar in [('address', audit.audit_address, columnar.audit_address_columnar),
+                                             ('created_by', audit.audit_created_by, columnar.audit_created_by_columnar)]:
+        start = time.time()
+        expected = audit_json(filename)
+        json_seconds = time.time() - start
+        start = time.time()
+        result = audit_columnar(path)
+        columnar_seconds = time.time() - start
+        data[name] = {'json_seconds': round(json_seconds, 2),
+                      'columnar_seconds': round(columnar_seconds, 2),
+                      'identical': result == expected}
+    return data
+
+# Original implementation of clean.extract_unit_housenumber, kept as a reference for benchmark_housenumber_parser
+def legacy_extract_unit_housenumber(s):
+    print "================"
+    print "Attempting to match: "+s
+    p1 = re.compile(r'^#([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$')
+    m = p1.search(s)
+    if m:
+        print "MATCHED by P1: "+s
+        return (m.group(1), m.group(2))
+    p2 = re.compile(r'^([0-9]+)\, suite #?([0-9A-Za-z\-\s]+)$', re.IGNORECASE)
+    m = p2.search(s)
+    if m:
+        print "MATCHED by P2: "+s
+        return (m.group(2), m.group(1))
+    p3 = re.compile(r'^([0-9]+)\, #([0-9\-]+)$')
+    m = p3.search(s)
+    if m:
+        print "MATCHED by P3: "+s
+        return (m.group(2), m.group(1))
+    p4 = re.compile(r'^([A-Za-z]{1,3}[0-9]{1,5}|[0-9]{1,5}[A-Za-z]{1,3})[\-\s\,]{1,3}([0-9]+)$')
+    m = p4.search(s)
+    if m:
+        print "MATCHED by P4: "+s
+        return (m.group(1), m.group(2))
+    p5 = re.compile(r'^suite #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
+    m = p5.search(s)
+    if m:
+        print "MATCHED by P5: "+s
+        return (m.group(1), m.group(2))
+    p6 = re.compile(r'^unit\:? #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
+    m = p6.search(s)
+    if m:
+        print "MATCHED by P6: "+s
+        return (m.group(1), m.group(2))
+    p7 = re.compile(r'^studio #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
+    m = p7.search(s)
+    if m:
+        print "MATCHED by P7: "+s
+        return (m.group(1), m.group(2))
+    p8 = re.compile(r'^([0-9]+)\,? #([0-9A-Za-z\-\s]+)$', re.IGNORECASE)
+    m = p8.search(s)
+    if m:
+        print "MATCHED by P8: "+s
+        return (m.group(2), m.group(1))
+    p9 = re.compile(r'^([0-9]+)[\-\s\,]{1,3}([0-9]+)$')
+    m = p9.search(s)
+    if m:
+        if(len(m.group(1)) < len(m.group(2))):
+            print "MATCHED by P9: "+s
+            return (m.group(1), m.group(2))
+        elif(len(m.group(1)) > len(m.group(2))):
+            print "MATCHED by P9: "+s
+            return (m.group(2), m.group(1))
+    if s in clean.SPECIFIC_HOUSENUMBER_MAPPING:
+        print "MATCHED by MAPPING: "+s
+        return clean.SPECIFIC_HOUSENUMBER_MAPPING[s]
+    print "COULD NOT RECOGNIZE PATTERN: "+s
+    s = s.replace(';', '-')
+    s = s.replace(' - ', '-')
+    s = s.replace(', ', '-')
+    s = s.replace(':', '')
+    s = s.replace(',', '-')
+    return (None, s)
+
+# Collects the housenumbers from a JSON file that clean_json would pass to extract_unit_housenumber
+def housenumber_corpus(filename):
+    data = []
+    with open(filename, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            if 'address' in record and 'housenumber' in record['address']:
+                hn = clean.clean_housenumber(record['address']['housenumber']).strip()
+                if not clean.numbers.search(hn):
+                    data.append(hn)
+    return data
+
+# Times the legacy and current housenumber parsers over a corpus and checks that their results match
+def benchmark_housenumber_parser(corpus=HOUSENUMBER_CORPUS, repeat=1000):
+    # The legacy parser prints for every value, so send stdout to devnull while running it
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        expected = [legacy_extract_unit_housenumber(s) for s in corpus]
+        legacy_time = timeit.timeit(lambda: [legacy_extract_unit_housenumber(s) for s in corpus], number=repeat)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    # Count rules over a single pass of the corpus
+    clean.housenumber_rule_counts.clear()
+    mismatches = [s for s, result in zip(corpus, expected) if clean.extract_unit_housenumber(s) != result]
+    rule_counts = dict(clean.housenumber_rule_counts)
+    current_time = timeit.timeit(lambda: [clean.extract_unit_housenumber(s) for s in corpus], number=repeat)
+    calls = len(corpus) * repeat
+    return {'values': len(corpus),
+            'mismatches': mismatches,
+            'legacy_us_per_call': round(legacy_time / calls * 1e6, 2),
+            'current_us_per_call': round(current_time / calls * 1e6, 2),
+            'speedup': round(legacy_time / current_time, 1),
+            'rule_counts': rule_counts}
+
+# Shapes every element of an OSM file and holds them in memory as 'dict', 'interned' (dictionaries with their
+# repeated values interned) or 'compact' records, or holds none
+def hold_records(filename, kind = None):
+    data = []
+    strings = string_table.StringTable()
+    for el in audit.iter_shaped_elements(filename):
+        if kind == 'dict':
+            data.append(el)
+        elif kind == 'interned':
+            data.append(strings.intern_record(el))
+        elif kind == 'compact':
+            data.append(records.ElementRecord.from_dict(el))
+    return data
+
+# Compares the memory taken per record by shaped dictionaries, with and without interning, and records.ElementRecord
+# Each kind is held in a fresh process, and the peak of a run that holds nothing is taken off
+def benchmark_record_memory(filename):
+    count = sum(1 for _ in audit.iter_shaped_elements(filename))
+    base_kb, _ = run_with_peak_rss(hold_records, (filename,))
+    data = {'file': filename, 'records': count}
+    for kind in ('dict', 'interned', 'compact'):
+        peak_kb, elapsed = run_with_peak_rss(hold_records, (filename, kind))
+        data[kind] = {'bytes_per_record': round((peak_kb - base_kb) * 1024.0 / count),
+                      'peak_rss_mb': round(peak_kb / 1024.0, 1),
+                      'seconds': round(elapsed, 2)}
+    data['ratio'] = round(data['dict']['bytes_per_record'] / data['compact']['bytes_per_record'], 1)
+    return data
+
+# Decode and encode throughput of each installed JSON backend over the lines of a JSON file
+# Each backend's records are checked against json.loads, and its lines are checked to decode back to the same records
+def benchmark_json_codecs(filename):
+    with open(filename, "r") as f:
+        lines = f.readlines()
+    size_mb = sum(len(line) for line in lines) / (1024.0 * 1024.0)
+    expected = [json.loads(line) for line in lines]
+    data = {'file': filename, 'size_mb': round(size_mb, 1), 'backends': {}}
+    for name in json_codec.available_backends():
+        codec = json_codec.get_codec(name)
+        start = time.time()
+        decoded = [codec.loads(line) for line in lines]
+        decode_time = time.time() - start
+        start = time.time()
+        encoded = [codec.dumps_line(record) for record in decoded]
+        encode_time = time.time() - start
+        data['backends'][name] = {'decode_mb_per_sec': round(size_mb / decode_time, 1),
+                                  'encode_mb_per_sec': round(size_mb / encode_time, 1),
+                                  'identical': decoded == expected and [json.loads(line) for line in encoded] == expected}
+    return data
+
+# Address values of a JSON file that clean_record would pass to each normalization cache
+def normalization_corpus(filename):
+    corpus = dict([(name, []) for name in clean.NORMALIZATION_CACHES])
+    with open(filename, "r") as f:
+        for line in f:
+            if '"address"' not in line:
+                continue
+            address = json.loads(line).get('address', {})
+            for name, values in corpus.items():
+                if name in address:
+                    values.append(address[name])
+    return corpus
+
+# Times each normalization cache against calling its normalize function directly on the same values
+# The caches start empty, so their misses are counted too, and their results are checked against the direct calls
+def benchmark_normalization_caches(filename, repeat = 3):
+    corpus = normalization_corpus(filename)
+    data = {'file': filename}
+    for name, values in corpus.items():
+        func = clean.NORMALIZATION_CACHES[name].func
+        direct_time = time_call(lambda: [func(value) for value in values], (), repeat)
+        caches = []
+        def cached():
+            cache = clean.NormalizationCache(func)
+            caches.append(cache)
+            return [cache(value) for value in values]
+        cached_time = time_call(cached, (), repeat)
+        data[name] = {'values': len(values),
+                      'direct_seconds': round(direct_time, 3),
+                      'cached_seconds': round(cached_time, 3),
+                      'speedup': round(direct_time / cached_time, 1) if cached_time else None,
+                      'hit_ratio': caches[-1].stats()['hit_ratio'],
+                      'identical': cached() == [func(value) for value in values]}
+    return data
+
+# Synthetic OSM file for a scale, generated the first time it is needed
+# The generator is seeded, so every machine benchmarks the same file
+def synthetic_file(scale, size_bytes, seed = 0):
+    filename = os.path.join(benchmark_dir, 'synthetic_{0}.osm'.format(scale.lower()))
+    if not os.path.exists(filename):
+        if not os.path.isdir(benchmark_dir):
+            os.makedirs(benchmark_dir)
+        synthetic_osm.generate_osm(filename, size_bytes, seed)
+    return filename
+
+# Best time of a number of calls to func
+def time_call(func, args, repeat = 1):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Times count_tags, audit_xml, process_map, clean_json and each audit function over synthetic files of each scale
+# process_map keeps every record in memory, so the 1GB scale needs several GB of RAM
+def benchmark_suite(scales = SCALES, repeat = 1, seed = 0):
+    data = {}
+    for scale, size_bytes in scales:
+        filename = synthetic_file(scale, size_bytes, seed)
+        json_file = "{0}.json".format(filename)
+        size_mb = os.path.getsize(filename) / (1024.0 * 1024.0)
+        # process_map writes the JSON file the later steps read, so the order matters
+        steps = [('count_tags', count_tags, (filename,)),
+                 ('audit_xml', audit.audit_xml, (filename,)),
+                 ('process_map', audit.process_map, (filename,)),
+                 ('clean_json', clean.clean_json, (json_file,))]
+        steps.extend([(func.__name__, func, (json_file,)) for func in SUITE_AUDITS])
+        timings = {}
+        for name, func, args in steps:
+            seconds = time_call(func, args, repeat)
+            timings[name] = {'seconds': round(seconds, 3), 'mb_per_sec': round(size_mb / seconds, 1)}
+        data[scale] = {'file': filename, 'size_mb': round(size_mb, 1), 'functions': timings}
+    return data
+
+# Stores the results of benchmark_suite as the baseline later runs are compared with
+def save_baseline(results, filename = baseline_file):
+    with open(filename, "w") as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'scales': results},
+                  f, indent=2, sort_keys=True)
+
+# Rows of (scale, function, baseline seconds, current seconds, change in %) for the results of benchmark_suite
+# Baseline seconds and change are None where the baseline has no timing to compare with
+def compare_to_baseline(results, filename = baseline_file):
+    baseline = {}
+    if os.path.exists(filename):
+        with open(filename, "r") as f:
+            baseline = json.load(f)['scales']
+    rows = []
+    for scale, _ in SCALES:
+        if scale not in results:
+            continue
+        functions = results[scale]['functions']
+        for name in SUITE_FUNCTIONS:
+            current = functions[name]['seconds']
+            base = baseline.get(scale, {}).get('functions', {}).get(name, {}).get('seconds')
+            change = round((current - base) / base * 100, 1) if base else None
+            rows.append((scale, name, base, current, change))
+    return rows
+
+# Formats the rows of compare_to_baseline as a text table
+def format_table(rows):
+    lines = ['{0:<6} {1:<30} {2:>10} {3:>10} {4:>8}'.format('Scale', 'Function', 'Baseline', 'Current', 'Change')]
+    for scale, name, base, current, change in rows:
+        lines.append('{0:<6} {1:<30} {2:>10} {3:>10.3f} {4:>8}'.format(
+            scale, name, 'n/a' if base is None else '{0:.3f}'.format(base), current,
+            'n/a' if change is None else '{0:+.1f}%'.format(change)))
+    return '\n'.join(lines)
+
+def main():
+    pprint.pprint(benchmark_process_map_memory([osm_file, osm_file_full]))
+    pprint.pprint(benchmark_parallel_scaling(osm_file_full))
+    pprint.pprint(benchmark_clean_json_scaling(json_file_full))
+    pprint.pprint(benchmark_pipeline(osm_file_full))
+    pprint.pprint(benchmark_parsers(osm_file_full))
+    pprint.pprint(benchmark_housenumber_parser())
+    pprint.pprint(benchmark_housenumber_parser(housenumber_corpus(json_file_full), repeat=10))
+    pprint.pprint(benchmark_columnar(clean_json_file_full))
+    pprint.pprint(benchmark_record_memory(osm_file_full))
+    pprint.pprint(benchmark_json_codecs(clean_json_file_full))
+    pprint.pprint(benchmark_normalization_caches(json_file_full))
+    results = benchmark_suite()
+    print(format_table(compare_to_baseline(results)))
+    # save_baseline(results)
+
+if __name__ == "__main__":
+    main()
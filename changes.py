@@ -0,0 +1,225 @@
+import xml.etree.cElementTree as ET
+import codecs
+import os
+import pprint
+import time
+
+import audit
+import clean
+import pipeline
+import record_index
+
+# Actions of an osmChange file
+ACTIONS = ("create", "modify", "delete")
+# Order of the record types in OSM files, and so in the JSON files made from them
+TYPE_ORDER = {"node": 0, "way": 1, "relation": 2}
+# Bytes copied at a time from the old JSON file
+COPY_SIZE = 1024 * 1024
+
+# Files
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+osc_file = './vancouver.osm/vancouver.osc'
+
+# Iteratively parses an osmChange file and yields (action, shaped element) for each element in it
+def iter_changes(file_in):
+    context = ET.iterparse(file_in, events=("start", "end"))
+    # First event is the start of the root <osmChange> element
+    _, root = next(context)
+    depth = 0
+    action = None
+    for event, element in context:
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                action = element
+        else:
+            depth -= 1
+            if depth == 1:
+                el = audit.shape_element(element)
+                if el and action.tag in ACTIONS:
+                    yield action.tag, el
+                # Clear finished element out of memory
+                action.clear()
+            elif depth == 0:
+                root.clear()
+
+# Shapes and cleans the elements of an osmChange file
+# Yields (type, id, record), where record is the cleaned record or None if the element was deleted or
+# clean_record removes it.  Only the last change to each element is kept, as later versions replace earlier ones.
+def iter_cleaned_changes(file_in):
+    changes = {}
+    order = []
+    for action, el in iter_changes(file_in):
+        key = (el['type'], el['id'])
+        if key not in changes:
+            order.append(key)
+        if action == "delete":
+            changes[key] = None
+        else:
+            # Same dictionary order as a record that went through process_map and clean_json
+            el = pipeline.as_loaded(el)
+            changes[key] = el if clean.clean_record(el) else None
+    for key in order:
+        yield key[0], key[1], changes[key]
+
+# Sort key of a record in an OSM derived file: type, then id
+def record_order(type, osm_id):
+    return (TYPE_ORDER.get(type, len(TYPE_ORDER)), int(osm_id))
+
+# Ordinal of the first record in the JSON file that comes after a (type, id), found by binary search
+def insert_position(reader, type, osm_id):
+    key = record_order(type, osm_id)
+    lo, hi = 0, len(reader)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        record = reader.record(mid)
+        if record_order(record['type'], record['id']) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+# Copies the bytes from start to end of one file to another
+def copy_range(fr, fw, start, end):
+    fr.seek(start)
+    while start < end:
+        block = fr.read(min(COPY_SIZE, end - start))
+        if not block:
+            break
+        fw.write(block)
+        start += len(block)
+
+# Applies an osmChange file to a cleaned JSON file
+# Only the changed elements are shaped and cleaned.  Their lines are found with the record index, and everything
+# in between is copied over as bytes, so the result is the same as re-running the full process on the new extract.
+# Created elements are inserted where they belong by type and id.
+# The JSON file is replaced unless file_out is given.  Returns counts of the records replaced, inserted and removed.
+def apply_changes_json(json_file, osc_file, file_out = None):
+    stats = {'replaced': 0, 'inserted': 0, 'removed': 0}
+    reader = record_index.RecordReader(json_file)
+    # (start, end, type order, new line) for each edit, where start == end for inserts
+    edits = []
+    try:
+        for type, osm_id, record in iter_cleaned_changes(osc_file):
+            line = '' if record is None else pipeline.dumps(record)
+            ordinals = reader.find_ordinals(osm_id, type)
+            if ordinals:
+                for i, n in enumerate(ordinals):
+                    start, end = reader.span(n)
+                    # Any duplicates of the record are removed
+                    edits.append((start, end, record_order(type, osm_id), line if i == 0 else ''))
+                stats['replaced' if line else 'removed'] += 1
+            elif line:
+                n = insert_position(reader, type, osm_id)
+                start = reader.span(n)[0] if n < len(reader) else os.path.getsize(json_file)
+                edits.append((start, start, record_order(type, osm_id), line))
+                stats['inserted'] += 1
+    finally:
+        reader.close()
+    edits.sort()
+    tmp_file = (file_out or json_file) + ".tmp"
+    with open(json_file, "rb") as fr:
+        with codecs.open(tmp_file, "w") as fw:
+            pos = 0
+            for start, end, _, line in edits:
+                copy_range(fr, fw, pos, start)
+                fw.write(line)
+                pos = end
+            copy_range(fr, fw, pos, os.path.getsize(json_file))
+    os.rename(tmp_file, file_out or json_file)
+    return stats
+
+def main():
+    start = time.time()
+    pprint.pprint(apply_changes_json(clean_json_file_full, osc_file))
+    print("Applied in {0:.2f}s".format(time.time() - start))
+
+def test():
+    import tempfile
+    import shutil
+    base = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="1" lat="49.28" lon="-123.12" version="1" user="a" uid="1" changeset="1" timestamp="2015-01-01T00:00:00Z"/>
+ <node id="2" lat="49.29" lon="-123.13" version="1" user="a" uid="1" changeset="1" timestamp="2015-01-01T00:00:00Z">
+  <tag k="addr:street" v="Main St"/>
+  <tag k="addr:postcode" v="V6B 1A1"/>
+ </node>
+ <node id="4" lat="49.27" lon="-123.11" version="1" user="a" uid="1" changeset="1" timestamp="2015-01-01T00:00:00Z"/>
+ <way id="10" version="1" user="a" uid="1" changeset="1" timestamp="2015-01-01T00:00:00Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <tag k="highway" v="residential"/>
+ </way>
+</osm>
+"""
+    change = """<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6">
+ <create>
+  <node id="3" lat="49.30" lon="-123.14" version="1" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+   <tag k="addr:street" v="Hastings St"/>
+  </node>
+  <way id="11" version="1" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+   <nd ref="3"/>
+   <nd ref="4"/>
+  </way>
+ </create>
+ <modify>
+  <node id="2" lat="49.29" lon="-123.13" version="2" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+   <tag k="addr:street" v="Main St"/>
+   <tag k="addr:postcode" v="V6B1A1"/>
+  </node>
+  <node id="4" lat="49.27" lon="-123.11" version="2" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+   <tag k="addr:postcode" v="98225"/>
+  </node>
+ </modify>
+ <delete>
+  <node id="1" version="2" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z"/>
+ </delete>
+</osmChange>
+"""
+    # The same extract with the change applied, processed in full for comparison
+    after = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+ <node id="2" lat="49.29" lon="-123.13" version="2" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+  <tag k="addr:street" v="Main St"/>
+  <tag k="addr:postcode" v="V6B1A1"/>
+ </node>
+ <node id="3" lat="49.30" lon="-123.14" version="1" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+  <tag k="addr:street" v="Hastings St"/>
+ </node>
+ <node id="4" lat="49.27" lon="-123.11" version="2" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+  <tag k="addr:postcode" v="98225"/>
+ </node>
+ <way id="10" version="1" user="a" uid="1" changeset="1" timestamp="2015-01-01T00:00:00Z">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <tag k="highway" v="residential"/>
+ </way>
+ <way id="11" version="1" user="b" uid="2" changeset="2" timestamp="2015-02-01T00:00:00Z">
+  <nd ref="3"/>
+  <nd ref="4"/>
+ </way>
+</osm>
+"""
+    tmp = tempfile.mkdtemp()
+    try:
+        for name, text in [("base.osm", base), ("after.osm", after), ("change.osc", change)]:
+            with open(os.path.join(tmp, name), "w") as f:
+                f.write(text)
+        for name in ("base.osm", "after.osm"):
+            audit.stream_map(os.path.join(tmp, name))
+            clean.clean_json(os.path.join(tmp, name + ".json"))
+        cleaned = os.path.join(tmp, "base_cleaned.osm.json")
+        stats = apply_changes_json(cleaned, os.path.join(tmp, "change.osc"))
+        pprint.pprint(stats)
+        # Node 4 gets a US postcode, so clean_record removes it along with deleted node 1
+        assert stats == {'replaced': 1, 'inserted': 2, 'removed': 2}
+        with open(cleaned) as f:
+            updated = f.read()
+        with open(os.path.join(tmp, "after_cleaned.osm.json")) as f:
+            assert updated == f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import codecs
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import pprint
+import types
+
+import audit
+import clean
+import json_codec
+
+# Input bytes processed between checkpoints
+CHECKPOINT_BYTES = 64 * 1024 * 1024
+# Bump when the layout of the checkpoint file changes
+CHECKPOINT_VERSION = 1
+# Bytes hashed at a time
+HASH_BLOCK = 1024 * 1024
+
+# Files
+osm_file_full = './vancouver.osm/vancouver.osm'
+json_file_full = './vancouver.osm/vancouver.osm.json'
+
+# Name of the checkpoint file kept next to an output file
+def checkpoint_filename(file_out):
+    return file_out + ".ckpt"
+
+# Name of the file an unfinished output is written to
+def partial_filename(file_out):
+    return file_out + ".partial"
+
+# Content hash of a file
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+# Source file of a module
+def module_source(module):
+    source = module.__file__
+    if source.endswith('.pyc'):
+        source = source[:-1]
+    return os.path.abspath(source)
+
+# The modules and every module of this project they import, directly or not, sorted by name
+# Standard library and installed packages are left out
+def project_modules(modules):
+    project_dir = os.path.dirname(module_source(audit))
+    found = {}
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module.__name__ in found or not hasattr(module, '__file__'):
+            continue
+        if os.path.dirname(module_source(module)) != project_dir:
+            continue
+        found[module.__name__] = module
+        pending.extend(value for value in vars(module).values() if isinstance(value, types.ModuleType))
+    return [found[name] for name in sorted(found)]
+
+# Hash of the rules a step runs: the source of the modules that define them and the project modules they
+# import, the JSON backend that writes the output and the step's options
+def rules_hash(modules, options):
+    h = hashlib.sha1()
+    for module in project_modules(modules):
+        with open(module_source(module), "rb") as f:
+            h.update(f.read())
+    h.update(json_codec.codec.name)
+    h.update(repr(sorted(options.items())))
+    return h.hexdigest()
+
+def load_checkpoint(file_out):
+    try:
+        with open(checkpoint_filename(file_out), "r") as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if state.get('version') != CHECKPOINT_VERSION:
+        return None
+    return state
+
+# Writes the checkpoint to a temporary file first, so a crash while saving never leaves a broken checkpoint
+def save_checkpoint(file_out, state):
+    state['version'] = CHECKPOINT_VERSION
+    tmp_file = checkpoint_filename(file_out) + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.rename(tmp_file, checkpoint_filename(file_out))
+
+# Runs a step with checkpoints
+# step(fw, input_offset, checkpoint) writes the output from input_offset on, calling checkpoint(input_offset) at
+# points it could resume from.  Output goes to file_out.partial and is renamed to file_out only once the step
+# finishes, so an existing result is never overwritten by a broken one.
+# The step is skipped if the last finished run had the same input and rules and its output is still there.
+# Returns the checkpoint state, with 'skipped' and 'resumed_from' set for this run
+def run_checkpointed(file_in, file_out, rules, step):
+    input_hash = file_hash(file_in)
+    state = load_checkpoint(file_out)
+    same_run = state is not None and state['input'] == input_hash and state['rules'] == rules
+    if same_run and state['complete'] and os.path.exists(file_out) \
+            and os.path.getsize(file_out) == state['output_offset']:
+        state['skipped'] = True
+        return state
+    partial = partial_filename(file_out)
+    if same_run and not state['complete'] and os.path.exists(partial) \
+            and os.path.getsize(partial) >= state['output_offset']:
+        # Drop anything written after the last checkpoint
+        fw = open(partial, "r+b")
+        fw.truncate(state['output_offset'])
+        fw.seek(state['output_offset'])
+        resumed_from = state['input_offset']
+    else:
+        fw = codecs.open(partial, "wb")
+        resumed_from = 0
+    state = {'input': input_hash, 'rules': rules, 'input_offset': resumed_from,
+             'output_offset': fw.tell(), 'complete': False}
+
+    def checkpoint(input_offset):
+        # Output must be on disk before the checkpoint that points past it
+        fw.flush()
+        os.fsync(fw.fileno())
+        state['input_offset'] = input_offset
+        state['output_offset'] = fw.tell()
+        save_checkpoint(file_out, state)
+
+    try:
+        step(fw, resumed_from, checkpoint)
+        fw.flush()
+        os.fsync(fw.fileno())
+        state['output_offset'] = fw.tell()
+    finally:
+        fw.close()
+    os.rename(partial, file_out)
+    state['input_offset'] = os.path.getsize(file_in)
+    state['complete'] = True
+    save_checkpoint(file_out, state)
+    state['skipped'] = False
+    state['resumed_from'] = resumed_from
+    return state
+
+# Checkpointed version of audit.stream_map
+# The OSM file is shaped in the chunks of audit.split_osm_file, and a checkpoint is saved after each one.
+# Chunks always start on a top level element, so a resumed run picks up exactly where the last chunk ended.
+def stream_map(file_in, pretty = False, parser = 'etree', chunk_size = audit.CHUNK_SIZE):
+    file_out = "{0}.json".format(file_in)
+    chunks = max(1, os.path.getsize(file_in) // chunk_size)
+    rules = rules_hash([audit], {'pretty': pretty, 'parser': parser, 'chunks': chunks})
+
+    def step(fw, input_offset, checkpoint):
+        prolog, ranges = audit.split_osm_file(file_in, chunks)
+        for start, end in ranges:
+            if end <= input_offset:
+                continue
+            text, _ = audit.shape_chunk((file_in, prolog, start, end, pretty, parser))
+            fw.write(text)
+            checkpoint(end)
+
+    return run_checkpointed(file_in, file_out, rules, step)
+
+# Reads batches of lines from input_offset on, yielding each batch with the input offset after it
+def read_batches(f, input_offset, batch_size):
+    f.seek(input_offset)
+    batch = []
+    while True:
+        line = f.readline()
+        if not line:
+            break
+        batch.append(line)
+        input_offset += len(line)
+        if len(batch) == batch_size:
+            yield batch, input_offset
+            batch = []
+    if batch:
+        yield batch, input_offset
+
+# Adds the housenumber rule counts and cache counters from a worker, as clean.clean_json does
+def merge_counts(counts, cache_counts):
+    clean.housenumber_rule_counts.update(counts)
+    for name, (hits, misses) in cache_counts.items():
+        clean.NORMALIZATION_CACHES[name].hits += hits
+        clean.NORMALIZATION_CACHES[name].misses += misses
+
+# Checkpointed version of clean.clean_json
+# Lines are cleaned in batches, serially or in a pool of workers, and a checkpoint is saved whenever another
+# checkpoint_bytes of input have been cleaned
+def clean_json(file_in, pretty = False, workers = None, batch_size = clean.BATCH_SIZE,
+               checkpoint_bytes = CHECKPOINT_BYTES):
+    file_out = file_in[:len(file_in)-9]+"_cleaned"+file_in[len(file_in)-9:]
+    rules = rules_hash([clean], {'pretty': pretty})
+
+    def step(fw, input_offset, checkpoint):
+        last_checkpoint = input_offset
+        with open(file_in, "rb") as fr:
+            batches = read_batches(fr, input_offset, batch_size)
+            if workers is None:
+                results = ((''.join([clean.clean_line(obj, pretty) for obj in batch]), offset)
+                           for batch, offset in batches)
+                pool = None
+            else:
+                # Offsets are queued as batches are handed out and taken back in the same order imap returns them
+                offsets = collections.deque()
+                def tasks():
+                    for batch, offset in batches:
+                        offsets.append(offset)
+                        yield batch, pretty
+                def worker_results():
+                    for text, counts, cache_counts in pool.imap(clean.clean_batch, tasks()):
+                        merge_counts(counts, cache_counts)
+                        yield text, offsets.popleft()
+                pool = multiprocessing.Pool(workers)
+                results = worker_results()
+            try:
+                for text, offset in results:
+                    fw.write(text)
+                    if offset - last_checkpoint >= checkpoint_bytes:
+                        checkpoint(offset)
+                        last_checkpoint = offset
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+    return run_checkpointed(file_in, file_out, rules, step)
+
+def main():
+    pprint.pprint(stream_map(osm_file_full))
+    pprint.pprint(clean_json(json_file_full))
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,19 @@
-import xml.etree.cElementTree as ET
 import pprint
 import re
-import codecs
 import json
+import logging
+import multiprocessing
+from collections import Counter
+
+import columnar
+import json_codec
+import compressed_io
 
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
-EXPECTED_STREET_NAMES = ["Avenue", "Boulevard", "Centre", "Close", "Court", "Crescent", "Diversion", "Drive", "East",
-                         "Forest", "Gate", "Grove", "Highway", "Kingsway", "Lane", "Mall", "Mews", "North", "Parkway",
-                         "Place", "Road", "South", "Street", "Terrace", "Trail", "Way", "West", "Wynd", "Broadway",
-                         "Tsawwassen", "Walk", "Park", "Alley"]
+EXPECTED_STREET_NAMES = set(["Avenue", "Boulevard", "Centre", "Close", "Court", "Crescent", "Diversion", "Drive", "East",
+                             "Forest", "Gate", "Grove", "Highway", "Kingsway", "Lane", "Mall", "Mews", "North", "Parkway",
+                             "Place", "Road", "South", "Street", "Terrace", "Trail", "Way", "West", "Wynd", "Broadway",
+                             "Tsawwassen", "Walk", "Park", "Alley"])
 EXPECTED_PROVINCE_NAMES = ["BC", "British Columbia", "british columbia", "bc", "British columbia", "Bc"]
 EXPECTED_COUNTRY_NAMES = ["CA", "Canada", "Ca", "ca", "canada"]
 STREET_NAME_MAPPING = { "Ave" : "Avenue",
@@ -86,6 +91,36 @@ SPECIFIC_HOUSENUMBER_MAPPING = { "201 City Square, 555" : ("555", "201 City Squa
                                  "3917, Army, Navy, & Airforce Veterans Club, Taurus Unit #298" : (None, "3917 Army, Navy, & Airforce Veterans Club, Taurus Unit #298")
                                  }
 
+# Patterns used to split a housenumber into (unit, housenumber), in the order they are tried
+# Each entry is (rule name, pattern, unit group, housenumber group).  P9 is ambiguous, so its groups are
+# compared by length in extract_unit_housenumber instead.
+# Case-insensitive words are spelled out as character classes so that all rules can share one regex.
+HOUSENUMBER_RULES = [
+    # Unit placed in front of the housenumber (such as #101-7885)
+    ('P1', r'#(?P<P1_unit>[0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}(?P<P1_hn>[0-9]+)', 'P1_unit', 'P1_hn'),
+    # Unit labeled as "Suite" after the housenumber with comma-separation (such as 10153, Suite 147-2153)
+    ('P2', r'(?P<P2_hn>[0-9]+)\, [Ss][Uu][Ii][Tt][Ee] #?(?P<P2_unit>[0-9A-Za-z\-\s]+)', 'P2_unit', 'P2_hn'),
+    # Unit labeled with "#" after the housenumber with comma-separation (such as 4269, #4051)
+    ('P3', r'(?P<P3_hn>[0-9]+)\, #(?P<P3_unit>[0-9\-]+)', 'P3_unit', 'P3_hn'),
+    # Formatting similar to U1 601
+    ('P4', r'(?P<P4_unit>[A-Za-z]{1,3}[0-9]{1,5}|[0-9]{1,5}[A-Za-z]{1,3})[\-\s\,]{1,3}(?P<P4_hn>[0-9]+)', 'P4_unit', 'P4_hn'),
+    # Formatting similar to Suite 110, 1333
+    ('P5', r'[Ss][Uu][Ii][Tt][Ee] #?(?P<P5_unit>[0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}(?P<P5_hn>[0-9]+)', 'P5_unit', 'P5_hn'),
+    # Formatting similar to Unit 102 -1626
+    ('P6', r'[Uu][Nn][Ii][Tt]\:? #?(?P<P6_unit>[0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}(?P<P6_hn>[0-9]+)', 'P6_unit', 'P6_hn'),
+    # Formatting similar to Studio 100 1000
+    ('P7', r'[Ss][Tt][Uu][Dd][Ii][Oo] #?(?P<P7_unit>[0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}(?P<P7_hn>[0-9]+)', 'P7_unit', 'P7_hn'),
+    # Formatting similar to 1238 #4
+    ('P8', r'(?P<P8_hn>[0-9]+)\,? #(?P<P8_unit>[0-9A-Za-z\-\s]+)', 'P8_unit', 'P8_hn'),
+    # Ambiguous formats, where the shorter of the two numbers is assumed to be the unit
+    ('P9', r'(?P<P9_first>[0-9]+)[\-\s\,]{1,3}(?P<P9_second>[0-9]+)', None, None)
+]
+
+# Number of lines cleaned per task when clean_json runs with workers
+BATCH_SIZE = 10000
+# Number of distinct values each normalization cache holds
+CACHE_SIZE = 10000
+
 # Files
 osm_file = './vancouver.osm/vancouver_sample.osm'
 json_file = './vancouver.osm/vancouver_sample.osm.json'
@@ -103,230 +138,379 @@ lower_first = re.compile(r'^([a-z])')
 street_ending = re.compile(r'(\S)+$')
 street_type_re = re.compile(r'\b\S+\.?$', re.IGNORECASE)
 contains_numbers = re.compile(r'([0-9]+)')
+# All housenumber rules as one alternation, so a single regex run finds the first rule that matches
+housenumber_re = re.compile('|'.join(['(?P<%s>^%s$)' % (name, pattern) for name, pattern, _, _ in HOUSENUMBER_RULES]))
+housenumber_groups = dict([(name, (unit, hn)) for name, _, unit, hn in HOUSENUMBER_RULES])
+
+# Number of housenumbers handled by each rule (P1-P9, MAPPING or UNRECOGNIZED)
+housenumber_rule_counts = Counter()
+logger = logging.getLogger(__name__)
 
 # Function that cleans osm json file and outputs a clean version of json
-def clean_json(file_in, pretty = False):
+# With workers set, batches of lines are cleaned in a process pool and written back in input order
+# Compressed input and output are read and written as streams (see compressed_io.py)
+def clean_json(file_in, pretty = False, workers = None, batch_size = BATCH_SIZE, columnar_out = False, file_out = None):
     # Open file for cleaned json
-    file_out = file_in[:len(file_in)-9]+"_cleaned"+file_in[len(file_in)-9:]
-    with codecs.open(file_out, "w") as fw:
+    if file_out is None:
+        file_out = cleaned_filename(file_in)
+    # Cleaned records are also written in the columnar format if asked for (see columnar.py)
+    writer = None
+    if columnar_out:
+        writer = columnar.ColumnarWriter(columnar.columnar_filename(file_out))
+    with json_codec.open_output(file_out) as fw:
         # Read dirty json file
-        with open(file_in, "r") as fr:
-            for obj in fr:
-                # Load dirty json object as dictionary
-                record = json.loads(obj)
-                # Clean dictionary object
-                write_record = True
-                # Check if dictionary object has address before cleaning
-                if 'address' in record:      
-                    # Clean address.postcode
-                    if 'postcode' in record['address']:
-                        # Remove if postal code is not Canadian
-                        m = pcode_relaxed_match.search(record['address']['postcode'])
-                        if m:
-                            # Clean postal code if necessary
-                            m = pcode_match.search(record['address']['postcode'])
-                            if not m:
-                                record['address']['postcode'] = clean_postcode(record['address']['postcode'])
-                        else:
-                            # Remove record
-                            write_record = False                          
-                    # Clean address.state
-                    if 'state' in record['address']:
-                        # Check if state is an expected province name, otherwise remove
-                        if record['address']['state'] in EXPECTED_PROVINCE_NAMES:
-                            # Transfer state value over to address.province
-                            record['address']['province'] = record['address'].pop('state', None)
-                        else:
-                            # Remove record
-                            write_record = False
-                    # Clean address.province
-                    if 'province' in record['address']:
-                        # Check if province is expected, otherwise remove
-                        if record['address']['province'] in EXPECTED_PROVINCE_NAMES:
-                            record['address']['province'] = 'British Columbia'
-                        else:
-                            # Remove record
-                            write_record = False
-                    else:
-                        # If province is not set in record, add to record
-                        if 'street' in record['address']:
-                            record['address']['province'] = 'British Columbia'
-                    # Clean address.country
-                    if 'country' in record['address']:
-                        # Check if country is expected, otherwise remove
-                        if record['address']['country'] in EXPECTED_COUNTRY_NAMES:
-                            record['address']['country'] = 'Canada'
-                        else:
-                            # Remove record
-                            write_record = False
-                    else:
-                        # If country is not set in record, add to record
-                        if 'street' in record['address']:
-                            record['address']['country'] = 'Canada'
-                    # Clean address.city
-                    if 'city' in record['address']:
-                        # Check that city and province was not merged together
-                        city_split = record['address']['city'].split(',')
-                        if(len(city_split) > 1):
-                            # Check if province merged is expected.  If not, remove record.
-                            if city_split[1].replace(' ', '') in EXPECTED_PROVINCE_NAMES:
-                                # Clean city value
-                                record['address']['city'] = city_split[0].strip()
-                            else:
-                                # Remove record
-                                write_record = False
-                        # Check that city is not in lowercase
-                        m = lower.search(record['address']['city'])
-                        if m:
-                            # Capitalize city name
-                            record['address']['city'] = record['address']['city'].capitalize()
-                    # Clean address.housename
-                    if 'housename' in record['address']:
-                        # Clean record if it contains numbers, otherwise leave alone
-                        m = contains_numbers.search(record['address']['housename'])
-                        if m:
-                            # Get value of possible house number of unit
-                            housenumber = m.group()
-                            # If record doesn't already contain a house number, use value instead.
-                            if 'housenumber' not in record['address']:
-                                record['address']['housenumber'] = housenumber
-                            else:
-                                # If house name is found in house number already, don't need to do anything more
-                                if housenumber in record['address']['housenumber']:
-                                    pass
-                                else:
-                                    # If house name isn't found in house number, append it to house number
-                                    record['address']['housenumber'] = record['address']['housenumber']+', '+record['address']['housename']
-                            # Remove housename key from record to prevent redundancy
-                            record['address'].pop('housename', None)
-                    # Clean address.housenumber
-                    if 'housenumber' in record['address']:
-                        # Check if housenumber contains unexpected characters
-                        try:
-                            record['address']['housenumber'].decode()
-                        except UnicodeEncodeError:
-                            record['address']['housenumber'] = clean_housenumber(record['address']['housenumber'])
-                        # Trim whitespaces from beginning and end of housenumber
-                        record['address']['housenumber'] = record['address']['housenumber'].lstrip()
-                        record['address']['housenumber'] = record['address']['housenumber'].rstrip()
-                        # Clean housenumber if it is not a straightforward number
-                        m = numbers.search(record['address']['housenumber'])
-                        if not m:
-                            # Extract unit from housenumber if applicable
-                            unit, hn = extract_unit_housenumber(record['address']['housenumber'])
-                            if((unit != None) and ('unit' not in record['address'])):
-                                # Add unit value to address
-                                record['address']['unit'] = unit
-                                print("Unit: "+unit)
-                            # Update housenumber value with cleaned value
-                            record['address']['housenumber'] = hn
-                            print("Housenumber: "+hn)
-                            # Updating with very specific case manually
-                            if(record['address']['housenumber'] == '205 East 10th Ave'):
-                                record['address']['housenumber'] = '205'
-                                record['address']['street'] = 'East 10th Avenue'
-                    # Clean address.street
-                    if 'street' in record['address']:
-                        # Fix specific cases manually, where it is too unique a case to solve programmatically
-                        if record['address']['street'] in SPECIFIC_STREET_NAME_MAPPING:
-                            record['address']['street'] = SPECIFIC_STREET_NAME_MAPPING[record['address']['street']]
-                        else: 
-                            # Check if street uses a different form (ie. Ave instead of Avenue)
-                            m = street_type_re.search(record['address']['street'])
-                            if m:
-                                ending = m.group()
-                                if ending not in EXPECTED_STREET_NAMES:
-                                    record['address']['street'] = update_street_name(record['address']['street'], STREET_NAME_MAPPING)
-                    # Clean address.unit
-                    if 'unit' in record['address']:
-                        # Check if unit value contains "suite"
-                        if "suite" in record['address']['unit'].lower():
-                            # Remove suite from number
-                            record['address']['unit'] = record['address']['unit'].replace('Suite', '')
-                            record['address']['unit'] = record['address']['unit'].replace('suite', '')
-                            # Trim off whitespaces from both sides
-                            record['address']['unit'] = record['address']['unit'].lstrip()
-                            record['address']['unit'] = record['address']['unit'].rstrip()
-                            
-                # Write cleaned dictionary to new json file
-                if write_record:
-                    if pretty:
-                            fw.write(json.dumps(record, indent=2)+"\n")
+        with compressed_io.open_input(file_in) as fr:
+            if workers is None:
+                # Cleaned lines are written a batch at a time
+                for batch in read_batches(fr, json_codec.WRITE_BATCH):
+                    if writer is None:
+                        fw.write(''.join([clean_line(obj, pretty) for obj in batch]))
                     else:
-                        fw.write(json.dumps(record) + "\n")
+                        lines = []
+                        for obj in batch:
+                            record = json_codec.loads(obj)
+                            if clean_record(record):
+                                writer.add(record)
+                                lines.append(json_codec.dumps_line(record, pretty))
+                        fw.write(''.join(lines))
+            else:
+                pool = multiprocessing.Pool(workers)
+                try:
+                    batches = ((batch, pretty) for batch in read_batches(fr, batch_size))
+                    for text, counts, cache_counts in pool.imap(clean_batch, batches):
+                        fw.write(text)
+                        if writer is not None:
+                            # Workers only send back JSON text, so the records are read back from it
+                            for record in iter_json_text(text):
+                                writer.add(record)
+                        # Housenumber rule counts and cache counters from the workers
+                        housenumber_rule_counts.update(counts)
+                        for name, (hits, misses) in cache_counts.items():
+                            NORMALIZATION_CACHES[name].hits += hits
+                            NORMALIZATION_CACHES[name].misses += misses
+                finally:
+                    pool.close()
+                    pool.join()
+    if writer is not None:
+        writer.close()
+
+# Name of the cleaned version of a JSON file, compressed the same way as the JSON file
+def cleaned_filename(file_in):
+    name, ext = compressed_io.split_compression(file_in)
+    return name[:len(name)-9]+"_cleaned"+name[len(name)-9:]+ext
+
+# Reads back the records from a piece of JSON output, one record per line or indented
+def iter_json_text(text):
+    decoder = json.JSONDecoder()
+    pos = 0
+    while pos < len(text):
+        record, pos = decoder.raw_decode(text, pos)
+        # Skip the newline after each record
+        pos += 1
+        yield record
+
+# Cleans a single line of dirty json and returns the cleaned json line, or an empty string if the record is removed
+def clean_line(obj, pretty = False):
+    # Load dirty json object as dictionary
+    record = json_codec.loads(obj)
+    # Write cleaned dictionary to new json file
+    if clean_record(record):
+        return json_codec.dumps_line(record, pretty)
+    return ''
+
+# Groups lines of a file into lists of batch_size lines
+def read_batches(f, batch_size):
+    batch = []
+    for line in f:
+        batch.append(line)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# Cleans a batch of lines in a worker process
+# Returns the cleaned json lines, the housenumber rule counts and the cache hits/misses for the batch
+# Cached values are kept between batches, only the counters are reset
+def clean_batch(args):
+    batch, pretty = args
+    housenumber_rule_counts.clear()
+    for cache in NORMALIZATION_CACHES.values():
+        cache.hits = 0
+        cache.misses = 0
+    text = ''.join([clean_line(obj, pretty) for obj in batch])
+    cache_counts = dict([(name, (cache.hits, cache.misses)) for name, cache in NORMALIZATION_CACHES.items()])
+    return text, dict(housenumber_rule_counts), cache_counts
+
+# Cleans a record in place
+# Returns False if the record should be removed from the cleaned dataset
+# rules defaults to CLEAN_RULES, a different list is used to time or count the rules
+def clean_record(record, rules = None):
+    write_record = True
+    # Check if dictionary object has address before cleaning
+    if 'address' in record:
+        for _, rule in rules or CLEAN_RULES:
+            if rule(record['address']) is False:
+                # Remove record
+                write_record = False
+    return write_record
+
+# Cleaning rules for the address fields, in the order clean_record applies them
+# Each rule cleans the address in place and returns False if the record should be removed
+
+# Clean address.postcode
+def clean_address_postcode(address):
+    if 'postcode' in address:
+        postcode, keep = postcode_cache(address['postcode'])
+        address['postcode'] = postcode
+        if not keep:
+            return False
+
+# Clean address.state
+def clean_address_state(address):
+    if 'state' in address:
+        # Check if state is an expected province name, otherwise remove
+        if address['state'] in EXPECTED_PROVINCE_NAMES:
+            # Transfer state value over to address.province
+            address['province'] = address.pop('state', None)
+        else:
+            return False
+
+# Clean address.province
+def clean_address_province(address):
+    if 'province' in address:
+        province, keep = province_cache(address['province'])
+        address['province'] = province
+        if not keep:
+            return False
+    else:
+        # If province is not set in record, add to record
+        if 'street' in address:
+            address['province'] = 'British Columbia'
+
+# Clean address.country
+def clean_address_country(address):
+    if 'country' in address:
+        # Check if country is expected, otherwise remove
+        if address['country'] in EXPECTED_COUNTRY_NAMES:
+            address['country'] = 'Canada'
+        else:
+            return False
+    else:
+        # If country is not set in record, add to record
+        if 'street' in address:
+            address['country'] = 'Canada'
+
+# Clean address.city
+def clean_address_city(address):
+    if 'city' in address:
+        city, keep = city_cache(address['city'])
+        address['city'] = city
+        if not keep:
+            return False
+
+# Clean address.housename
+def clean_address_housename(address):
+    if 'housename' in address:
+        # Clean record if it contains numbers, otherwise leave alone
+        m = contains_numbers.search(address['housename'])
+        if m:
+            # Get value of possible house number of unit
+            housenumber = m.group()
+            # If record doesn't already contain a house number, use value instead.
+            if 'housenumber' not in address:
+                address['housenumber'] = housenumber
+            else:
+                # If house name is found in house number already, don't need to do anything more
+                if housenumber in address['housenumber']:
+                    pass
+                else:
+                    # If house name isn't found in house number, append it to house number
+                    address['housenumber'] = address['housenumber']+', '+address['housename']
+            # Remove housename key from record to prevent redundancy
+            address.pop('housename', None)
+
+# Clean address.housenumber
+def clean_address_housenumber(address):
+    if 'housenumber' in address:
+        # Check if housenumber contains unexpected characters
+        try:
+            address['housenumber'].decode()
+        except UnicodeEncodeError:
+            address['housenumber'] = clean_housenumber(address['housenumber'])
+        # Trim whitespaces from beginning and end of housenumber
+        address['housenumber'] = address['housenumber'].lstrip()
+        address['housenumber'] = address['housenumber'].rstrip()
+        # Clean housenumber if it is not a straightforward number
+        m = numbers.search(address['housenumber'])
+        if not m:
+            # Extract unit from housenumber if applicable
+            unit, hn = extract_unit_housenumber(address['housenumber'])
+            if((unit != None) and ('unit' not in address)):
+                # Add unit value to address
+                address['unit'] = unit
+                logger.debug("Unit: %s", unit)
+            # Update housenumber value with cleaned value
+            address['housenumber'] = hn
+            logger.debug("Housenumber: %s", hn)
+            # Updating with very specific case manually
+            if(address['housenumber'] == '205 East 10th Ave'):
+                address['housenumber'] = '205'
+                address['street'] = 'East 10th Avenue'
+
+# Clean address.street
+def clean_address_street(address):
+    if 'street' in address:
+        address['street'] = street_cache(address['street'])
+
+# Clean address.unit
+def clean_address_unit(address):
+    if 'unit' in address:
+        # Check if unit value contains "suite"
+        if "suite" in address['unit'].lower():
+            # Remove suite from number
+            address['unit'] = address['unit'].replace('Suite', '')
+            address['unit'] = address['unit'].replace('suite', '')
+            # Trim off whitespaces from both sides
+            address['unit'] = address['unit'].lstrip()
+            address['unit'] = address['unit'].rstrip()
+
+# (address field, rule) pairs
+CLEAN_RULES = [('postcode', clean_address_postcode),
+               ('state', clean_address_state),
+               ('province', clean_address_province),
+               ('country', clean_address_country),
+               ('city', clean_address_city),
+               ('housename', clean_address_housename),
+               ('housenumber', clean_address_housenumber),
+               ('street', clean_address_street),
+               ('unit', clean_address_unit)]
+
+# Returns the cleaned postal code and whether the record should be kept
+def normalize_postcode(postcode):
+    # Remove if postal code is not Canadian
+    m = pcode_relaxed_match.search(postcode)
+    if m:
+        # Clean postal code if necessary
+        m = pcode_match.search(postcode)
+        if not m:
+            postcode = clean_postcode(postcode)
+        return (postcode, True)
+    return (postcode, False)
+
+# Returns the cleaned province and whether the record should be kept
+def normalize_province(province):
+    # Check if province is expected, otherwise remove
+    if province in EXPECTED_PROVINCE_NAMES:
+        return ('British Columbia', True)
+    return (province, False)
+
+# Returns the cleaned city and whether the record should be kept
+def normalize_city(city):
+    keep = True
+    # Check that city and province was not merged together
+    city_split = city.split(',')
+    if(len(city_split) > 1):
+        # Check if province merged is expected.  If not, remove record.
+        if city_split[1].replace(' ', '') in EXPECTED_PROVINCE_NAMES:
+            # Clean city value
+            city = city_split[0].strip()
+        else:
+            keep = False
+    # Check that city is not in lowercase
+    m = lower.search(city)
+    if m:
+        # Capitalize city name
+        city = city.capitalize()
+    return (city, keep)
+
+# Returns the cleaned street name
+def normalize_street(street):
+    # Fix specific cases manually, where it is too unique a case to solve programmatically
+    if street in SPECIFIC_STREET_NAME_MAPPING:
+        return SPECIFIC_STREET_NAME_MAPPING[street]
+    # Check if street uses a different form (ie. Ave instead of Avenue)
+    m = street_type_re.search(street)
+    if m:
+        ending = m.group()
+        if ending not in EXPECTED_STREET_NAMES:
+            street = update_street_name(street, STREET_NAME_MAPPING)
+    return street
+
+# Bounded cache of normalized values
+# Values repeat heavily across records (Main Street, Vancouver, BC, ...), so most lookups skip the regex work.
+# A hit is one lookup in a plain dictionary.  When the dictionary fills up it becomes the previous generation and a
+# new one is started, and values found in the previous generation are moved back into the new one, so values that
+# are still in use survive while the rest are dropped with the old dictionary.
+class NormalizationCache(object):
+    def __init__(self, func, maxsize = CACHE_SIZE):
+        self.func = func
+        self.maxsize = maxsize
+        self.data = {}
+        self.previous = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, value):
+        try:
+            result = self.data[value]
+            self.hits += 1
+            return result
+        except KeyError:
+            pass
+        try:
+            result = self.previous[value]
+            self.hits += 1
+        except KeyError:
+            result = self.func(value)
+            self.misses += 1
+        if len(self.data) >= self.maxsize:
+            self.previous = self.data
+            self.data = {}
+        self.data[value] = result
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.data) + len(self.previous),
+                'hit_ratio': round(float(self.hits) / lookups, 4) if lookups else None}
+
+# Normalization caches used by clean_record
+postcode_cache = NormalizationCache(normalize_postcode)
+province_cache = NormalizationCache(normalize_province)
+city_cache = NormalizationCache(normalize_city)
+street_cache = NormalizationCache(normalize_street)
+NORMALIZATION_CACHES = {'postcode': postcode_cache, 'province': province_cache, 'city': city_cache, 'street': street_cache}
+
+# Hit/miss counters and hit ratio for each normalization cache
+def cache_stats():
+    return dict([(name, cache.stats()) for name, cache in NORMALIZATION_CACHES.items()])
 
 # Extract unit from housenumber
 # Function will try to recognize a pattern in the housenumber and extract the unit and housenumber from it
 # If function cannot match a pattern, it will return None for unit and the original housenumber value for housenumber
+# The rule that handled the value is counted in housenumber_rule_counts and logged at debug level
 def extract_unit_housenumber(s):
-    print "================"
-    print "Attempting to match: "+s
-    # Match for formatting where the unit is placed in front of the housenumber (such as #101-7885)
-    p1 = re.compile(r'^#([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$')
-    m = p1.search(s)
-    if m:
-        print "MATCHED by P1: "+s
-        return (m.group(1), m.group(2))
-    # Match for formatting where the unit is labeled as "Suite" after the housenumber with comma-separation (such as 10153, Suite 147-2153)
-    p2 = re.compile(r'^([0-9]+)\, suite #?([0-9A-Za-z\-\s]+)$', re.IGNORECASE)
-    m = p2.search(s)
-    if m:
-        print "MATCHED by P2: "+s
-        return (m.group(2), m.group(1))
-    # Match for formatting where the unit is labeled with "#" after the housenumber with comma-separation (such as 4269, #4051)
-    p3 = re.compile(r'^([0-9]+)\, #([0-9\-]+)$')
-    m = p3.search(s)
-    if m:
-        print "MATCHED by P3: "+s
-        return (m.group(2), m.group(1))
-    # Match for formatting similar to U1 601
-    p4 = re.compile(r'^([A-Za-z]{1,3}[0-9]{1,5}|[0-9]{1,5}[A-Za-z]{1,3})[\-\s\,]{1,3}([0-9]+)$')
-    m = p4.search(s)
-    if m:
-        print "MATCHED by P4: "+s
-        return (m.group(1), m.group(2))
-    # Match for formatting similar to Suite 110, 1333
-    p5 = re.compile(r'^suite #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
-    m = p5.search(s)
+    m = housenumber_re.match(s)
     if m:
-        print "MATCHED by P5: "+s
-        return (m.group(1), m.group(2))
-    # Match for formatting similar to Unit 102 -1626
-    p6 = re.compile(r'^unit\:? #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
-    m = p6.search(s)
-    if m:
-        print "MATCHED by P6: "+s
-        return (m.group(1), m.group(2))
-    # Match for formatting similar to Studio 100 1000
-    p7 = re.compile(r'^studio #?([0-9]{1,5}[A-Za-z]{0,3})[\-\s\,]{1,3}([0-9]+)$', re.IGNORECASE)
-    m = p7.search(s)
-    if m:
-        print "MATCHED by P7: "+s
-        return (m.group(1), m.group(2))
-    # Match for formatting similar to 1238 #4
-    p8 = re.compile(r'^([0-9]+)\,? #([0-9A-Za-z\-\s]+)$', re.IGNORECASE)
-    m = p8.search(s)
-    if m:
-        print "MATCHED by P8: "+s
-        return (m.group(2), m.group(1))
-    # Match for ambiguous formats, but will assume that the shorter of the two strings is unit
-    # If both strings are equal in length, it is too ambiguous to extract
-    p9 = re.compile(r'^([0-9]+)[\-\s\,]{1,3}([0-9]+)$')
-    m = p9.search(s)
-    if m:
-        # Check if there is any difference in length
-        if(len(m.group(1)) < len(m.group(2))):  
-            print "MATCHED by P9: "+s
-            return (m.group(1), m.group(2))
-        elif(len(m.group(1)) > len(m.group(2))):
-            print "MATCHED by P9: "+s
-            return (m.group(2), m.group(1))
+        rule = m.lastgroup
+        if rule != 'P9':
+            unit, hn = housenumber_groups[rule]
+            return matched_housenumber(rule, s, (m.group(unit), m.group(hn)))
+        # Check if there is any difference in length, otherwise it is too ambiguous to extract
+        first, second = m.group('P9_first'), m.group('P9_second')
+        if(len(first) < len(second)):
+            return matched_housenumber(rule, s, (first, second))
+        elif(len(first) > len(second)):
+            return matched_housenumber(rule, s, (second, first))
     # Some cases needed to be manually mapped because they were too unique
     if s in SPECIFIC_HOUSENUMBER_MAPPING:
-        print "MATCHED by MAPPING: "+s
-        return SPECIFIC_HOUSENUMBER_MAPPING[s]
-    # If we made it here, then no patterns were recognized, so just return original 
-    print "COULD NOT RECOGNIZE PATTERN: "+s
+        return matched_housenumber('MAPPING', s, SPECIFIC_HOUSENUMBER_MAPPING[s])
+    # If we made it here, then no patterns were recognized, so just return original
+    housenumber_rule_counts['UNRECOGNIZED'] += 1
+    logger.debug("COULD NOT RECOGNIZE PATTERN: %s", s)
     # Do basic cleaning of housenumber for consistency
     s = s.replace(';', '-')
     s = s.replace(' - ', '-')
@@ -334,6 +518,12 @@ def extract_unit_housenumber(s):
     s = s.replace(':', '')
     s = s.replace(',', '-')
     return (None, s)
+
+# Records which rule matched a housenumber and passes its (unit, housenumber) result through
+def matched_housenumber(rule, s, result):
+    housenumber_rule_counts[rule] += 1
+    logger.debug("MATCHED by %s: %s", rule, s)
+    return result
     
 # Returns a better street name for given street name
 def update_street_name(name, mapping):
@@ -365,12 +555,14 @@ def clean_postcode(old_pcode):
         new_pcode = old_pcode[:3]+' '+old_pcode[3:]
         return new_pcode
     else:
-        print 'Error occurred in clean_pcode(): pcode string length does not match 6 characters' 
+        logger.warning('Error occurred in clean_pcode(): pcode string length does not match 6 characters')
         return False
 
 def main():
     # clean_json(json_file)
+    # clean_json(json_file_full, workers=multiprocessing.cpu_count())
     clean_json(json_file_full)
+    pprint.pprint(cache_stats())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import codecs
+import pprint
+import shutil
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import compressed_io
+import string_table
+
+'''
+Columnar layout (a directory ending in .osmc)
+
+meta.json          number of records and the names of the address columns
+strings.json       string table of the run that wrote the directory, a list of distinct values indexed by code
+                   (see string_table.py)
+type.npy, visible.npy, created.<field>.npy, address.<field>.npy
+                   int32 codes into the string table, -1 where the record has no value
+id.npy             int64 ids, -1 where the id is not a plain integer (the id is then kept in the tag table)
+lat.npy, lon.npy   float64 positions, NaN for records without "pos"
+node_refs.npy      int64 node refs of all records, one after another
+node_refs_offsets.npy
+                   int64, record i's node refs are node_refs[offsets[i]:offsets[i+1]], -1 for records without refs
+member_type.npy, member_ref.npy, member_role.npy, members_offsets.npy
+                   relation members, laid out like node_refs with the type and role dictionary-encoded
+tag_record.npy, tag_key.npy, tag_value.npy
+                   every other top level key as (record, key code, value code) triplets
+'''
+
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+INT64_TYPECODE = 'l'
+INT32_TYPECODE = 'i'
+MISSING = -1
+# Top level keys with their own columns, everything else goes into the tag table
+COLUMN_KEYS = set(['type', 'id', 'visible', 'pos', 'created', 'address', 'node_refs', 'members'])
+CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
+# Records added before the writer appends its columns to their files
+FLUSH_ROWS = 65536
+# Bytes copied at a time when a column file is turned into a .npy file
+COPY_BUFFER = 1024 * 1024
+# File the string table is exported to inside a columnar directory
+STRINGS_FILE = 'strings.json'
+
+# Same patterns as the audit module
+pcode_match = re.compile(r'^V[0-9][A-Z] [0-9][A-Z][0-9]$')
+street_ending = re.compile(r'(\S)+$')
+
+# Files
+json_file_full = './vancouver.osm/vancouver.osm.json'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+
+# Name of the columnar output that goes with a JSON output file, compressed or not
+def columnar_filename(json_filename):
+    json_filename = compressed_io.split_compression(json_filename)[0]
+    if json_filename.endswith('.json'):
+        json_filename = json_filename[:-5]
+    return json_filename + '.osmc'
+
+# Column of numbers that is appended to a file on disk in chunks, so only the latest chunk is held in memory
+# save turns the file into a .npy file.  len is the number of values in the column, on disk or not.
+class SpooledColumn(object):
+    def __init__(self, filename, typecode, dtype, missing_rows = 0):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.f = open(filename + '.part', 'wb')
+        self.values = array(typecode)
+        self.flushed = 0
+        # A column that starts late has no values for the records before it
+        for start in xrange(0, missing_rows, FLUSH_ROWS):
+            self.values.extend(array(typecode, [MISSING]) * min(FLUSH_ROWS, missing_rows - start))
+            self.flush()
+
+    def append(self, value):
+        self.values.append(value)
+
+    def extend(self, values):
+        self.values.extend(values)
+
+    def __len__(self):
+        return self.flushed + len(self.values)
+
+    def flush(self):
+        self.values.tofile(self.f)
+        self.flushed += len(self.values)
+        del self.values[:]
+
+    # Writes the column as a .npy file, which is a header followed by the raw values
+    def save(self):
+        self.flush()
+        self.f.close()
+        with open(self.filename + '.npy', 'wb') as fw:
+            np.lib.format.write_array_header_1_0(fw, {'descr': np.lib.format.dtype_to_descr(self.dtype),
+                                                      'fortran_order': False, 'shape': (self.flushed,)})
+            with open(self.filename + '.part', 'rb') as fr:
+                shutil.copyfileobj(fr, fw, COPY_BUFFER)
+        os.remove(self.filename + '.part')
+
+# Column of values stored as int32 codes into a string_table.StringTable
+# codes is a SpooledColumn, and the distinct values stay in memory in the table
+class DictionaryColumn(object):
+    def __init__(self, codes, strings):
+        self.codes = codes
+        self.strings = strings
+
+    def append(self, value):
+        self.codes.append(self.strings.encode(value))
+
+    def append_missing(self):
+        self.codes.append(MISSING)
+
+# Collects shaped records into compact arrays and writes them out as a columnar directory
+# Columns are appended to files in the directory every FLUSH_ROWS records, so the numbers don't build up in
+# memory.  The distinct values of the dictionary columns are kept in a string table until close, so memory still
+# grows with the number of distinct users, streets, tag values and so on, but not with the number of records.
+# strings is the string table of the run, which is exported into the directory.  A new one is made if it's None.
+class ColumnarWriter(object):
+    def __init__(self, path, strings = None):
+        if np is None:
+            raise ImportError("numpy is required to write the columnar format")
+        if not os.path.exists(path):
+            os.makedirs(path)
+        if strings is None:
+            strings = string_table.StringTable()
+        self.path = path
+        self.strings = strings
+        self.rows = 0
+        self.spooled = []
+        self.type = self.dictionary_column('type')
+        self.visible = self.dictionary_column('visible')
+        self.created = dict([(c, self.dictionary_column('created.' + c)) for c in CREATED])
+        self.address = {}
+        self.ids = self.column('id', INT64_TYPECODE, np.int64)
+        self.lat = self.column('lat', 'd', np.float64)
+        self.lon = self.column('lon', 'd', np.float64)
+        self.node_refs = self.column('node_refs', INT64_TYPECODE, np.int64)
+        self.node_refs_offsets = self.column('node_refs_offsets', INT64_TYPECODE, np.int64)
+        self.member_type = self.dictionary_column('member_type')
+        self.member_ref = self.column('member_ref', INT64_TYPECODE, np.int64)
+        self.member_role = self.dictionary_column('member_role')
+        self.members_offsets = self.column('members_offsets', INT64_TYPECODE, np.int64)
+        self.tag_record = self.column('tag_record', INT64_TYPECODE, np.int64)
+        self.tag_key = self.dictionary_column('tag_key')
+        self.tag_value = self.dictionary_column('tag_value')
+
+    def column(self, name, typecode, dtype, missing_rows = 0):
+        column = SpooledColumn(os.path.join(self.path, name), typecode, dtype, missing_rows)
+        self.spooled.append(column)
+        return column
+
+    def dictionary_column(self, name, missing_rows = 0):
+        return DictionaryColumn(self.column(name, INT32_TYPECODE, np.int32, missing_rows), self.strings)
+
+    def add(self, record):
+        row = self.rows
+        self.add_value(self.type, record, 'type')
+        self.add_value(self.visible, record, 'visible')
+        # Ids go in the int64 column when they round-trip exactly, otherwise in the tag table
+        osm_id = record.get('id')
+        if osm_id is not None and numeric(osm_id):
+            self.ids.append(int(osm_id))
+        else:
+            self.ids.append(MISSING)
+            if osm_id is not None:
+                self.add_tag(row, 'id', osm_id)
+        if 'pos' in record:
+            self.lat.append(record['pos'][0])
+            self.lon.append(record['pos'][1])
+        else:
+            self.lat.append(float('nan'))
+            self.lon.append(float('nan'))
+        created = record.get('created', {})
+        for c in CREATED:
+            self.add_value(self.created[c], created, c)
+        address = record.get('address', {})
+        for key in address:
+            if key not in self.address:
+                # Earlier records don't have this address field
+                self.address[key] = self.dictionary_column('address.' + key, row)
+        for key, column in self.address.items():
+            self.add_value(column, address, key)
+        if 'node_refs' in record:
+            self.node_refs_offsets.append(len(self.node_refs))
+            self.node_refs.extend([int(ref) for ref in record['node_refs']])
+        else:
+            self.node_refs_offsets.append(MISSING)
+        if 'members' in record:
+            self.members_offsets.append(len(self.member_ref))
+            for member in record['members']:
+                self.member_type.append(member['type'])
+                self.member_ref.append(int(member['ref']))
+                self.member_role.append(member['role'])
+        else:
+            self.members_offsets.append(MISSING)
+        for key, value in record.items():
+            if key not in COLUMN_KEYS:
+                self.add_tag(row, key, value)
+        self.rows += 1
+        if self.rows % FLUSH_ROWS == 0:
+            for column in self.spooled:
+                column.flush()
+
+    def add_value(self, column, data, key):
+        if key in data:
+            column.append(data[key])
+        else:
+            column.append_missing()
+
+    def add_tag(self, row, key, value):
+        self.tag_record.append(row)
+        self.tag_key.append(key)
+        self.tag_value.append(value)
+
+    def close(self):
+        # Closing offsets, so record i's refs always end at the next non-missing offset
+        self.node_refs_offsets.append(len(self.node_refs))
+        self.members_offsets.append(len(self.member_ref))
+        for column in self.spooled:
+            column.save()
+        self.strings.export(os.path.join(self.path, STRINGS_FILE))
+        with codecs.open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'rows': self.rows, 'address': sorted(self.address)}, f)
+
+# Checks that a value is an integer written the way str(int) would write it
+def numeric(value):
+    try:
+        return str(int(value)) == value
+    except ValueError:
+        return False
+
+# Columns of a columnar directory, loaded as memory mapped NumPy arrays
+class Columns(object):
+    def __init__(self, path):
+        if np is None:
+            raise ImportError("numpy is required to read the columnar format")
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.address_fields = meta['address']
+        self.strings = string_table.StringTable.load(os.path.join(path, STRINGS_FILE))
+        self.values = self.strings.values
+
+    def __getitem__(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    # Distinct values that appear in a dictionary column
+    def uniques(self, name, codes = None):
+        if codes is None:
+            codes = self[name]
+        values = self.values
+        return set([values[code] for code in np.unique(codes[codes >= 0])])
+
+    # Boolean mask over a column's codes, from testing each distinct value of the column once
+    def value_mask(self, name, test):
+        codes = self[name]
+        matches = np.zeros(len(self.values) + 1, dtype=bool)
+        for code in np.unique(codes[codes >= 0]):
+            matches[code] = bool(test(self.values[code]))
+        # Missing values (-1) index the trailing False
+        return matches[codes]
+
+    # Rebuilds the records as dictionaries, in their original order
+    def iter_records(self):
+        names = ['type', 'visible'] + ['created.' + c for c in CREATED] + ['address.' + a for a in self.address_fields]
+        codes = dict([(name, self[name]) for name in names])
+        ids, lat, lon = self['id'], self['lat'], self['lon']
+        node_refs, offsets = self['node_refs'], self['node_refs_offsets']
+        member_type, member_ref, member_role = self['member_type'], self['member_ref'], self['member_role']
+        members_offsets = self['members_offsets']
+        tag_record, tag_key, tag_value = self['tag_record'], self['tag_key'], self['tag_value']
+        t = 0
+        for row in xrange(self.rows):
+            record = {}
+            self.decode(record, 'type', codes['type'][row])
+            if ids[row] != MISSING:
+                record['id'] = str(ids[row])
+            self.decode(record, 'visible', codes['visible'][row])
+            if not np.isnan(lat[row]):
+                record['pos'] = [float(lat[row]), float(lon[row])]
+            record['created'] = {}
+            for c in CREATED:
+                self.decode(record['created'], c, codes['created.' + c][row])
+            address = {}
+            for a in self.address_fields:
+                self.decode(address, a, codes['address.' + a][row])
+            if address:
+                record['address'] = address
+            if offsets[row] != MISSING:
+                # Refs run until the next record that has any
+                end = row + 1
+                while offsets[end] == MISSING:
+                    end += 1
+                record['node_refs'] = [str(ref) for ref in node_refs[offsets[row]:offsets[end]]]
+            if members_offsets[row] != MISSING:
+                end = row + 1
+                while members_offsets[end] == MISSING:
+                    end += 1
+                record['members'] = [{'type': self.values[member_type[m]],
+                                      'ref': str(member_ref[m]),
+                                      'role': self.values[member_role[m]]}
+                                     for m in xrange(members_offsets[row], members_offsets[end])]
+            while t < len(tag_record) and tag_record[t] == row:
+                record[self.values[tag_key[t]]] = self.values[tag_value[t]]
+                t += 1
+            yield record
+
+    def decode(self, data, key, code):
+        if code != MISSING:
+            data[key] = self.values[code]
+
+# Converts a JSON-lines file to the columnar format
+def json_to_columnar(filename, path = None):
+    if path is None:
+        path = columnar_filename(filename)
+    writer = ColumnarWriter(path)
+    with open(filename, "r") as f:
+        for line in f:
+            writer.add(json.loads(line))
+    writer.close()
+    return path
+
+# Vectorized version of audit.audit_address over a columnar directory, returning the same result
+def audit_address_columnar(path):
+    columns = Columns(path)
+    fields = dict([(a, columns['address.' + a]) for a in columns.address_fields])
+    has_address = np.zeros(columns.rows, dtype=bool)
+    for codes in fields.values():
+        has_address |= codes >= 0
+    data = {}
+    data['counter'] = int(has_address.sum())
+    data['total'] = columns.rows
+    data['attributes'] = set([a for a, codes in fields.items() if (codes >= 0).any()])
+    empty = np.zeros(columns.rows, dtype=np.int32) - 1
+    def field(name):
+        return fields.get(name, empty)
+    def count(name):
+        return int((field(name) >= 0).sum())
+    def uniques(name, codes = None):
+        if name not in fields:
+            return set()
+        return columns.uniques('address.' + name, codes)
+    for key, name in [('cities', 'city'), ('countries', 'country'), ('provinces', 'province'), ('states', 'state'),
+                      ('units', 'unit'), ('housenames', 'housename'), ('housenumbers', 'housenumber')]:
+        data[key] = {'count': count(name), 'uniques': uniques(name)}
+    # Postal codes that are not expected
+    pcode = set()
+    if 'postcode' in fields:
+        mask = columns.value_mask('address.postcode', lambda value: not pcode_match.search(value))
+        pcode = uniques('postcode', fields['postcode'][mask])
+    data['postcodes'] = {'count': count('postcode'), 'unexpected': pcode}
+    # Street ending variations
+    streets = set()
+    if 'street' in fields:
+        for value in uniques('street'):
+            m = street_ending.search(value)
+            if m:
+                streets.add(m.group())
+    data['streets'] = {'count': count('street'), 'uniques': streets}
+    return data
+
+# Vectorized version of audit.audit_created_by over a columnar directory, returning the same result
+def audit_created_by_columnar(path):
+    columns = Columns(path)
+    data = {}
+    code = columns.strings.find('created_by')
+    rows = np.zeros(0, dtype=np.int64)
+    values = set()
+    if code is not None:
+        mask = columns['tag_key'] == code
+        rows = columns['tag_record'][mask]
+        values = columns.uniques('tag_value', columns['tag_value'][mask])
+    data[len(rows)] = values
+    data['total'] = columns.rows
+    data['types'] = columns.uniques('type', columns['type'][rows])
+    return data
+
+def main():
+    # json_to_columnar(json_file_full)
+    path = json_to_columnar(clean_json_file_full)
+    pprint.pprint(audit_address_columnar(path))
+
+if __name__ == "__main__":
+    main()
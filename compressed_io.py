@@ -0,0 +1,208 @@
+import bz2
+import gzip
+import io
+import signal
+import subprocess
+from distutils.spawn import find_executable
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression formats, by file extension
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst')
+# Command line tools that decompress to stdout, best first.  pigz, lbzip2, pbzip2, xz -T0 and zstd -T0 use several
+# threads, and any of them runs in its own process next to the parser, so decompression never holds up Python.
+DECOMPRESSORS = {'.gz': [['pigz', '-dc'], ['gzip', '-dc']],
+                 '.bz2': [['lbzip2', '-dc'], ['pbzip2', '-dc'], ['bzip2', '-dc']],
+                 '.xz': [['xz', '-dc', '-T0']],
+                 '.zst': [['zstd', '-dcq']]}
+# Command line tools that compress stdin to stdout, best first
+COMPRESSORS = {'.gz': [['pigz', '-c'], ['gzip', '-c']],
+               '.bz2': [['lbzip2', '-c'], ['pbzip2', '-c'], ['bzip2', '-c']],
+               '.xz': [['xz', '-c', '-T0']],
+               '.zst': [['zstd', '-cq', '-T0']]}
+# Buffer size of the pipes to and from the tools
+PIPE_BUFFER = 1024 * 1024
+# Compressed bytes read at a time by the in-process bzip2 reader
+READ_BLOCK = 1024 * 1024
+
+# Splits a file name into its name without the compression extension and the extension, which is '' for
+# uncompressed files
+def split_compression(filename):
+    for ext in COMPRESSED_EXTENSIONS:
+        if filename.endswith(ext):
+            return filename[:-len(ext)], ext
+    return filename, ''
+
+def is_compressed(filename):
+    return split_compression(filename)[1] != ''
+
+# PBF is a binary format, not compressed XML, so it can't be streamed into the XML parsers
+def check_supported(filename):
+    if split_compression(filename)[0].endswith('.pbf'):
+        raise ValueError("{0} is in the PBF format, which isn't supported. "
+                         "Convert it to XML first (such as with osmium cat -o file.osm.bz2)".format(filename))
+
+# First tool from a list that is on the PATH
+def find_tool(commands):
+    for command in commands:
+        if find_executable(command[0]):
+            return command
+    return None
+
+# File object for the stdin or stdout of a compression tool
+# Closing it waits for the tool to finish and raises IOError if the tool failed
+class PipeFile(object):
+    def __init__(self, process, f, name, command):
+        self.process = process
+        self.f = f
+        self.name = name
+        self.command = ' '.join(command)
+
+    def read(self, size = -1):
+        return self.f.read(size)
+
+    def readline(self, size = -1):
+        return self.f.readline(size)
+
+    def __iter__(self):
+        return iter(self.f)
+
+    def write(self, text):
+        self.f.write(text)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.close()
+        status = self.process.wait()
+        # A reader that stops early closes the pipe and the tool gets SIGPIPE, which isn't an error
+        if status != 0 and status != -signal.SIGPIPE:
+            raise IOError("{0} exited with status {1} for {2}".format(self.command, status, self.name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Opens a file for reading, decompressing it on the fly if its extension says it's compressed
+# Decompression runs in a separate tool process feeding a pipe when one is installed, otherwise in this process.
+# Nothing is decompressed to disk.
+def open_input(filename):
+    check_supported(filename)
+    ext = split_compression(filename)[1]
+    if not ext:
+        return open(filename, "rb")
+    command = find_tool(DECOMPRESSORS[ext])
+    if command is not None:
+        # close_fds keeps other pipes from leaking into the tool, which would stop them from ever seeing the end
+        process = subprocess.Popen(command + [filename], stdout=subprocess.PIPE, bufsize=PIPE_BUFFER, close_fds=True)
+        return PipeFile(process, process.stdout, filename, command)
+    return open_module(filename, ext, "rb")
+
+# Opens a file for writing, compressing it on the fly if its extension asks for compression
+def open_output(filename, buffering = -1):
+    ext = split_compression(filename)[1]
+    if not ext:
+        return open(filename, "w", buffering)
+    command = find_tool(COMPRESSORS[ext])
+    if command is not None:
+        with open(filename, "wb") as f:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=f, bufsize=PIPE_BUFFER, close_fds=True)
+        return PipeFile(process, process.stdin, filename, command)
+    return open_module(filename, ext, "wb")
+
+# In-process fallback for when no tool is installed
+def open_module(filename, ext, mode):
+    if ext == '.gz':
+        return gzip.open(filename, mode)
+    if ext == '.bz2':
+        if 'r' in mode:
+            return io.BufferedReader(MultiStreamBZ2Reader(filename), PIPE_BUFFER)
+        return bz2.BZ2File(filename, mode)
+    if ext == '.xz':
+        if lzma is None:
+            raise ImportError("xz or backports.lzma is required for {0}".format(filename))
+        return lzma.open(filename, mode)
+    if zstandard is None:
+        raise ImportError("zstd or zstandard is required for {0}".format(filename))
+    if 'r' in mode:
+        # Buffered so that lines can be read from it
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, "rb")))
+    return zstandard.ZstdCompressor().stream_writer(open(filename, "wb"))
+
+# Raw reader for .bz2 files made of several streams one after another, as pbzip2 and lbzip2 write them
+# Python 2's bz2.BZ2File stops after the first stream without any error, so each stream is decoded in turn with a
+# new BZ2Decompressor.  A file that ends in the middle of a stream raises IOError rather than returning part of it.
+class MultiStreamBZ2Reader(io.RawIOBase):
+    def __init__(self, filename):
+        self.name = filename
+        self.f = open(filename, "rb")
+        self.decompressor = bz2.BZ2Decompressor()
+        # Whether the current decompressor has been given any data
+        self.started = False
+        self.pending = ''
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.pos == len(self.pending):
+            self.pending = self.fill()
+            self.pos = 0
+        n = min(len(b), len(self.pending) - self.pos)
+        b[:n] = self.pending[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    # Next piece of decompressed data, or '' at the end of the file
+    def fill(self):
+        while True:
+            data = self.f.read(READ_BLOCK)
+            if not data:
+                if self.started:
+                    try:
+                        self.decompressor.decompress('')
+                    except EOFError:
+                        # The last stream is complete
+                        return ''
+                    raise IOError("{0} ends in the middle of a bzip2 stream".format(self.name))
+                return ''
+            decompressed = self.decompress(data)
+            if decompressed:
+                return decompressed
+
+    def decompress(self, data):
+        parts = []
+        while data:
+            try:
+                parts.append(self.decompressor.decompress(data))
+            except EOFError:
+                # The previous stream ended exactly at the end of the last block read, so this is the next stream
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            self.started = True
+            data = self.decompressor.unused_data
+            if data:
+                self.decompressor = bz2.BZ2Decompressor()
+        return ''.join(parts)
+
+    def close(self):
+        if not self.closed:
+            self.f.close()
+        io.RawIOBase.close(self)
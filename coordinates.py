@@ -0,0 +1,150 @@
+import json
+import codecs
+import pprint
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Generous (min lat, min lon, max lat, max lon) box around the Vancouver metro extract
+VANCOUVER_BBOX = (48.9, -123.5, 49.6, -122.2)
+# Number of records whose positions are checked together
+BATCH_SIZE = 100000
+# Field set on records outside the area when the stage flags instead of dropping them
+OUTSIDE_FIELD = 'outside_area'
+
+# Files
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+# Boundary of relation 1852574 in the Osmosis .poly format
+vancouver_poly_file = './vancouver.osm/vancouver.poly'
+
+# Reads a polygon in the Osmosis .poly format into a list of rings of (lat, lon) points
+# Holes (sections starting with "!") are returned like any other ring, since point_in_polygon uses the
+# even-odd rule and a point inside a hole crosses one more ring
+def load_poly(filename):
+    rings = []
+    ring = None
+    with open(filename, "r") as f:
+        # First line is the polygon's name
+        f.readline()
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line == 'END':
+                if ring is None:
+                    break
+                rings.append(ring)
+                ring = None
+            elif ring is None:
+                # Section name, "1", "2", "!2", ...
+                ring = []
+            else:
+                lon, lat = line.split()[:2]
+                ring.append((float(lat), float(lon)))
+    return rings
+
+# Checks which points fall inside a bounding box of (min lat, min lon, max lat, max lon)
+def in_bbox(lat, lon, bbox):
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+
+# Vectorized even-odd point in polygon test over arrays of points
+# Points are sorted by latitude once, so each edge only tests the slice of points in its latitude band
+# instead of every point
+def point_in_polygon(lat, lon, rings):
+    order = np.argsort(lat, kind='mergesort')
+    sorted_lat = lat[order]
+    sorted_lon = lon[order]
+    crossings = np.zeros(len(lat), dtype=np.int32)
+    for ring in rings:
+        points = np.asarray(ring, dtype=np.float64)
+        lat0, lon0 = points[:, 0], points[:, 1]
+        # Each point is joined to the next one, and the last point back to the first
+        lat1, lon1 = np.roll(lat0, -1), np.roll(lon0, -1)
+        lo = np.searchsorted(sorted_lat, np.minimum(lat0, lat1), 'left')
+        hi = np.searchsorted(sorted_lat, np.maximum(lat0, lat1), 'left')
+        for i in np.nonzero(hi > lo)[0]:
+            band_lat = sorted_lat[lo[i]:hi[i]]
+            # Longitude where the edge crosses each point's latitude
+            cross_lon = lon0[i] + (band_lat - lat0[i]) * (lon1[i] - lon0[i]) / (lat1[i] - lat0[i])
+            crossings[lo[i]:hi[i]] += sorted_lon[lo[i]:hi[i]] < cross_lon
+    inside = np.empty(len(lat), dtype=bool)
+    inside[order] = crossings % 2 == 1
+    return inside
+
+# Coordinate stage that checks node positions against a bounding box and optionally a polygon
+# Records outside the area are either dropped or flagged with OUTSIDE_FIELD.  Records without a position
+# (ways) are passed through unchanged.
+class CoordinateFilter(object):
+    def __init__(self, bbox = VANCOUVER_BBOX, polygon = None, drop = False, batch_size = BATCH_SIZE):
+        if np is None:
+            raise ImportError("numpy is required to check coordinates")
+        self.bbox = bbox
+        self.polygon = polygon
+        self.drop = drop
+        self.batch_size = batch_size
+        self.checked = 0
+        self.outside = 0
+
+    # Boolean mask of the points that are inside the area
+    def inside(self, lat, lon):
+        mask = np.ones(len(lat), dtype=bool)
+        if self.bbox is not None:
+            mask &= in_bbox(lat, lon, self.bbox)
+        if self.polygon is not None:
+            # Only points that passed the bounding box need the polygon test
+            candidates = np.nonzero(mask)[0]
+            mask[candidates] = point_in_polygon(lat[candidates], lon[candidates], self.polygon)
+        return mask
+
+    # Checks a list of records, returning the ones that are kept
+    def check_batch(self, records):
+        positioned = [record for record in records if 'pos' in record]
+        if not positioned:
+            return records
+        pos = np.array([record['pos'] for record in positioned], dtype=np.float64)
+        inside = self.inside(pos[:, 0], pos[:, 1])
+        self.checked += len(positioned)
+        outside = set()
+        for i in np.nonzero(~inside)[0]:
+            outside.add(id(positioned[i]))
+            positioned[i][OUTSIDE_FIELD] = True
+        self.outside += len(outside)
+        if self.drop:
+            return [record for record in records if id(record) not in outside]
+        return records
+
+    # Runs the stage over a stream of records, checking them in batches of batch_size
+    def filter_records(self, records):
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                for record in self.check_batch(batch):
+                    yield record
+                batch = []
+        for record in self.check_batch(batch):
+            yield record
+
+    def stats(self):
+        return {'checked': self.checked, 'outside': self.outside}
+
+# Runs the coordinate stage over a JSON-lines file
+def filter_json(file_in, file_out, area):
+    with codecs.open(file_out, "w") as fw:
+        with open(file_in, "r") as fr:
+            for record in area.filter_records(json.loads(line) for line in fr):
+                fw.write(json.dumps(record) + "\n")
+    return area.stats()
+
+def main():
+    area = CoordinateFilter(polygon=load_poly(vancouver_poly_file))
+    start = time.time()
+    pprint.pprint(filter_json(clean_json_file_full, clean_json_file_full[:-5] + "_area.json", area))
+    print("Done in {0:.2f}s".format(time.time() - start))
+
+if __name__ == "__main__":
+    main()
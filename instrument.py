@@ -0,0 +1,212 @@
+import xml.etree.cElementTree as ET
+import cProfile
+import json
+import os
+import pprint
+import resource
+import threading
+import time
+
+import audit
+import clean
+import compressed_io
+import json_codec
+import pipeline
+
+# Seconds between memory samples
+MEMORY_INTERVAL = 0.05
+
+# Files
+osm_file = './vancouver.osm/vancouver_sample.osm'
+osm_file_full = './vancouver.osm/vancouver.osm'
+
+# Resident memory of this process in MB, from /proc where it is available
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except IOError:
+        # ru_maxrss is in KB on Linux, and only gives the peak so far
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+# Collects time, record and byte counts for each stage of a run, plus per-rule hit counts and peak memory
+class Instrumentation(object):
+    def __init__(self):
+        self.stages = {}
+        self.hits = {}
+        self.removed = {}
+        self.phase = None
+        self.peak_mb = {}
+        self.sampler = None
+        self.running = False
+
+    # Adds a measurement to a stage
+    def add(self, stage, seconds, records = 0, nbytes = 0):
+        if stage not in self.stages:
+            self.stages[stage] = {'seconds': 0.0, 'records': 0, 'bytes': 0}
+        data = self.stages[stage]
+        data['seconds'] += seconds
+        data['records'] += records
+        data['bytes'] += nbytes
+
+    # Starts a phase, which peak memory is reported for
+    def start_phase(self, phase):
+        self.phase = phase
+        self.sample_memory()
+
+    def sample_memory(self):
+        if self.phase is not None:
+            self.peak_mb[self.phase] = max(self.peak_mb.get(self.phase, 0.0), current_rss_mb())
+
+    def start_memory_sampler(self):
+        def sample():
+            while self.running:
+                self.sample_memory()
+                time.sleep(MEMORY_INTERVAL)
+        self.running = True
+        self.sampler = threading.Thread(target=sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop_memory_sampler(self):
+        self.running = False
+        if self.sampler is not None:
+            self.sampler.join()
+        self.sample_memory()
+
+    # clean.CLEAN_RULES wrapped so each rule is timed and counts the addresses that have its field and the
+    # records it removes
+    def timed_clean_rules(self, rules = None):
+        def timed(name, rule):
+            stage = 'clean.' + name
+            def run(address):
+                if name in address:
+                    self.hits[stage] = self.hits.get(stage, 0) + 1
+                start = time.time()
+                result = rule(address)
+                self.add(stage, time.time() - start, 1)
+                if result is False:
+                    self.removed[stage] = self.removed.get(stage, 0) + 1
+                return result
+            return run
+        return [(name, timed(name, rule)) for name, rule in rules or clean.CLEAN_RULES]
+
+    # Audit rules wrapped so that each one is timed
+    def timed_audit_rules(self, rules):
+        return [TimedAuditRule(rule, self) for rule in rules]
+
+    # Machine-readable summary of the run
+    def summary(self):
+        stages = {}
+        for stage, data in self.stages.items():
+            seconds = data['seconds']
+            stages[stage] = {'seconds': round(seconds, 4), 'records': data['records']}
+            if seconds > 0:
+                stages[stage]['records_per_sec'] = round(data['records'] / seconds, 1)
+            if data['bytes']:
+                stages[stage]['mb'] = round(data['bytes'] / (1024.0 * 1024.0), 2)
+                if seconds > 0:
+                    stages[stage]['mb_per_sec'] = round(data['bytes'] / (1024.0 * 1024.0) / seconds, 2)
+        return {'stages': stages,
+                'rule_hits': self.hits,
+                'rule_removed': self.removed,
+                'housenumber_rules': dict(clean.housenumber_rule_counts),
+                'caches': clean.cache_stats(),
+                'peak_rss_mb': dict((phase, round(mb, 1)) for phase, mb in self.peak_mb.items()),
+                'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)}
+
+# Times an audit.AuditRule's process and finalize calls under 'audit.<name>'
+class TimedAuditRule(audit.AuditRule):
+    def __init__(self, rule, stats):
+        self.rule = rule
+        self.name = rule.name
+        self.stats = stats
+
+    def process(self, record):
+        start = time.time()
+        self.rule.process(record)
+        self.stats.add('audit.' + self.name, time.time() - start, 1)
+
+    def finalize(self):
+        start = time.time()
+        data = self.rule.finalize()
+        self.stats.add('audit.' + self.name, time.time() - start)
+        return data
+
+# Same as audit.iter_etree_elements, but times iterparse ('parse') and shape_element ('shape') separately
+def iter_timed_elements(file_in, stats):
+    with compressed_io.open_input(file_in) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        depth = 0
+        start = time.time()
+        for event, element in context:
+            if event == "start":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    shape_start = time.time()
+                    stats.add('parse', shape_start - start, 1)
+                    el = audit.shape_element(element)
+                    root.clear()
+                    stats.add('shape', time.time() - shape_start, 1 if el else 0)
+                    if el:
+                        yield el
+                    start = time.time()
+    stats.add('parse', time.time() - start, nbytes=os.path.getsize(file_in))
+
+# Runs the pipeline (parse, shape, clean, serialize) and the audits over its output with instrumentation
+# Writes the JSON summary to summary_file and a cProfile dump, which pstats can read, to profile_file if they
+# are given.  Returns the summary
+def run_instrumented(file_in, file_out = None, summary_file = None, profile_file = None,
+                     audit_rules = None):
+    if file_out is None:
+        file_out = clean.cleaned_filename(audit.json_filename(file_in))
+    if audit_rules is None:
+        audit_rules = [audit.JsonKeysRule(), audit.CreatedByRule(), audit.OtherFieldsUnexpectedRule(),
+                       audit.AddressRule(), audit.AddressUnexpectedRule()]
+    stats = Instrumentation()
+    profiler = cProfile.Profile() if profile_file else None
+    rules = stats.timed_clean_rules()
+    stats.start_memory_sampler()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        stats.start_phase('convert')
+        run_start = time.time()
+        with json_codec.open_output(file_out) as fw:
+            for el in iter_timed_elements(file_in, stats):
+                start = time.time()
+                el = pipeline.as_loaded(el)
+                keep = clean.clean_record(el, rules)
+                stats.add('clean', time.time() - start, 1)
+                if keep:
+                    start = time.time()
+                    line = pipeline.dumps(el)
+                    fw.write(line)
+                    stats.add('serialize', time.time() - start, 1, len(line))
+        stats.add('convert', time.time() - run_start, stats.stages['clean']['records'] if 'clean' in stats.stages else 0,
+                  os.path.getsize(file_in))
+        stats.start_phase('audit')
+        start = time.time()
+        audit.run_audits(file_out, stats.timed_audit_rules(audit_rules))
+        stats.add('audit', time.time() - start, stats.stages.get('serialize', {}).get('records', 0),
+                  os.path.getsize(file_out))
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+        stats.stop_memory_sampler()
+    summary = stats.summary()
+    if summary_file is not None:
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+def main():
+    pprint.pprint(run_instrumented(osm_file_full, summary_file=osm_file_full + ".summary.json",
+                                   profile_file=osm_file_full + ".pstats"))
+
+if __name__ == "__main__":
+    main()
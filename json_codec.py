@@ -0,0 +1,101 @@
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+import compressed_io
+
+# Backends in the order they are listed.  The stdlib json module is the default, and the others are only used when
+# set_backend asks for them, so the output doesn't depend on what happens to be installed.
+# orjson, python-rapidjson and pysimdjson only support Python 3, so they aren't among them.
+PREFERENCE = ['json', 'ujson']
+# Lines collected before RecordWriter writes them out
+WRITE_BATCH = 1000
+# Buffer size for output files
+WRITE_BUFFER = 8 * 1024 * 1024
+
+# JSON decoder and encoder of one backend
+# Non-ASCII characters are escaped by every encoder, as json.dumps does, but ujson leaves out the spaces after
+# separators, so its lines are shorter than json.dumps lines.  Indented output always goes through
+# json.dumps, so pretty files look the same whatever the backend.
+class Codec(object):
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    # Serializes a record as a line of JSON
+    def dumps_line(self, record, pretty = False):
+        if pretty:
+            return json.dumps(record, indent=2)+"\n"
+        return self.dumps(record) + "\n"
+
+def ujson_codec():
+    # precise_float keeps positions exact, and forward slashes are left alone like json.dumps does
+    return Codec('ujson', lambda s: ujson.loads(s, precise_float=True),
+                 lambda obj: ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False))
+
+def json_codec():
+    return Codec('json', json.loads, json.dumps)
+
+BACKENDS = {'ujson': (ujson, ujson_codec), 'json': (json, json_codec)}
+
+# Names of the backends that are installed, in order of preference
+def available_backends():
+    return [name for name in PREFERENCE if BACKENDS[name][0] is not None]
+
+# Codec for a backend, or the stdlib one if name is None
+def get_codec(name = None):
+    if name is None:
+        name = 'json'
+    if name not in BACKENDS:
+        raise ValueError("Unknown JSON backend: {0}".format(name))
+    module, make_codec = BACKENDS[name]
+    if module is None:
+        raise ImportError("{0} is required for the '{0}' JSON backend".format(name))
+    return make_codec()
+
+# Codec used by the pipeline, which set_backend changes
+codec = get_codec()
+
+def set_backend(name = None):
+    global codec
+    codec = get_codec(name)
+    return codec
+
+def loads(s):
+    return codec.loads(s)
+
+def dumps_line(record, pretty = False):
+    return codec.dumps_line(record, pretty)
+
+# Writes records as JSON lines, joining them into batches so that the file is written in large pieces rather than
+# once per record
+class RecordWriter(object):
+    def __init__(self, f, pretty = False, batch_size = WRITE_BATCH):
+        self.f = f
+        self.pretty = pretty
+        self.batch_size = batch_size
+        self.lines = []
+
+    def write(self, record):
+        self.lines.append(codec.dumps_line(record, self.pretty))
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.f.write(''.join(self.lines))
+            del self.lines[:]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.flush()
+
+# Opens an output file with a large buffer, compressing it if its name ends in a compression extension
+def open_output(filename):
+    return compressed_io.open_output(filename, WRITE_BUFFER)
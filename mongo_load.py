@@ -0,0 +1,208 @@
+import threading
+import Queue
+import time
+import json
+import pprint
+
+import pipeline
+import changes
+
+try:
+    from pymongo import MongoClient, ReplaceOne, DeleteOne
+    from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
+    TRANSIENT_ERRORS = (AutoReconnect, NetworkTimeout)
+except ImportError:
+    MongoClient = None
+    ReplaceOne = DeleteOne = None
+    BulkWriteError = None
+    TRANSIENT_ERRORS = ()
+
+# Loader settings
+BATCH_SIZE = 1000
+WRITERS = 4
+RETRIES = 5
+RETRY_DELAY = 0.5
+# Error code MongoDB uses for duplicate _id values
+DUPLICATE_KEY = 11000
+
+# Database
+mongo_uri = 'mongodb://localhost:27017'
+db_name = 'openstreetmap'
+collection_name = 'vancouver'
+
+# Files
+osm_file = './vancouver.osm/vancouver_sample.osm'
+osm_file_full = './vancouver.osm/vancouver.osm'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+osc_file = './vancouver.osm/vancouver.osc'
+
+# Inserts one batch with an unordered insert_many, retrying on transient errors
+# insert_many sets _id on each document before sending it, so documents that made it in before a failure
+# come back as duplicate key errors on the retry and can be ignored
+def insert_batch(collection, batch, retries = RETRIES, retry_delay = RETRY_DELAY):
+    attempt = 0
+    while True:
+        try:
+            collection.insert_many(batch, ordered=False)
+            return
+        except TRANSIENT_ERRORS:
+            attempt += 1
+            if attempt > retries:
+                raise
+            # Back off a little more after each failed attempt
+            time.sleep(retry_delay * attempt)
+        except Exception as e:
+            if BulkWriteError is not None and isinstance(e, BulkWriteError) and attempt > 0:
+                errors = e.details.get('writeErrors', [])
+                if all(error.get('code') == DUPLICATE_KEY for error in errors):
+                    return
+            raise
+
+# Loads records into a MongoDB collection using a small pool of writer threads
+# Records are grouped into batches of batch_size and handed to the writers through a bounded queue,
+# so at most a few batches are held in memory at once
+# Returns the number of documents loaded, elapsed seconds and documents per second
+def load_records(records, collection, batch_size = BATCH_SIZE, writers = WRITERS, retries = RETRIES):
+    queue = Queue.Queue(maxsize=writers * 2)
+    errors = []
+
+    def writer():
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            # After a failure keep draining the queue so the reader doesn't block
+            if not errors:
+                try:
+                    insert_batch(collection, batch, retries)
+                except Exception as e:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    start = time.time()
+    count = 0
+    batch = []
+    try:
+        for record in records:
+            if errors:
+                break
+            batch.append(record)
+            count += 1
+            if len(batch) == batch_size:
+                queue.put(batch)
+                batch = []
+        if batch and not errors:
+            queue.put(batch)
+    finally:
+        # One stop marker per writer
+        for _ in threads:
+            queue.put(None)
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+    elapsed = time.time() - start
+    return {'documents': count,
+            'seconds': round(elapsed, 2),
+            'docs_per_sec': round(count / elapsed, 1) if elapsed > 0 else None}
+
+# Loads a cleaned JSON file into a collection, replacing the mongoimport step
+def load_json_file(filename, collection, batch_size = BATCH_SIZE, writers = WRITERS):
+    with open(filename, "r") as f:
+        records = (json.loads(line) for line in f)
+        return load_records(records, collection, batch_size, writers)
+
+# Shapes, cleans and loads an OSM file into a collection without writing any JSON to disk
+def load_osm(file_in, collection, batch_size = BATCH_SIZE, writers = WRITERS):
+    return load_records(pipeline.iter_cleaned_records(file_in), collection, batch_size, writers)
+
+# Applies an osmChange file to a loaded collection
+# Created and modified elements are upserted by type and id, and deleted elements (or ones clean_record now
+# removes) are deleted.  Writes are ordered, so repeated changes to an element are applied in sequence.
+# Returns the number of upserts and deletes
+def apply_changes(osc_file, collection, batch_size = BATCH_SIZE):
+    if ReplaceOne is None:
+        raise ImportError("pymongo is required to apply changes to MongoDB")
+    # Lookups by type and id need an index to stay fast on the full collection
+    collection.create_index([('type', 1), ('id', 1)])
+    stats = {'upserted': 0, 'deleted': 0}
+    requests = []
+    for type, osm_id, record in changes.iter_cleaned_changes(osc_file):
+        key = {'type': type, 'id': osm_id}
+        if record is None:
+            requests.append(DeleteOne(key))
+            stats['deleted'] += 1
+        else:
+            requests.append(ReplaceOne(key, record, upsert=True))
+            stats['upserted'] += 1
+        if len(requests) == batch_size:
+            collection.bulk_write(requests, ordered=True)
+            requests = []
+    if requests:
+        collection.bulk_write(requests, ordered=True)
+    return stats
+
+# Returns the collection records are loaded into
+def get_collection(uri = mongo_uri, db = db_name, name = collection_name):
+    if MongoClient is None:
+        raise ImportError("pymongo is required to load records into MongoDB")
+    return MongoClient(uri)[db][name]
+
+def main():
+    # pprint.pprint(load_json_file(clean_json_file_full, get_collection()))
+    # pprint.pprint(apply_changes(osc_file, get_collection()))
+    pprint.pprint(load_osm(osm_file_full, get_collection()))
+
+def test():
+    # Uses mongomock as a stand-in for a local mongod
+    import mongomock
+    collection = mongomock.MongoClient().db.test
+    records = [{'type': 'node', 'id': str(i)} for i in range(2500)]
+    stats = load_records(records, collection, batch_size=100, writers=3)
+    pprint.pprint(stats)
+    assert stats['documents'] == 2500
+    assert collection.count_documents({}) == 2500
+
+    # Transient errors are retried, and documents inserted before the error are not duplicated
+    class FlakyCollection(object):
+        def __init__(self, collection):
+            self.collection = collection
+            self.failures = 0
+
+        def insert_many(self, documents, ordered=True):
+            if self.failures < 2:
+                # First failure happens after part of the batch was written
+                if self.failures == 0:
+                    self.collection.insert_many(documents[:10], ordered=ordered)
+                self.failures += 1
+                raise AutoReconnect("connection reset")
+            return self.collection.insert_many(documents, ordered=ordered)
+
+    collection = mongomock.MongoClient().db.flaky
+    flaky = FlakyCollection(collection)
+    insert_batch(flaky, [{'id': str(i)} for i in range(50)], retry_delay=0)
+    assert flaky.failures == 2
+    assert collection.count_documents({}) == 50
+
+    # Changes are upserted and deleted by type and id
+    import tempfile
+    import os
+    collection = mongomock.MongoClient().db.changes
+    collection.insert_many([{'type': 'node', 'id': '1'}, {'type': 'node', 'id': '2', 'version': '1'}])
+    fd, osc = tempfile.mkstemp(suffix='.osc')
+    with os.fdopen(fd, 'w') as f:
+        f.write('<osmChange version="0.6"><create><node id="3" lat="49.3" lon="-123.1" version="1"/></create>'
+                '<modify><node id="2" lat="49.3" lon="-123.1" version="2"/></modify>'
+                '<delete><node id="1" version="2"/></delete></osmChange>')
+    try:
+        assert apply_changes(osc, collection) == {'upserted': 2, 'deleted': 1}
+    finally:
+        os.remove(osc)
+    assert sorted(doc['id'] for doc in collection.find()) == ['2', '3']
+    assert collection.find_one({'id': '2'})['created'] == {'version': '2'}
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import json
+import codecs
+import struct
+import pprint
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Layout of a saved store: header, then the sorted ids, latitudes and longitudes
+# Header fields are magic and number of nodes
+HEADER = struct.Struct('<8sq')
+MAGIC = 'OSMNODE1'
+# Coordinates are kept as int32 fixed point with 7 decimals, the precision OSM itself stores
+SCALE = 10000000
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+ID_TYPECODE = 'l'
+COORD_TYPECODE = 'i'
+# Number of records buffered before the geometry of their ways is computed
+BATCH_SIZE = 10000
+# Mean earth radius in metres, for haversine distances
+EARTH_RADIUS = 6371008.8
+
+# Files
+osm_file_full = './vancouver.osm/vancouver.osm'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+
+# Compact node id -> (lat, lon) store
+# Nodes are appended to flat arrays during the pass over the file and sorted by id on first lookup, so each node
+# costs 16 bytes (int64 id and two int32 coordinates) instead of a dictionary entry of strings
+class NodeCoordinateStore(object):
+    def __init__(self):
+        if np is None:
+            raise ImportError("numpy is required for the node coordinate store")
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.lat = np.zeros(0, dtype=np.int32)
+        self.lon = np.zeros(0, dtype=np.int32)
+        # Nodes added since the last lookup
+        self.pending_ids = array(ID_TYPECODE)
+        self.pending_lat = array(COORD_TYPECODE)
+        self.pending_lon = array(COORD_TYPECODE)
+
+    def __len__(self):
+        return len(self.ids) + len(self.pending_ids)
+
+    def add(self, osm_id, lat, lon):
+        self.pending_ids.append(int(osm_id))
+        self.pending_lat.append(int(round(lat * SCALE)))
+        self.pending_lon.append(int(round(lon * SCALE)))
+
+    # Merges pending nodes into the sorted arrays
+    # OSM files list nodes by increasing id, so the sort is skipped when the ids are already in order
+    def freeze(self):
+        if not self.pending_ids:
+            return
+        ids = np.concatenate([self.ids, np.frombuffer(self.pending_ids, dtype=np.int64)])
+        lat = np.concatenate([self.lat, np.frombuffer(self.pending_lat, dtype=np.int32)])
+        lon = np.concatenate([self.lon, np.frombuffer(self.pending_lon, dtype=np.int32)])
+        if len(ids) > 1 and not (ids[1:] >= ids[:-1]).all():
+            order = np.argsort(ids, kind='mergesort')
+            ids, lat, lon = ids[order], lat[order], lon[order]
+        self.ids, self.lat, self.lon = ids, lat, lon
+        self.pending_ids = array(ID_TYPECODE)
+        self.pending_lat = array(COORD_TYPECODE)
+        self.pending_lon = array(COORD_TYPECODE)
+
+    # Positions of an array of node ids in the store, and a mask of the ids that were found
+    def find(self, refs):
+        self.freeze()
+        if not len(self.ids):
+            return np.zeros(len(refs), dtype=np.int64), np.zeros(len(refs), dtype=bool)
+        idx = np.searchsorted(self.ids, refs)
+        idx[idx == len(self.ids)] = 0
+        return idx, self.ids[idx] == refs
+
+    # (lat, lon) of a node, or None if it isn't in the store
+    def get(self, osm_id):
+        idx, found = self.find(np.array([int(osm_id)], dtype=np.int64))
+        if not found[0]:
+            return None
+        return (self.lat[idx[0]] / float(SCALE), self.lon[idx[0]] / float(SCALE))
+
+    def save(self, filename):
+        self.freeze()
+        with open(filename, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.ids)))
+            self.ids.astype('<i8').tofile(f)
+            self.lat.astype('<i4').tofile(f)
+            self.lon.astype('<i4').tofile(f)
+
+    # Loads a saved store memory mapped, so it can be shared between processes without reading it in
+    @classmethod
+    def load(cls, filename):
+        store = cls()
+        with open(filename, "rb") as f:
+            magic, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{0} is not a node coordinate store".format(filename))
+        offset = HEADER.size
+        store.ids = np.memmap(filename, dtype='<i8', mode='r', offset=offset, shape=(count,))
+        offset += count * 8
+        store.lat = np.memmap(filename, dtype='<i4', mode='r', offset=offset, shape=(count,))
+        offset += count * 4
+        store.lon = np.memmap(filename, dtype='<i4', mode='r', offset=offset, shape=(count,))
+        return store
+
+# Great-circle distance in metres between arrays of points given in degrees
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+# Computes centroid, bbox and length for a list of way records and sets them as record['geometry']
+# All ways are looked up with a single searchsorted, and the per-way values are reduced over the combined arrays
+# Refs to nodes that aren't in the store (outside the extract) are skipped, and ways without any known node
+# are left without geometry
+def add_way_geometry(ways, store):
+    if not ways:
+        return
+    counts = np.array([len(way['node_refs']) for way in ways], dtype=np.int64)
+    refs = np.array([ref for way in ways for ref in way['node_refs']], dtype=np.int64)
+    way_index = np.repeat(np.arange(len(ways)), counts)
+    idx, found = store.find(refs)
+    idx, way_index = idx[found], way_index[found]
+    lat = store.lat[idx] / float(SCALE)
+    lon = store.lon[idx] / float(SCALE)
+    found_counts = np.bincount(way_index, minlength=len(ways))
+    # Segments only join consecutive nodes of the same way
+    same_way = way_index[1:] == way_index[:-1]
+    segments = haversine(lat[:-1], lon[:-1], lat[1:], lon[1:]) * same_way
+    length = np.bincount(way_index[1:], weights=segments, minlength=len(ways))
+    has_nodes = np.nonzero(found_counts)[0]
+    if not len(has_nodes):
+        return
+    starts = np.concatenate([[0], np.cumsum(found_counts[has_nodes])[:-1]])
+    lat_sum, lon_sum = np.add.reduceat(lat, starts), np.add.reduceat(lon, starts)
+    min_lat, max_lat = np.minimum.reduceat(lat, starts), np.maximum.reduceat(lat, starts)
+    min_lon, max_lon = np.minimum.reduceat(lon, starts), np.maximum.reduceat(lon, starts)
+    for j, i in enumerate(has_nodes):
+        n = found_counts[i]
+        ways[i]['geometry'] = {'centroid': [round(lat_sum[j] / n, 7), round(lon_sum[j] / n, 7)],
+                               'bbox': [float(min_lat[j]), float(min_lon[j]), float(max_lat[j]), float(max_lon[j])],
+                               'length': round(float(length[i]), 1)}
+
+# Pipeline stage that stores node positions as they stream past and adds geometry to the ways that follow them
+# OSM files list all nodes before any ways, so every node a way refers to has been stored by the time the way
+# is reached.  Records are buffered in batches so the way geometry can be computed with NumPy.
+class WayGeometry(object):
+    def __init__(self, store = None, batch_size = BATCH_SIZE):
+        if store is None:
+            store = NodeCoordinateStore()
+        self.store = store
+        self.batch_size = batch_size
+
+    def filter_records(self, records):
+        batch = []
+        for record in records:
+            if record.get('type') == 'node' and 'pos' in record:
+                self.store.add(record['id'], record['pos'][0], record['pos'][1])
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                for record in self.flush(batch):
+                    yield record
+                batch = []
+        for record in self.flush(batch):
+            yield record
+
+    def flush(self, batch):
+        add_way_geometry([record for record in batch if 'node_refs' in record], self.store)
+        return batch
+
+# Runs the way geometry stage over a JSON-lines file
+def add_geometry_json(file_in, file_out, stage = None):
+    if stage is None:
+        stage = WayGeometry()
+    count = 0
+    with codecs.open(file_out, "w") as fw:
+        with open(file_in, "r") as fr:
+            for record in stage.filter_records(json.loads(line) for line in fr):
+                fw.write(json.dumps(record) + "\n")
+                count += 1
+    return count
+
+def main():
+    stage = WayGeometry()
+    start = time.time()
+    add_geometry_json(clean_json_file_full, clean_json_file_full[:-5] + "_geometry.json", stage)
+    print("Done in {0:.2f}s, {1} nodes stored".format(time.time() - start, len(stage.store)))
+    stage.store.save(osm_file_full + ".nodes")
+    pprint.pprint(stage.store.get('261114295'))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import audit
+import clean
+import compressed_io
+import json_codec
+
+# Files
+osm_file = './vancouver.osm/vancouver_sample.osm'
+osm_file_full = './vancouver.osm/vancouver.osm'
+
+# Converts an OSM file straight into cleaned JSON in one pass
+# Elements are streamed from iterparse through shape_element and clean_record, so the dirty JSON file is only
+# written if dirty_file is given.  Output file names default to the ones used by process_map and clean_json.
+# The geometry and rings stages see every shaped record, before clean_record removes any, so ways and relations
+# keep the positions and refs of nodes and ways that cleaning or the area stage drops.
+# geometry is an optional node_store.WayGeometry that adds centroid, bbox and length to ways
+# rings is an optional relations.RingAssembler that adds the rings of multipolygon and boundary relations
+# area is an optional coordinates.CoordinateFilter that flags or drops records outside the map area
+# Returns the number of cleaned records written
+def run_pipeline(file_in, file_out = None, dirty_file = None, pretty = False, parser = 'etree', area = None,
+                 geometry = None, rings = None):
+    compressed_io.check_supported(file_in)
+    if file_out is None:
+        file_out = clean.cleaned_filename(audit.json_filename(file_in))
+    count = 0
+    with json_codec.open_output(file_out) as fw, json_codec.RecordWriter(fw, pretty) as lines:
+        records = iter_loaded_records(file_in, dirty_file, pretty, parser)
+        if geometry is not None:
+            records = geometry.filter_records(records)
+        if rings is not None:
+            records = rings.filter_records(records)
+        records = filter_cleaned(records)
+        if area is not None:
+            records = area.filter_records(records)
+        for el in records:
+            lines.write(el)
+            count += 1
+    return count
+
+# Yields shaped and cleaned records from an OSM file, leaving out records that clean_record removes
+# If dirty_file is given, every shaped record is also written to it before cleaning
+def iter_cleaned_records(file_in, dirty_file = None, pretty = False, parser = 'etree'):
+    return filter_cleaned(iter_loaded_records(file_in, dirty_file, pretty, parser))
+
+# Yields shaped records from an OSM file as json.loads would have read them from the dirty file
+# If dirty_file is given, every shaped record is also written to it
+def iter_loaded_records(file_in, dirty_file = None, pretty = False, parser = 'etree'):
+    fd = None
+    if dirty_file is not None:
+        fd = json_codec.open_output(dirty_file)
+    try:
+        for el in audit.iter_shaped_elements(file_in, parser):
+            if fd is not None:
+                fd.write(dumps(el, pretty))
+            yield as_loaded(el)
+    finally:
+        if fd is not None:
+            fd.close()
+
+# Cleans records and leaves out the ones clean_record removes
+def filter_cleaned(records):
+    for el in records:
+        if clean.clean_record(el):
+            yield el
+
+# Rebuilds a record's dictionaries in the order json.loads would have built them from its JSON line
+# Dictionary iteration order depends on insertion history, so without this the cleaned output would
+# list keys in a different order than clean_json does after reading the dirty file back
+def as_loaded(record):
+    d = {}
+    for k, v in record.items():
+        if isinstance(v, dict):
+            v = as_loaded(v)
+        elif isinstance(v, list) and v and isinstance(v[0], dict):
+            # Relation members
+            v = [as_loaded(item) for item in v]
+        d[k] = v
+    return d
+
+# Serializes a record as a line of JSON with the JSON backend in use (see json_codec.py)
+def dumps(record, pretty = False):
+    return json_codec.dumps_line(record, pretty)
+
+def main():
+    # run_pipeline(osm_file)
+    run_pipeline(osm_file_full)
+
+if __name__ == "__main__":
+    main()
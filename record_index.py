@@ -0,0 +1,174 @@
+import json
+import re
+import os
+import mmap
+import random
+import struct
+import pprint
+from array import array
+
+# Layout of the index file: header, record offsets, then OSM ids sorted with the ordinal of their record
+# Header fields are magic, source file size, source file mtime, number of records and number of ids
+HEADER = struct.Struct('<8sqqqq')
+MAGIC = 'OSMRIDX1'
+ITEM = struct.Struct('<q')
+# Number of values packed per write when saving the index
+WRITE_CHUNK = 65536
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+OFFSET_TYPECODE = 'l'
+
+# Matches the top level id of a record, so the index can be built without json.loads
+# Backends other than json.dumps leave out the space after the colon
+record_id = re.compile(r'"id":\s*"(-?[0-9]+)"')
+
+# Files
+json_file = './vancouver.osm/vancouver_sample.osm.json'
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+
+# Name of the index file kept next to the JSON file
+def index_filename(filename):
+    return filename + ".rec.idx"
+
+# Identifies the version of a JSON file, so that an index built from an older file is not used
+def source_stamp(filename):
+    st = os.stat(filename)
+    return (st.st_size, int(st.st_mtime))
+
+# Writes an array of integers as little-endian int64 values
+def write_values(f, values):
+    for i in xrange(0, len(values), WRITE_CHUNK):
+        chunk = values[i:i+WRITE_CHUNK]
+        f.write(struct.pack('<%dq' % len(chunk), *chunk))
+
+# Builds the offset index for a JSON-lines file in a single pass
+# The index is written to a temporary file first, so an interrupted build never leaves a broken index behind
+def build_record_index(filename, index_file = None):
+    if index_file is None:
+        index_file = index_filename(filename)
+    size, mtime = source_stamp(filename)
+    offsets = array(OFFSET_TYPECODE, [0])
+    ids = array(OFFSET_TYPECODE)
+    ordinals = array(OFFSET_TYPECODE)
+    offset = 0
+    with open(filename, "rb") as f:
+        for line in f:
+            m = record_id.search(line)
+            if m:
+                ids.append(int(m.group(1)))
+                ordinals.append(len(offsets) - 1)
+            offset += len(line)
+            offsets.append(offset)
+    # Sort ids, keeping each one paired with its record
+    order = sorted(xrange(len(ids)), key=ids.__getitem__)
+    ids = array(OFFSET_TYPECODE, [ids[i] for i in order])
+    ordinals = array(OFFSET_TYPECODE, [ordinals[i] for i in order])
+    tmp_file = index_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, size, mtime, len(offsets) - 1, len(ids)))
+        write_values(f, offsets)
+        write_values(f, ids)
+        write_values(f, ordinals)
+    os.rename(tmp_file, index_file)
+
+# Checks that an index file exists and was built from the current version of the JSON file
+def record_index_is_current(filename, index_file = None):
+    if index_file is None:
+        index_file = index_filename(filename)
+    if not os.path.exists(index_file):
+        return False
+    with open(index_file, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return False
+    magic, size, mtime, _, _ = HEADER.unpack(header)
+    return magic == MAGIC and (size, mtime) == source_stamp(filename)
+
+# Random-access reader for a JSON-lines file
+# The data file and its offset index are both memory mapped, so fetching record N or an id does not depend on
+# where the record is in the file
+class RecordReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+        index_file = index_filename(filename)
+        if not record_index_is_current(filename, index_file):
+            build_record_index(filename, index_file)
+        with open(index_file, "rb") as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.count, self.id_count = HEADER.unpack_from(self.index, 0)
+        self.ids_start = HEADER.size + (self.count + 1) * ITEM.size
+        self.ordinals_start = self.ids_start + self.id_count * ITEM.size
+        # mmap can't map an empty file
+        self.data = None
+        if self.count:
+            with open(filename, "rb") as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def value(self, start, i):
+        return ITEM.unpack_from(self.index, start + i * ITEM.size)[0]
+
+    # Byte range (start, end) of record n in the JSON file
+    def span(self, n):
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError("record {0} out of range".format(n))
+        return self.value(HEADER.size, n), self.value(HEADER.size, n + 1)
+
+    # Raw JSON line of record n
+    def line(self, n):
+        start, end = self.span(n)
+        return self.data[start:end]
+
+    def record(self, n):
+        return json.loads(self.line(n))
+
+    # Records start to start + count, for paging through the file
+    def page(self, start, count):
+        return [self.record(n) for n in xrange(start, min(start + count, self.count))]
+
+    # Random sample of records, returned in file order
+    def sample(self, count, seed = None):
+        ordinals = random.Random(seed).sample(xrange(self.count), min(count, self.count))
+        return [self.record(n) for n in sorted(ordinals)]
+
+    # Records with an OSM id, optionally only of one type (node and way ids can overlap)
+    def find_id(self, osm_id, type = None):
+        return [self.record(n) for n in self.find_ordinals(osm_id, type)]
+
+    # Ordinals of the records with an OSM id, optionally only of one type
+    def find_ordinals(self, osm_id, type = None):
+        osm_id = int(osm_id)
+        # Binary search for the first matching id
+        lo, hi = 0, self.id_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.value(self.ids_start, mid) < osm_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        data = []
+        while lo < self.id_count and self.value(self.ids_start, lo) == osm_id:
+            n = self.value(self.ordinals_start, lo)
+            record = self.record(n)
+            # The id pattern could have matched an "id" nested inside the record, so check the real one
+            if record.get('id') == str(osm_id) and (type is None or record.get('type') == type):
+                data.append(n)
+            lo += 1
+        return data
+
+    def close(self):
+        self.index.close()
+        if self.data is not None:
+            self.data.close()
+
+def main():
+    reader = RecordReader(clean_json_file_full)
+    pprint.pprint(reader.record(1500000))
+    pprint.pprint(reader.find_id('261114295', 'node'))
+    reader.close()
+
+if __name__ == "__main__":
+    main()
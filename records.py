@@ -0,0 +1,178 @@
+import json
+import collections
+from array import array
+from json.encoder import encode_basestring_ascii
+
+# Fixed fields of a shaped element, in the order ElementRecord lists them
+FIELDS = ('type', 'id', 'visible', 'pos', 'created', 'address', 'node_refs', 'members')
+FIELD_SET = frozenset(FIELDS)
+CREATED = ("version", "changeset", "timestamp", "user", "uid")
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+REF_TYPECODE = 'l'
+
+# One shared object for each distinct user, uid and tag key
+# Python keeps an interned string only while something refers to it, so nothing is left behind with the records
+def intern_string(s):
+    if type(s) is str:
+        return intern(s)
+    return s
+
+# Compact version of the dictionary shape_element builds
+# Fixed fields are kept in slots, with position as two floats, created as a tuple of values in CREATED order and
+# node refs in an integer array.  Any other key goes into a dictionary of tags, which most nodes don't have.
+# Records behave like the dictionaries, so the audit rules and clean_record can use them directly, but pos,
+# created and node_refs are rebuilt on each access and changes to them have to be assigned back.
+# A slot that isn't set is a key that isn't in the record.
+class ElementRecord(object):
+    __slots__ = ('type', 'id', 'visible', 'lat', 'lon', 'created_values', 'address', 'refs', 'members', 'tags')
+
+    def __init__(self, type):
+        self.type = intern_string(type)
+        self.tags = None
+
+    # Record made from a dictionary shaped by shape_element or read back with json.loads
+    @classmethod
+    def from_dict(cls, d):
+        record = cls(d['type'])
+        for k, v in d.items():
+            if k != 'type':
+                record[k] = v
+        return record
+
+    def __getitem__(self, key):
+        if key in FIELD_SET:
+            try:
+                if key == 'pos':
+                    return [self.lat, self.lon]
+                if key == 'created':
+                    return dict((c, v) for c, v in zip(CREATED, self.created_values) if v is not None)
+                if key == 'node_refs':
+                    if isinstance(self.refs, array):
+                        return [str(ref) for ref in self.refs]
+                    return list(self.refs)
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.tags is None:
+            raise KeyError(key)
+        return self.tags[key]
+
+    def __setitem__(self, key, value):
+        if key == 'pos':
+            self.lat, self.lon = value
+        elif key == 'created':
+            self.created_values = tuple(intern_string(value[c]) if c in ('user', 'uid') and c in value
+                                        else value.get(c) for c in CREATED)
+        elif key == 'node_refs':
+            try:
+                self.refs = array(REF_TYPECODE, [int(ref) for ref in value])
+            except ValueError:
+                # Refs that aren't plain integers are kept as they are
+                self.refs = list(value)
+        elif key in FIELD_SET:
+            setattr(self, key, intern_string(value) if key == 'type' else value)
+        else:
+            if self.tags is None:
+                self.tags = {}
+            self.tags[intern_string(key)] = value
+
+    def __delitem__(self, key):
+        try:
+            if key == 'pos':
+                del self.lat
+                del self.lon
+            elif key == 'created':
+                del self.created_values
+            elif key == 'node_refs':
+                del self.refs
+            elif key in FIELD_SET:
+                delattr(self, key)
+            elif self.tags is not None:
+                del self.tags[key]
+                if not self.tags:
+                    self.tags = None
+            else:
+                raise KeyError(key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in FIELD_SET:
+            return hasattr(self, {'pos': 'lat', 'created': 'created_values', 'node_refs': 'refs'}.get(key, key))
+        return self.tags is not None and key in self.tags
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [key for key in FIELDS if key in self]
+        if self.tags is not None:
+            keys.extend(self.tags)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    # Records print and compare like the dictionaries they replace, so audit results read the same either way
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __eq__(self, other):
+        if isinstance(other, ElementRecord):
+            other = other.to_dict()
+        elif not isinstance(other, collections.Mapping):
+            return NotImplemented
+        return self.to_dict() == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    # Records can change, so like dictionaries they can't be hashed
+    __hash__ = None
+
+    # Serializes the record as one line of JSON, the same as json.dumps(record.to_dict()) apart from key order
+    # Fixed fields are written directly and only tags go through json.dumps
+    def to_json(self):
+        parts = ['"type": ', encode_basestring_ascii(self.type)]
+        if hasattr(self, 'id'):
+            parts.extend([', "id": ', encode_basestring_ascii(self.id)])
+        if hasattr(self, 'visible'):
+            parts.extend([', "visible": ', encode_basestring_ascii(self.visible)])
+        if hasattr(self, 'lat'):
+            parts.extend([', "pos": [', repr(self.lat), ', ', repr(self.lon), ']'])
+        if hasattr(self, 'created_values'):
+            parts.append(', "created": {')
+            parts.append(', '.join(['"' + c + '": ' + encode_basestring_ascii(v)
+                                    for c, v in zip(CREATED, self.created_values) if v is not None]))
+            parts.append('}')
+        if hasattr(self, 'address'):
+            parts.extend([', "address": ', json.dumps(self.address)])
+        if hasattr(self, 'refs'):
+            parts.append(', "node_refs": [')
+            if isinstance(self.refs, array):
+                parts.append(', '.join(['"' + str(ref) + '"' for ref in self.refs]))
+            else:
+                parts.append(', '.join([encode_basestring_ascii(ref) for ref in self.refs]))
+            parts.append(']')
+        if hasattr(self, 'members'):
+            parts.extend([', "members": ', json.dumps(self.members)])
+        if self.tags is not None:
+            for k, v in self.tags.items():
+                parts.extend([', ', encode_basestring_ascii(k), ': ',
+                              encode_basestring_ascii(v) if isinstance(v, basestring) else json.dumps(v)])
+        return '{' + ''.join(parts) + '}'
@@ -0,0 +1,183 @@
+import json
+import codecs
+import pprint
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import node_store
+
+# Relation types whose outer and inner ways form closed rings
+AREA_RELATIONS = set(['multipolygon', 'boundary'])
+# Python 2's array has no 'q', and 'l' is 64-bit on the Linux machines the pipeline runs on
+ID_TYPECODE = 'l'
+
+# Files
+clean_json_file_full = './vancouver.osm/vancouver_cleaned.osm.json'
+
+# Checks if a record is a relation whose rings should be assembled
+def is_area_relation(record):
+    return record.get('type') == 'relation' and record.get('type_tag') in AREA_RELATIONS
+
+# First pass: ids of the ways used by multipolygon and boundary relations, as a sorted int64 array
+# Only these ways need their node refs kept during the second pass
+def area_member_ways(records):
+    ids = array(ID_TYPECODE)
+    for record in records:
+        if is_area_relation(record):
+            for member in record.get('members', []):
+                if member['type'] == 'way':
+                    ids.append(int(member['ref']))
+    return np.unique(np.frombuffer(ids, dtype=np.int64)) if ids else np.zeros(0, dtype=np.int64)
+
+# First pass over a JSON-lines file, only decoding the lines that have members
+def area_member_ways_json(filename):
+    with open(filename, "r") as f:
+        return area_member_ways(json.loads(line) for line in f if '"members"' in line)
+
+# Joins ways (lists of node ids) end to end into closed rings
+# Returns the closed rings and the number of pieces that couldn't be closed, which happens when part of the
+# relation lies outside the extract.  An open piece doesn't stop the remaining ways from being joined.
+def join_rings(ways):
+    rings = []
+    unclosed = 0
+    unused = [list(way) for way in ways if len(way) > 1]
+    # Ways that are already closed are rings on their own
+    for way in [way for way in unused if way[0] == way[-1]]:
+        rings.append(way)
+        unused.remove(way)
+    while unused:
+        ring = unused.pop(0)
+        while ring[0] != ring[-1]:
+            for i, way in enumerate(unused):
+                if way[0] == ring[-1]:
+                    ring.extend(way[1:])
+                elif way[-1] == ring[-1]:
+                    ring.extend(way[-2::-1])
+                else:
+                    continue
+                del unused[i]
+                break
+            else:
+                # No way continues this ring
+                break
+        if ring[0] == ring[-1]:
+            rings.append(ring)
+        else:
+            unclosed += 1
+    return rings, unclosed
+
+# Pipeline stage that assembles the outer and inner rings of multipolygon and boundary relations
+# Node positions go into a node_store.NodeCoordinateStore, and only the node refs of ways listed by
+# member_ways are kept, in flat arrays, so memory stays bounded by the nodes and the relevant ways.
+# OSM files list nodes, then ways, then relations, so everything a relation needs has been seen when it arrives.
+# Rings are written to record['rings'] as {'outer': [...], 'inner': [...]} lists of [lat, lon] points.
+class RingAssembler(object):
+    def __init__(self, member_ways, store = None):
+        if np is None:
+            raise ImportError("numpy is required to assemble relation rings")
+        if store is None:
+            store = node_store.NodeCoordinateStore()
+        self.store = store
+        self.member_ways = member_ways
+        # Kept ways, their node refs are refs[offsets[i]:offsets[i+1]]
+        self.way_ids = array(ID_TYPECODE)
+        self.refs = array(ID_TYPECODE)
+        self.offsets = array(ID_TYPECODE, [0])
+        self.assembled = 0
+        self.incomplete = 0
+
+    def keep_way(self, osm_id):
+        if not len(self.member_ways):
+            return False
+        i = np.searchsorted(self.member_ways, osm_id)
+        return i < len(self.member_ways) and self.member_ways[i] == osm_id
+
+    # Node refs of a kept way, or None if the way wasn't seen
+    def way_refs(self, osm_id, way_index):
+        i = way_index.get(osm_id)
+        if i is None:
+            return None
+        return self.refs[self.offsets[i]:self.offsets[i + 1]]
+
+    def filter_records(self, records):
+        way_index = None
+        for record in records:
+            if record.get('type') == 'node' and 'pos' in record:
+                self.store.add(record['id'], record['pos'][0], record['pos'][1])
+            elif record.get('type') == 'way' and 'node_refs' in record and self.keep_way(int(record['id'])):
+                self.way_ids.append(int(record['id']))
+                self.refs.extend([int(ref) for ref in record['node_refs']])
+                self.offsets.append(len(self.refs))
+            elif is_area_relation(record):
+                if way_index is None:
+                    way_index = dict((osm_id, i) for i, osm_id in enumerate(self.way_ids))
+                self.assemble(record, way_index)
+            yield record
+
+    def assemble(self, record, way_index):
+        rings = {'outer': [], 'inner': []}
+        complete = True
+        for role in rings:
+            ways = []
+            for member in record.get('members', []):
+                # Members without a role are treated as outer ways, as most editors do
+                if member['type'] == 'way' and (member['role'] or 'outer') == role:
+                    refs = self.way_refs(int(member['ref']), way_index)
+                    if refs is None:
+                        complete = False
+                    else:
+                        ways.append(refs)
+            joined, unclosed = join_rings(ways)
+            if unclosed:
+                complete = False
+            for ring in joined:
+                idx, found = self.store.find(np.array(ring, dtype=np.int64))
+                if not found.all():
+                    complete = False
+                    continue
+                rings[role].append([[self.store.lat[i] / float(node_store.SCALE), self.store.lon[i] / float(node_store.SCALE)]
+                                    for i in idx])
+        if rings['outer']:
+            record['rings'] = rings
+            self.assembled += 1
+        if not complete:
+            self.incomplete += 1
+
+    def stats(self):
+        return {'assembled': self.assembled, 'incomplete': self.incomplete, 'ways_kept': len(self.way_ids)}
+
+# Polygon of an assembled relation in the form coordinates.CoordinateFilter takes, so the data can be clipped
+# to a boundary relation such as 1852574
+def relation_polygon(record):
+    return record['rings']['outer'] + record['rings']['inner']
+
+# Assembles relation rings for a JSON-lines file in two passes
+def assemble_rings_json(file_in, file_out):
+    stage = RingAssembler(area_member_ways_json(file_in))
+    with codecs.open(file_out, "w") as fw:
+        with open(file_in, "r") as fr:
+            for record in stage.filter_records(json.loads(line) for line in fr):
+                fw.write(json.dumps(record) + "\n")
+    return stage.stats()
+
+def main():
+    start = time.time()
+    pprint.pprint(assemble_rings_json(clean_json_file_full, clean_json_file_full[:-5] + "_rings.json"))
+    print("Done in {0:.2f}s".format(time.time() - start))
+
+def test():
+    assert join_rings([[1, 2, 3], [3, 4], [4, 1]]) == ([[1, 2, 3, 4, 1]], 0)
+    # Ways can be listed backwards
+    assert join_rings([[1, 2, 3], [1, 4], [4, 3]]) == ([[1, 2, 3, 4, 1]], 0)
+    # A way that can't be closed is counted, and the ways after it are still joined
+    assert join_rings([[1, 2, 3], [3, 4], [4, 1], [7, 8]]) == ([[1, 2, 3, 4, 1]], 1)
+    assert join_rings([[7, 8], [1, 2, 3], [3, 4], [4, 1]]) == ([[1, 2, 3, 4, 1]], 1)
+    assert join_rings([[7, 8], [5, 6, 5], [9, 10]]) == ([[5, 6, 5]], 2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import os
+import re
+import json
+import random
+import time
+import pprint
+
+import audit
+
+# Record types in the order OSM files list them
+TYPES = ("node", "way", "relation")
+# Bytes read per seek; most elements are much smaller than this
+SEEK_BLOCK = 8192
+# Number of elements read from each type region to estimate its average element size
+SIZE_PROBES = 64
+# Sampling fraction, the same as keeping every 100th element
+FRACTION = 0.01
+
+# Start tag of a top level element, with its id
+element_head = re.compile(r'<(node|way|relation)\s[^>]*?\bid="(-?[0-9]+)"')
+node_ref = re.compile(r'<nd\s+ref="(-?[0-9]+)"')
+
+# Files
+osm_file_full = './vancouver.osm/vancouver.osm'
+osm_sample_file = './vancouver.osm/vancouver_sample.osm'
+
+# Random access to the top level elements of an OSM XML file or the records of a JSON-lines file
+# Elements are found by seeking to a byte offset and moving forward to the next element start, so nothing
+# before the offset is ever read
+class ElementFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.xml = not filename.endswith('.json')
+        self.size = os.path.getsize(filename)
+        self.f = open(filename, "rb")
+        if self.xml:
+            _, ranges = audit.split_osm_file(filename, 1)
+            self.start, self.end = ranges[0] if ranges else (self.size, self.size)
+        else:
+            self.start, self.end = 0, self.size
+
+    # Offset of the first element at or after offset, or None if there isn't one
+    def next_start(self, offset):
+        offset = max(offset, self.start)
+        if offset >= self.end:
+            return None
+        if self.xml:
+            start = audit.find_element_start(self.f, offset, SEEK_BLOCK)
+        elif offset == self.start:
+            start = offset
+        else:
+            # Skip the rest of the line the offset falls in
+            self.f.seek(offset - 1)
+            self.f.readline()
+            start = self.f.tell()
+        if start is None or start >= self.end:
+            return None
+        return start
+
+    # (type, id) of the element starting at start
+    def head(self, start):
+        self.f.seek(start)
+        if self.xml:
+            m = element_head.match(self.f.read(SEEK_BLOCK))
+            return m.group(1), int(m.group(2))
+        record = json.loads(self.f.readline())
+        return record['type'], int(record['id'])
+
+    # Raw text of the element starting at start, including the whitespace after it
+    def text(self, start):
+        if self.xml:
+            end = self.next_start(start + 1) or self.end
+            self.f.seek(start)
+            return self.f.read(end - start)
+        self.f.seek(start)
+        return self.f.readline()
+
+    # Node refs of a way, from its raw text
+    def node_refs(self, text):
+        if self.xml:
+            return [int(ref) for ref in node_ref.findall(text)]
+        return [int(ref) for ref in json.loads(text).get('node_refs', [])]
+
+    # Smallest offset in [lo, hi) whose next element is not before key, where key(type, id) gives a sort key
+    # Elements are in type then id order, so this is a binary search over byte offsets
+    def search(self, lo, hi, target, key):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self.next_start(mid)
+            if start is None or start >= hi or key(*self.head(start)) >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    # Byte range of each record type
+    def type_regions(self):
+        rank = lambda type, osm_id: TYPES.index(type) if type in TYPES else len(TYPES)
+        bounds = [self.start]
+        for i in range(1, len(TYPES)):
+            offset = self.search(bounds[-1], self.end, i, rank)
+            bounds.append(self.next_start(offset) or self.end)
+        bounds.append(self.end)
+        return dict((type, (bounds[i], bounds[i + 1])) for i, type in enumerate(TYPES))
+
+    # Offset of the element with an id within a region, or None if it isn't there
+    # The search range is first narrowed by doubling steps from the start of the region, which keeps searches
+    # short when ids are looked up in order and the start is moved up after each one
+    def find_id(self, region, osm_id):
+        key = lambda type, element_id: element_id
+        lo, hi = region
+        step = SEEK_BLOCK
+        while lo + step < hi:
+            start = self.next_start(lo + step)
+            if start is None or start >= region[1] or self.head(start)[1] >= osm_id:
+                hi = lo + step + 1
+                break
+            lo = start + 1
+            step *= 2
+        start = self.next_start(self.search(lo, hi, osm_id, key))
+        if start is not None and start < region[1] and self.head(start)[1] == osm_id:
+            return start
+        return None
+
+    # Parts of the file around the elements (XML declaration, root tag, bounds and the closing root tag)
+    def prolog(self):
+        self.f.seek(0)
+        return self.f.read(self.start)
+
+    def epilog(self):
+        self.f.seek(self.end)
+        return self.f.read()
+
+    def close(self):
+        self.f.close()
+
+# First element of a region at or after offset, wrapping around to the start of the region
+def element_after(source, region, offset):
+    start = source.next_start(offset)
+    if start is None or start >= region[1]:
+        return region[0]
+    return start
+
+# Picks about fraction of the elements of a region, one from each of a set of equal byte slices
+# Each pick seeks to a random offset within its slice and takes the next element, so the sample is spread over
+# the whole region.  Elements that follow long elements are a little more likely to be picked.
+def sample_region(source, region, fraction, rng):
+    lo, hi = region
+    if lo >= hi or fraction <= 0:
+        return []
+    # Estimate the number of elements from the average size of a few of them
+    sizes = [len(source.text(element_after(source, region, rng.randint(lo, hi - 1)))) for _ in range(SIZE_PROBES)]
+    picks = max(1, int(round(fraction * (hi - lo) / (sum(sizes) / float(len(sizes))))))
+    step = (hi - lo) / float(picks)
+    offsets = set()
+    for i in range(picks):
+        offsets.add(element_after(source, region, int(lo + (i + rng.random()) * step)))
+    return sorted(offsets)
+
+# Writes a sample of an OSM or JSON-lines file by seeking, without parsing the whole file
+# fractions sets the fraction for each type (stratified sampling), otherwise fraction is used for every type.
+# With complete_ways, the nodes of every sampled way are included too, found by binary search over the node ids.
+# The same seed always gives the same sample.  Returns the number of elements of each type in the sample
+def sample_file(file_in, file_out, fraction = FRACTION, fractions = None, complete_ways = True, seed = 0):
+    rng = random.Random(seed)
+    source = ElementFile(file_in)
+    try:
+        regions = source.type_regions()
+        chosen = {}
+        for type in TYPES:
+            chosen[type] = sample_region(source, regions[type], (fractions or {}).get(type, fraction), rng)
+        if complete_ways:
+            refs = set()
+            for start in chosen['way']:
+                refs.update(source.node_refs(source.text(start)))
+            nodes = set(chosen['node'])
+            lo, hi = regions['node']
+            # Looking the ids up in order lets each search start where the last one ended
+            for ref in sorted(refs):
+                start = source.find_id((lo, hi), ref)
+                if start is not None:
+                    nodes.add(start)
+                    lo = start
+            chosen['node'] = sorted(nodes)
+        with open(file_out, "wb") as fw:
+            fw.write(source.prolog())
+            for type in TYPES:
+                for start in chosen[type]:
+                    fw.write(source.text(start))
+            fw.write(source.epilog())
+    finally:
+        source.close()
+    return dict((type, len(chosen[type])) for type in TYPES)
+
+def main():
+    start = time.time()
+    pprint.pprint(sample_file(osm_file_full, osm_sample_file))
+    print("Sampled in {0:.2f}s".format(time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+
+# Values that repeat across records and are interned: created.user and created.uid, the low-cardinality address
+# fields and the top level tags with a small vocabulary.  Housenumbers, units and most names are close to unique,
+# so interning them would only grow the table.
+INTERNED_CREATED = ('user', 'uid')
+INTERNED_ADDRESS = ('street', 'city', 'province', 'state', 'country', 'postcode')
+INTERNED_KEYS = frozenset(['visible', 'created_by', 'source', 'amenity', 'highway', 'building', 'shop', 'cuisine', 'landuse',
+                     'natural', 'leisure', 'oneway', 'surface', 'type_tag', 'service', 'barrier', 'power'])
+
+# Dictionary encoding of repeated values for one run
+# Each distinct value gets one canonical object and a small integer code, in the order values are first seen.
+# A table is made by the run that uses it, such as one call of audit.process_map or clean.clean_json, and shared
+# by the parts of that run: the parser and the audit loaders intern the records they hold in it, and the columnar
+# writer stores its codes, so the table exported with a columnar output decodes that output (see columnar.py).
+class StringTable(object):
+    def __init__(self, values = None):
+        self.values = []
+        self.codes = {}
+        # Canonical object of each string, which intern looks values up in directly
+        self.canonical = {}
+        for value in values or []:
+            self.encode(value)
+
+    # Code of a value, adding it to the table if it's new
+    def encode(self, value):
+        key = value
+        if isinstance(value, (list, dict)):
+            # Lists and dictionaries can't be dictionary keys, so they are looked up by their JSON text
+            key = ('json', json.dumps(value, sort_keys=True))
+        code = self.codes.get(key)
+        if code is None:
+            code = len(self.values)
+            self.codes[key] = code
+            self.values.append(value)
+            if key is value:
+                self.canonical[value] = value
+        return code
+
+    # Code of a value, or None if it isn't in the table
+    def find(self, value):
+        return self.codes.get(value)
+
+    def decode(self, code):
+        return self.values[code]
+
+    # Canonical object for a value, so equal values share one string in memory
+    def intern(self, value):
+        try:
+            return self.canonical[value]
+        except KeyError:
+            self.encode(value)
+            return value
+
+    # Interns the repeated values of a shaped or loaded record in place and returns the record
+    def intern_record(self, record):
+        intern = self.intern
+        created = record.get('created')
+        if created:
+            for c in INTERNED_CREATED:
+                if c in created:
+                    created[c] = intern(created[c])
+        if 'address' in record:
+            self.intern_address(record['address'])
+        for key in INTERNED_KEYS.intersection(record.keys()):
+            record[key] = intern(record[key])
+        return record
+
+    def intern_address(self, address):
+        intern = self.intern
+        for field in INTERNED_ADDRESS:
+            if field in address:
+                address[field] = intern(address[field])
+
+    def __len__(self):
+        return len(self.values)
+
+    # Writes the table as a JSON list, where a value's position is its code
+    def export(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.values, f)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            return cls(json.load(f))
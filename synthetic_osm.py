@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+import calendar
+import codecs
+import random
+import time
+import pprint
+from xml.sax.saxutils import quoteattr
+
+# Share of the file's bytes taken by each record type, roughly as in the Vancouver extract
+TYPE_SHARES = [("node", 0.70), ("way", 0.29), ("relation", 0.01)]
+# Bounds of the generated positions, around Vancouver
+BOUNDS = (49.0, -123.3, 49.4, -122.4)
+# Top contributors and their record counts from the report, plus a long tail of occasional mappers
+TOP_USERS = [(u'mbiker_imports_and_more', 353007), (u'pdunn', 161782), (u'alexz', 156898), (u'pnorman', 133554),
+             (u'pnorman_mechanical', 130500), (u'WBSKI', 100491), (u'Adam Dunn', 92071), (u'SRW', 55128),
+             (u'woodpeck_fixbot', 51746), (u'alester', 42361)]
+TAIL_USERS = 951
+TAIL_RECORDS = 514296
+# Elements written at a time
+WRITE_BATCH = 100
+
+# Address values, in rough proportion to how often each form shows up.  The messy ones are the
+# variants listed in the report and handled by clean.py.
+HOUSENUMBERS = [(u'{n}', 90), (u' {n}', 1), (u'#{u}-{n}', 2), (u'#{u} {n}', 1), (u'{u}-{n}', 2), (u'{u}A-{n}', 1),
+                (u'{u} - {n} ', 1), (u'{n}, Suite {u}-{n}', 1), (u'{u} {n}', 1), (u'{n};{n}', 1), (u'{n}, #{u}', 1),
+                (u'U{u} {n}', 1), (u'Suite {u}, {n}', 1), (u'Unit {u} -{n}', 1), (u'Studio {u} {n}', 1),
+                (u'{n} #{u}', 1), (u'{u} – {n}', 1), (u'unit: #{u} {n}', 1), (u'SUITE {u}B {n}', 1),
+                (u'201 City Square, 555', 1)]
+POSTCODES = [(u'V{d}{l} {d}{l}{d}', 85), (u'v{d}{l} {d}{l}{d}', 3), (u'V{d}{l}{d}{l}{d}', 8), (u'982{d}{d}', 4)]
+STREETS = [(u'Main Street', 20), (u'Kingsway', 10), (u'West 4th Avenue', 10), (u'Hastings St', 5),
+           (u'Commercial Dr', 4), (u'Oak St.', 3), (u'Granville St', 3), (u'Hamilton', 3), (u'Davie', 2),
+           (u'Kingsway Ave', 2), (u'main street', 1), (u'e Broadway', 1), (u'41st Ave. W', 1),
+           (u'Hastings St E', 1), (u'King George Hwy', 1), (u'ing George Hwy.', 1), (u'Fraser Streettt', 1),
+           (u'Robson', 1), (u'Cambie', 1)]
+CITIES = [(u'Vancouver', 60), (u'Burnaby', 15), (u'Surrey', 15), (u'vancouver', 4), (u'Vancouver, BC', 3),
+          (u'Burnaby, B.C.', 1), (u'Seattle, WA', 1), (u'Point Roberts, WA', 1)]
+PROVINCES = [(u'BC', 60), (u'British Columbia', 20), (u'bc', 5), (u'british columbia', 5), (u'Bc', 5),
+             (u'British columbia', 3), (u'WA', 2)]
+STATES = [(u'BC', 70), (u'WA', 30)]
+COUNTRIES = [(u'CA', 70), (u'Canada', 15), (u'canada', 5), (u'Ca', 5), (u'US', 5)]
+UNITS = [(u'{u}', 70), (u'Suite {u}', 30)]
+HOUSENAMES = [(u'Point Grey Manor', 60), (u'#{u}', 40)]
+# Share of nodes with each address field.  Most nodes have no tags at all.
+ADDRESS_SHARE = 0.05
+ADDRESS_FIELDS = [('street', 0.95, STREETS), ('housenumber', 0.95, HOUSENUMBERS), ('postcode', 0.5, POSTCODES),
+                  ('city', 0.1, CITIES), ('province', 0.1, PROVINCES), ('state', 0.02, STATES),
+                  ('country', 0.05, COUNTRIES), ('unit', 0.05, UNITS), ('housename', 0.02, HOUSENAMES)]
+# Other tags, with the share of tagged nodes and ways that have them
+NODE_TAG_SHARE = 0.10
+NODE_TAGS = [('amenity', 0.3, [(u'restaurant', 5), (u'cafe', 3), (u'bench', 3), (u'parking', 2), (u'school', 1)]),
+             ('name', 0.4, [(u'Tim Hortons', 3), (u'Starbucks', 3), (u'Caf\xe9 Artigiano', 1), (u'A & W', 1)]),
+             ('highway', 0.3, [(u'crossing', 5), (u'traffic_signals', 3), (u'bus_stop', 3), (u'stop', 1)]),
+             ('created_by', 0.1, [(u'JOSM', 5), (u'Potlatch 0.10f', 3), (u'Merkaartor 0.12', 1)]),
+             ('source', 0.2, [(u'Bing', 5), (u'survey', 2), (u'CanVec 6.0 - NRCan', 3)]),
+             ('type', 0.01, [(u'broad_leaved', 1), (u'street_lamp', 1)]),
+             ('name:en', 0.02, [(u'Chinatown', 1)]),
+             ('addr:street:name', 0.005, [(u'Main', 1)]),
+             ('bad key', 0.001, [(u'x', 1)]),
+             ('fixme', 0.01, [(u'', 1), (u'check position', 2)])]
+WAY_TAGS = [('highway', 0.6, [(u'residential', 10), (u'service', 6), (u'footway', 4), (u'primary', 1)]),
+            ('building', 0.35, [(u'yes', 10), (u'house', 3), (u'apartments', 1)]),
+            ('name', 0.3, [(u'Main Street', 3), (u'Kingsway', 2), (u'Stanley Park Drive', 1)]),
+            ('source', 0.2, [(u'Bing', 5), (u'CanVec 6.0 - NRCan', 3)]),
+            ('oneway', 0.1, [(u'yes', 3), (u'no', 1)]),
+            ('created_by', 0.02, [(u'JOSM', 1)]),
+            ('type', 0.002, [(u'multipolygon', 1)])]
+WAY_ADDRESS_SHARE = 0.08
+WAY_NODES = (2, 12)
+RELATION_MEMBERS = (2, 8)
+
+# Files
+synthetic_file = './vancouver.osm/synthetic.osm'
+
+# Picks a weighted choice from a list of (value, weight)
+class WeightedChoice(object):
+    def __init__(self, choices):
+        self.values = [value for value, weight in choices]
+        self.totals = []
+        total = 0
+        for value, weight in choices:
+            total += weight
+            self.totals.append(total)
+
+    def pick(self, rng):
+        x = rng.random() * self.totals[-1]
+        lo, hi = 0, len(self.totals)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.totals[mid] <= x:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.values[lo]
+
+# Fills the {n} (housenumber), {u} (unit), {d} (digit) and {l} (letter) placeholders of a template
+def fill_template(template, rng):
+    if '{' not in template:
+        return template
+    return template.format(n=rng.randint(100, 20999), u=rng.randint(1, 2400),
+                           d=rng.randint(0, 9), l=rng.choice(u'ABCEGHJKLMNPRSTVXY'))
+
+# Writes the XML of OSM elements with random but realistic content
+class OsmGenerator(object):
+    def __init__(self, seed = 0):
+        self.rng = random.Random(seed)
+        users = TOP_USERS + [(u'mapper_{0}'.format(i), TAIL_RECORDS // TAIL_USERS) for i in range(TAIL_USERS)]
+        self.user_ids = dict((user, 1000 + i) for i, (user, _) in enumerate(users))
+        self.users = WeightedChoice(users)
+        self.address_fields = [(field, share, WeightedChoice(values)) for field, share, values in ADDRESS_FIELDS]
+        self.node_tags = [(k, share, WeightedChoice(values)) for k, share, values in NODE_TAGS]
+        self.way_tags = [(k, share, WeightedChoice(values)) for k, share, values in WAY_TAGS]
+        self.timestamp = calendar.timegm((2008, 1, 1, 0, 0, 0))
+        self.nodes = 0
+        self.ways = 0
+        self.relations = 0
+
+    def attributes(self, osm_id):
+        rng = self.rng
+        user = self.users.pick(rng)
+        stamp = time.gmtime(self.timestamp + rng.randint(0, 8 * 365 * 86400))
+        return u' id="{0}" visible="true" version="{1}" changeset="{2}" timestamp="{3}" user={4} uid="{5}"'.format(
+            osm_id, rng.randint(1, 12), rng.randint(100000, 40000000), time.strftime('%Y-%m-%dT%H:%M:%SZ', stamp),
+            quoteattr(user), self.user_ids[user])
+
+    def tags(self, tags):
+        return [u'  <tag k={0} v={1}/>\n'.format(quoteattr(k), quoteattr(v)) for k, v in tags]
+
+    def choose_tags(self, choices):
+        return [(k, fill_template(values.pick(self.rng), self.rng))
+                for k, share, values in choices if self.rng.random() < share]
+
+    def address(self):
+        return [('addr:' + field, fill_template(values.pick(self.rng), self.rng))
+                for field, share, values in self.address_fields if self.rng.random() < share]
+
+    def node(self):
+        rng = self.rng
+        self.nodes += 1
+        head = u' <node{0} lat="{1:.7f}" lon="{2:.7f}"'.format(self.attributes(self.nodes),
+                                                            rng.uniform(BOUNDS[0], BOUNDS[2]),
+                                                            rng.uniform(BOUNDS[1], BOUNDS[3]))
+        tags = []
+        if rng.random() < ADDRESS_SHARE:
+            tags.extend(self.address())
+        if rng.random() < NODE_TAG_SHARE:
+            tags.extend(self.choose_tags(self.node_tags))
+        if not tags:
+            return head + u'/>\n'
+        return head + u'>\n' + u''.join(self.tags(tags)) + u' </node>\n'
+
+    def way(self):
+        rng = self.rng
+        self.ways += 1
+        lines = [u' <way{0}>\n'.format(self.attributes(self.ways))]
+        # Ways mostly use nodes that are close together in id order
+        first = rng.randint(1, self.nodes)
+        refs = [min(self.nodes, first + i) for i in range(rng.randint(*WAY_NODES))]
+        if rng.random() < 0.2:
+            refs.append(refs[0])
+        lines.extend([u'  <nd ref="{0}"/>\n'.format(ref) for ref in refs])
+        tags = self.choose_tags(self.way_tags)
+        if rng.random() < WAY_ADDRESS_SHARE:
+            tags.extend(self.address())
+        lines.extend(self.tags(tags))
+        lines.append(u' </way>\n')
+        return u''.join(lines)
+
+    def relation(self):
+        rng = self.rng
+        self.relations += 1
+        lines = [u' <relation{0}>\n'.format(self.attributes(self.relations))]
+        for i in range(rng.randint(*RELATION_MEMBERS)):
+            if self.ways and rng.random() < 0.8:
+                lines.append(u'  <member type="way" ref="{0}" role="{1}"/>\n'.format(
+                    rng.randint(1, self.ways), u'outer' if i == 0 else rng.choice([u'outer', u'inner', u''])))
+            else:
+                lines.append(u'  <member type="node" ref="{0}" role=""/>\n'.format(rng.randint(1, self.nodes)))
+        type_tag = rng.choice([u'multipolygon', u'route', u'boundary', u'restriction'])
+        lines.extend(self.tags([('type', type_tag), ('name', u'Relation {0}'.format(self.relations))]))
+        lines.append(u' </relation>\n')
+        return u''.join(lines)
+
+# Writes a synthetic OSM XML file of about size_bytes bytes
+# Nodes, ways and relations take the shares of the file in TYPE_SHARES, in the order OSM files list them.  Tag
+# values are drawn from the distributions above, with the messy address formats mixed in, and the same seed
+# always gives the same file.  Returns the number of elements of each type.
+def generate_osm(file_out, size_bytes, seed = 0):
+    generator = OsmGenerator(seed)
+    makers = {"node": generator.node, "way": generator.way, "relation": generator.relation}
+    with codecs.open(file_out, "w", encoding="utf-8") as fw:
+        fw.write(u'<?xml version="1.0" encoding="UTF-8"?>\n')
+        fw.write(u'<osm version="0.6" generator="synthetic_osm.py">\n')
+        fw.write(u' <bounds minlat="{0}" minlon="{1}" maxlat="{2}" maxlon="{3}"/>\n'.format(*BOUNDS))
+        limit = 0
+        for type, share in TYPE_SHARES:
+            limit += share * size_bytes
+            # Ways and relations need at least one node to refer to
+            while fw.tell() < limit or (type == "node" and generator.nodes == 0):
+                fw.write(u''.join([makers[type]() for _ in range(WRITE_BATCH)]))
+        fw.write(u'</osm>\n')
+    return {'node': generator.nodes, 'way': generator.ways, 'relation': generator.relations}
+
+def main():
+    start = time.time()
+    pprint.pprint(generate_osm(synthetic_file, 10 * 1024 * 1024))
+    print("Generated in {0:.2f}s".format(time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import re
+
+# Regexes used to check the k value of a <tag>
+lower = re.compile(r'^([a-z]|_)*$')
+lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
+problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
+
+# What shape_element does with a tag, depending on its key
+DROP = 'drop'
+ADDRESS = 'address'
+KEY = 'key'
+RENAMED = 'renamed'
+
+# Number of distinct keys remembered.  Files have a few thousand distinct keys, so this is only a guard against
+# files with unusual numbers of them.
+KEY_CACHE_SIZE = 100000
+
+# Classification of each key seen so far, as (category, action, name)
+key_cache = {}
+
+# Classifies a tag key with the regexes
+# category is the key's category in Lesson6_Quiz3 ('lower', 'lower_colon', 'problemchars' or 'other').  action is
+# one of DROP, ADDRESS (name is the address field), KEY (name is the key) or RENAMED (name is the new key).
+def classify_key_uncached(k):
+    # Categories are checked in the order Lesson6_Quiz3 checks them
+    if lower.search(k):
+        category = 'lower'
+    elif lower_colon.search(k):
+        category = 'lower_colon'
+    elif problemchars.search(k):
+        category = 'problemchars'
+    else:
+        category = 'other'
+    # shape_element checks for problem characters first.  $ also matches before a trailing newline, so a key such
+    # as "name\n" is in the 'lower' category but is still dropped.
+    if category in ('problemchars', 'other') or problemchars.search(k):
+        return (category, DROP, None)
+    if category == 'lower':
+        # Rename the key "type" so that it doesn't overwrite our node['type'] value
+        if k == "type":
+            return (category, RENAMED, k + "_tag")
+        return (category, KEY, k)
+    # Split by colon
+    prefix, field = k.split(':')
+    if prefix == 'addr':
+        return (category, ADDRESS, field)
+    return (category, KEY, k)
+
+# Classifies a tag key, running the regexes only the first time each key is seen
+def classify_key(k):
+    try:
+        return key_cache[k]
+    except KeyError:
+        classification = classify_key_uncached(k)
+        if len(key_cache) < KEY_CACHE_SIZE:
+            key_cache[k] = classification
+        return classification
+
+def test():
+    assert classify_key('name') == ('lower', KEY, 'name')
+    assert classify_key('type') == ('lower', RENAMED, 'type_tag')
+    assert classify_key('addr:street') == ('lower_colon', ADDRESS, 'street')
+    assert classify_key('name:en') == ('lower_colon', KEY, 'name:en')
+    assert classify_key('addr street') == ('problemchars', DROP, None)
+    assert classify_key('FIXME') == ('other', DROP, None)
+    # Keys ending in a newline (&#10; in the XML) match lower and lower_colon, but have a problem character
+    assert classify_key('name\n') == ('lower', DROP, None)
+    assert classify_key('addr:street\n') == ('lower_colon', DROP, None)